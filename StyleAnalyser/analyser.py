@@ -5,20 +5,32 @@ Created on Tue Nov 12 14:32:54 2019
 @author: Carlos Moreno Morera
 """
 from __future__ import print_function
+import queue
+import threading
 import quotaunits as qu
 from extraction.messageextractor import MessageExtractor
 from extraction.threadextractor import ThreadExtractor
+from extraction.adaptiveextractor import AdaptiveExtractor
+from extraction.mailboxextractor import MailboxExtractor
+from extraction.imapextractor import ImapExtractor
 import confanalyser as cfa
-import requests
 from extraction.extractedmessage import ExtractedMessage
 import json
-from initdb import init_db
+from initdb import init_db, DB_NAME
 from preprocess.preprocessedmessage import PreprocessedMessage
 from typocorrection.typocode import TypoCode
 from typocorrection.correctedmessage import CorrectedMessage
 from sessiontypoerror import SessionTypoError
 from math import ceil
-# from stylemeasuring.metrics import Metrics
+from extraction.checkpoint import ExtractionCheckpoint
+from extraction.quotausage import QuotaUsage
+from pipelinelog import get_logger, timed
+from stageclients import get_stages, STATUS_OK
+from streaming import StageWorkers, STOP
+from stagebatch import chunked
+from stylemeasuring.metrics import Metrics
+
+log = get_logger('analyser')
 
 def yes_no_question(question):
         """
@@ -58,13 +70,26 @@ class Analyser:
         remaining quota units available to carry out the extraction operations.
     __extractor: Extractor
         Object which performs the task of extracting sent messages 
-        or sent threads from the user by accessing Gmail API.
+        or sent threads from the user by accessing Gmail API. It is None if
+        there are not enough quota units to extract (the stored messages are
+        analysed anyway).
     __nres: int
         Number of the resource that is going to be extracted (messages or threads).
+    __next_page: str
+        Page token from which the extraction continues if it is resumed from
+        a checkpoint.
+    __stages: LocalStages or HttpStages
+        Client of the stages of the analysis (preprocessor, typographic
+        corrector and style meter).
+    __results_lock: threading.Lock
+        Lock of the file where the identifiers of the measured messages are
+        written (the style meter may have several workers).
             
     """
     def __init__(self, service, usu, quota = qu.QUOTA_UNITS_PER_DAY, ext_msg = None,
-                 num_extracted = None):
+                 num_extracted = None, http_factory = None, mailbox = None,
+                 imap = None, async_factory = None, db_name = DB_NAME,
+                 stages = None):
         """
         Class constructor.
 
@@ -79,10 +104,35 @@ class Analyser:
             is qu.QUOTA_UNITS_PER_DAY.
         ext_msg: bool, optional
             Indicates whether there were a previous extraction and whether it
-            extracts messages or threads. The default is None.
+            extracts messages or threads. The default is None, which means that
+            it is obtained from the checkpoint of an unfinished extraction (if
+            there is one).
         num_extracted: int, optional
             If it was an extraction before, it indicates the number of resources
             extracted last time. The default is None.
+        http_factory: function, optional
+            Function that creates an authorized http object for each fetch
+            worker of the extractor. If it is None, the resources are not
+            fetched concurrently. The default is None.
+        mailbox: str, optional
+            Path of a mailbox export (mbox file or Maildir directory) from
+            which the messages are extracted instead of Gmail API. The default
+            is None.
+        imap: tuple, optional
+            Email address and password of an IMAP account from whose folder of
+            sent messages the messages are extracted instead of Gmail API. The
+            default is None.
+        async_factory: function, optional
+            Function that creates the asynchronous Gmail API client. If it is
+            not None, the resources are fetched by the asynchronous engine. The
+            default is None.
+        db_name: str, optional
+            Database where the messages of the user are stored. The default is
+            DB_NAME.
+        stages: LocalStages or HttpStages, optional
+            Client of the stages of the analysis. The default is None, which
+            means that it is chosen by cfa.IN_PROCESS_STAGES when the messages
+            are analysed.
 
         Returns
         -------
@@ -92,34 +142,106 @@ class Analyser:
         self.__service = service
         self.__user_name = usu
         self.__quota = quota
+        self.__next_page = None
+        self.__stages = stages
+        self.__results_lock = threading.Lock()
+        
+        init_db(db_name)
+        cp = None
+        if mailbox is None and imap is None:
+            cp = ExtractionCheckpoint.objects(user_name = usu, finished = False).first()
+        if ext_msg is None and cp is not None:
+            ext_msg = cp.extractor == 'messages'
+            num_extracted = cp.extracted
+            self.__quota = cp.get_remaining_quota()
+            self.__next_page = cp.pageToken
+            log.info('resuming extraction', extra = {
+                'user' : usu, 'checkpoint' : cp.checkpoint_id,
+                'extracted' : num_extracted, 'quota' : self.__quota})
+        if mailbox is None and imap is None:
+            # The quota units consumed today by previous executions count
+            usage = QuotaUsage.objects(user_name = usu).first()
+            if usage is not None:
+                self.__quota = min(self.__quota, usage.get_remaining_quota())
         
-        if (self.__quota > qu.LABELS_GET):
+        if mailbox is not None:
+            log.info('extractor selected', extra = {'user' : usu,
+                                                    'extractor' : 'mailbox',
+                                                    'path' : mailbox})
+            self.__extractor = MailboxExtractor(mailbox, self.__user_name,
+                                                cfa.NUM_PARSE_WORKERS)
+            self.__nres = None
+        elif imap is not None:
+            log.info('extractor selected', extra = {'user' : usu,
+                                                    'extractor' : 'imap'})
+            self.__extractor = ImapExtractor(self.__user_name, imap[0], imap[1],
+                                             num_workers = cfa.NUM_PARSE_WORKERS)
+            self.__nres = None
+        elif (self.__quota > qu.LABELS_GET):
             self.__extractor = None
+            num_workers = cfa.NUM_FETCH_WORKERS if http_factory is not None else 0
             
             l = self.__service.users().labels()
             sent_lb = l.get(userId = 'me', id = 'SENT').execute()
             self.__nres = sent_lb['messagesTotal']
             self.__quota -= qu.LABELS_GET
 
-            cost_msg_ext = self.__get_res_cost(qu.MSG_LIST, sent_lb['messagesTotal'], 
-                                               qu.MSG_GET)
-            cost_thrd_ext = self.__get_res_cost(qu.THREADS_LIST, sent_lb['threadsTotal'], 
-                                                qu.THREADS_GET)
-
-            if (((ext_msg is None) and cost_msg_ext <= cost_thrd_ext) or ext_msg):
-                with open('log.txt', 'a') as f:
-                    f.write('Message extractor has been selected.\n')
+            if cfa.ADAPTIVE_EXTRACTION and not(ext_msg is False):
+                # It chooses between messages and threads for each thread
+                log.info('extractor selected', extra = {'user' : usu,
+                                                        'extractor' : 'adaptive'})
+                self.__extractor = AdaptiveExtractor(self.__service, self.__user_name,
+                                                     self.__quota, cfa.BATCH_EXTRACTION,
+                                                     num_workers = num_workers,
+                                                     http_factory = http_factory,
+                                                     async_factory = async_factory)
+            elif ext_msg or (ext_msg is None and self.__is_msg_ext_cheaper(sent_lb)):
+                log.info('extractor selected', extra = {'user' : usu,
+                                                        'extractor' : 'messages'})
                 self.__extractor = MessageExtractor(self.__service, self.__user_name, 
-                                                  self.__quota)
+                                                  self.__quota, cfa.BATCH_EXTRACTION,
+                                                  num_workers = num_workers,
+                                                  http_factory = http_factory,
+                                                  async_factory = async_factory)
             else:
-                with open('log.txt', 'a') as f:
-                    f.write('Thread extractor has been selected.\n')
+                log.info('extractor selected', extra = {'user' : usu,
+                                                        'extractor' : 'threads'})
                 self.__extractor = ThreadExtractor(self.__service, self.__user_name,
-                                                 self.__quota)
+                                                 self.__quota, cfa.BATCH_EXTRACTION,
+                                                 num_workers = num_workers,
+                                                 http_factory = http_factory,
+                                                 async_factory = async_factory)
                 self.__nres = sent_lb['threadsTotal']
                 
             if ext_msg is not None:
                 self.__nres -= num_extracted
+        else:
+            # The quota units of a resumed extraction may have been consumed
+            log.warning('quota exhausted', extra = {'user' : usu,
+                                                    'quota' : self.__quota})
+            self.__extractor = None
+            self.__nres = None
+
+    def __is_msg_ext_cheaper(self, sent_lb):
+        """
+        Checks whether extracting the sent messages one by one costs less quota
+        units than extracting the sent threads.
+
+        Parameters
+        ----------
+        sent_lb: dict
+            Gmail API users.labels resource of the SENT label.
+
+        Returns
+        -------
+        bool: True if the extraction of messages is not more expensive.
+
+        """
+        cost_msg_ext = self.__get_res_cost(qu.MSG_LIST, sent_lb['messagesTotal'], 
+                                           qu.MSG_GET)
+        cost_thrd_ext = self.__get_res_cost(qu.THREADS_LIST, sent_lb['threadsTotal'], 
+                                            qu.THREADS_GET)
+        return cost_msg_ext <= cost_thrd_ext
 
     def __get_res_cost(self, listcost, numres, getcost):
         """
@@ -141,28 +263,33 @@ class Analyser:
         """
         return listcost * ceil(numres / cfa.NUM_RESOURCE_PER_LIST) + getcost * numres
     
-    def __preprocess_message(self, ext_msg, sign):
+    def __preprocess_messages(self, ext_msgs, sign):
         """
-        Preprocess the extracted message which has the given identifier.
+        Preprocess the given extracted messages in a single call to the
+        preprocessor.
 
         Parameters
         ----------
-        ext_msg : str
-            Extracted message which is going to be preprocessed in json format.
+        ext_msgs : list
+            Extracted messages which are going to be preprocessed.
         sign : str
             Signature of the user in his emails.
 
         Returns
         -------
-        None.
+        list: identifiers of the messages which have been preprocessed.
 
         """
-        ext_msg = json.loads(ext_msg)
-        response = requests.post(cfa.URL_PREP, json = {'message' : ext_msg,
-                                              'sign': sign})
-        if response.status_code != 200:
-            with open('logerror.txt', 'a') as f:
-                f.write(f"Preprocess error of {ext_msg['_id']}.\n")
+        with timed(log, 'preprocess batch', size = len(ext_msgs)) as fields:
+            results = self.__stages.preprocess_batch(ext_msgs, sign)
+            fields['failed'] = sum(st != STATUS_OK for st, _ in results)
+        prep_ids = []
+        for ext_msg, (status, resp_dic) in zip(ext_msgs, results):
+            if status != STATUS_OK:
+                log.error('preprocess error', extra = {'msg_id' : ext_msg['_id']})
+            elif resp_dic['id'] is not None:
+                prep_ids.append(resp_dic['id'])
+        return prep_ids
                 
     def __req_verified_answer(self, question):
         """
@@ -316,10 +443,8 @@ class Analyser:
                 ling_feat['is_stop'] = yes_no_question('Is a stop word?')
 
                 if (yes_no_question(cfa.SAVE_OOV)):
-                    response = requests.post(cfa.URL_TYPO_SAVE, json = ling_feat)
-                    if response.status_code != 200:
-                        with open('logerror.txt', 'a') as f:
-                            f.write(f"Save-oov error with {ling_feat['text']}.\n")
+                    if self.__stages.save_oov(ling_feat) != STATUS_OK:
+                        log.error('save-oov error', extra = {'text' : ling_feat['text']})
             
             if yes_no_question("Do you want to save this information for this session?"):
                 ses = SessionTypoError()
@@ -400,47 +525,48 @@ class Analyser:
                                               token_idx)
         return ind
     
-    def __correct_message(self, prep_msg):
+    def __correct_message(self, prep_msg, first = None):
         """
         Corrects the typographic errors of the preprocessed message which has
         the given identifier.
         
         Parameters
         ----------
-        prep_msg : str
+        prep_msg : dict
             Preprocessed message which is going to be corrected.
+        first : tuple, optional
+            Status and result of the first call to the typographic corrector
+            if it has already been made (see __auto_correct). The default is
+            None.
 
         Returns
         -------
         None.
         
         """
-        prep_msg = json.loads(prep_msg)
-        response = requests.post(cfa.URL_TYPO_CORRECT, json = {
-                                                    'message' : prep_msg,
-                                                    'index' : 0})
-        if response.status_code != 200:
-            with open('logerror.txt', 'a') as f:
-                f.write(f"Typo-correction error of {prep_msg['_id']}.\n")
+        if first is None:
+            with timed(log, 'typo-correction', msg_id = prep_msg['_id']) as fields:
+                status, resp_dic = self.__stages.correct(prep_msg, 0)
+                fields['status'] = status
+        else:
+            status, resp_dic = first
+        if status != STATUS_OK:
+            log.error('typo-correction error', extra = {'msg_id' : prep_msg['_id']})
         else:
-            resp_dic = json.loads(response.content)
-            
             tyer = SessionTypoError.objects(text = resp_dic['typoError']).first()
-            while (response.status_code == 200 and
+            while (status == STATUS_OK and
                    resp_dic['typoCode'] == TypoCode.typoFound.name and
                    (tyer is not None)):
                 prep_msg = resp_dic['message']
                 ind = self.__solve_with_session_error(tyer, resp_dic['index'], 
                                                 prep_msg, resp_dic['typoError'],
                                                 resp_dic['token_idx'])
-                response = requests.post(cfa.URL_TYPO_CORRECT, json = {
-                                                    'message' : prep_msg,
-                                                    'index' : ind})
-                if response.status_code == 200:
-                    resp_dic = json.loads(response.content)
+                status, result = self.__stages.correct(prep_msg, ind)
+                if status == STATUS_OK:
+                    resp_dic = result
             
             discard = False
-            if (response.status_code == 200 and 
+            if (status == STATUS_OK and 
                 resp_dic['typoCode'] == TypoCode.typoFound.name):
                 print(f"Typographic error found in {prep_msg['_id']}.")
                 print('This is the text:\n\n')
@@ -448,49 +574,313 @@ class Analyser:
                 discard = yes_no_question(cfa.DISC_MSG)
                 
             if not(discard):
-                while (response.status_code == 200 and 
+                while (status == STATUS_OK and 
                        resp_dic['typoCode'] == TypoCode.typoFound.name):
                     prep_msg = resp_dic['message']
                     ind = self.__correct_token(resp_dic['index'], prep_msg, 
                                          resp_dic['typoError'], resp_dic['token_idx'])
                     
-                    response = requests.post(cfa.URL_TYPO_CORRECT, json = {
-                                                        'message' : prep_msg,
-                                                        'index' : ind})
-                    if response.status_code == 200:
-                        resp_dic = json.loads(response.content)
+                    status, result = self.__stages.correct(prep_msg, ind)
+                    if status == STATUS_OK:
+                        resp_dic = result
                 
-                if response.status_code != 200:
-                    with open('logerror.txt', 'a') as f:
-                        f.write(f"Typo-correction error of {prep_msg['id']}.\n")
+                if status != STATUS_OK:
+                    log.error('typo-correction error', extra = {'msg_id' : prep_msg['_id']})
+                        
+    def __auto_correct(self, prep_msgs):
+        """
+        Corrects the typographic errors of the given preprocessed messages
+        from their first token in a single call to the typographic corrector.
+
+        Parameters
+        ----------
+        prep_msgs : list
+            Preprocessed messages which are going to be corrected.
+
+        Returns
+        -------
+        corrected : list
+            Identifiers of the messages which have been corrected.
+        pending : list
+            Tuples (message, (status, result)) of the messages whose
+            typographic errors need the user (see __correct_message).
+
+        """
+        with timed(log, 'typo-correction batch', size = len(prep_msgs)) as fields:
+            results = self.__stages.correct_batch(prep_msgs)
+            fields['failed'] = sum(st != STATUS_OK for st, _ in results)
+        corrected = []
+        pending = []
+        for prep_msg, (status, resp_dic) in zip(prep_msgs, results):
+            if status != STATUS_OK:
+                log.error('typo-correction error', extra = {'msg_id' : prep_msg['_id']})
+            elif resp_dic['typoCode'] == TypoCode.typoFound.name:
+                pending.append((prep_msg, (status, resp_dic)))
+            elif resp_dic['typoCode'] == TypoCode.successful.name:
+                corrected.append(prep_msg['_id'])
+        return corrected, pending
                         
-    def __measure_style(self, cor_msg):
+    def __measure_styles(self, cor_msgs):
         """
-        Measures the writting style of the message with the given identifier.
+        Measures the writting style of the given messages in a single call to
+        the style meter.
 
         Parameters
         ----------
-        cor_msg : str
-            Message which is going to be analysed.
+        cor_msgs : list
+            Messages which are going to be analysed.
 
         Returns
         -------
         None.
 
         """
-        cor_msg = json.loads(cor_msg)
-        response = requests.post(cfa.URL_MET, json = {'message' : cor_msg})
+        with timed(log, 'style measuring batch', size = len(cor_msgs)) as fields:
+            results = self.__stages.measure_batch(cor_msgs)
+            fields['failed'] = sum(st != STATUS_OK for st, _ in results)
         
-        if response.status_code != 200:
-            with open('logerror.txt', 'a') as f:
-                f.write(f"Metrics error with {cor_msg['_id']}.\n")
-                
-        else:
-            response_dic = json.loads(response.content)
-            if response_dic['id'] is not None:
-                with open(self.__user_name + '.txt', 'a') as f:
-                    f.write(f"{response_dic['id']}\n")
+        met_ids = []
+        for cor_msg, (status, response_dic) in zip(cor_msgs, results):
+            if status != STATUS_OK:
+                log.error('metrics error', extra = {'msg_id' : cor_msg['_id']})
+            elif response_dic['id'] is not None:
+                met_ids.append(response_dic['id'])
+        
+        if met_ids:
+            with self.__results_lock, open(self.__user_name + '.txt', 'a') as f:
+                f.writelines(f'{met_id}\n' for met_id in met_ids)
     
+    def __preprocess_streamed(self, ext_msgs, sign):
+        """
+        Preprocesses the given extracted messages in the streaming pipeline.
+
+        Parameters
+        ----------
+        ext_msgs : list
+            Extracted messages which are going to be preprocessed.
+        sign : str
+            Signature of the user in his emails.
+
+        Returns
+        -------
+        list: preprocessed messages (the ones which have not been preprocessed
+        because of an error or because they have no body are not included).
+
+        """
+        prep_ids = self.__preprocess_messages(ext_msgs, sign)
+        if not(prep_ids):
+            return []
+        return [prep.to_message() for prep in
+                PreprocessedMessage.objects(msg_id__in = prep_ids)]
+
+    def __correct_streamed(self, prep_msgs, interactive):
+        """
+        Corrects the given preprocessed messages in the streaming pipeline.
+        The messages with typographic errors are passed to the given queue,
+        so the user is asked about them in the main thread.
+
+        Parameters
+        ----------
+        prep_msgs : list
+            Preprocessed messages which are going to be corrected.
+        interactive : queue.Queue
+            Queue of the messages whose correction needs the user.
+
+        Returns
+        -------
+        list: corrected messages.
+
+        """
+        corrected, pending = self.__auto_correct(prep_msgs)
+        for item in pending:
+            interactive.put(item)
+        if not(corrected):
+            return []
+        return [cor.to_message() for cor in
+                CorrectedMessage.objects(msg_id__in = corrected)]
+
+    def __get_corrected(self, msg_id):
+        """
+        Obtains the corrected message with the given identifier.
+
+        Parameters
+        ----------
+        msg_id : str
+            Identifier of the message.
+
+        Returns
+        -------
+        dict: corrected message. It is None if it has not been stored.
+
+        """
+        cor = CorrectedMessage.objects(msg_id = msg_id).first()
+        return None if cor is None else cor.to_message()
+
+    def __get_backlog(self):
+        """
+        Obtains the identifiers of the messages of previous analyses which
+        have not finished every stage.
+
+        Returns
+        -------
+        ext_ids : set
+            Extracted messages which have not been preprocessed.
+        prep_ids : set
+            Preprocessed messages which have not been corrected.
+        cor_ids : set
+            Corrected messages which have not been measured.
+
+        """
+        ext = set(ExtractedMessage.objects().scalar('msg_id'))
+        prep = set(PreprocessedMessage.objects().scalar('msg_id'))
+        cor = set(CorrectedMessage.objects().scalar('msg_id'))
+        met = set(Metrics.objects().scalar('msg_id'))
+        return ext - prep, prep - cor, cor - met
+
+    def __feed_backlog(self, backlog, prep_stage, cor_stage, met_stage):
+        """
+        Puts the messages of previous analyses which have not finished every
+        stage in the stage where they stopped.
+
+        Parameters
+        ----------
+        backlog : tuple
+            Result of __get_backlog.
+        prep_stage : StageWorkers
+            Preprocessing stage.
+        cor_stage : StageWorkers
+            Typographic correction stage.
+        met_stage : StageWorkers
+            Style measuring stage.
+
+        Returns
+        -------
+        None.
+
+        """
+        ext_ids, prep_ids, cor_ids = backlog
+        for doc, ids, stage in ((CorrectedMessage, cor_ids, met_stage),
+                                (PreprocessedMessage, prep_ids, cor_stage),
+                                (ExtractedMessage, ext_ids, prep_stage)):
+            if ids:
+                for msg in doc.objects(msg_id__in = list(ids)):
+                    stage.put(msg.to_message())
+
+    def __analyse_streaming(self, nextPageToken, sign):
+        """
+        Analyses the messages of the user while they are being extracted. Each
+        message flows through the bounded queues of the stages of the analysis
+        (see StageWorkers), so the extraction and the stages overlap. The
+        messages whose typographic errors need the user are corrected in the
+        main thread.
+
+        Parameters
+        ----------
+        nextPageToken: str
+            Token of the next page for extracting messages.
+        sign: str
+            Signature of the user in his emails.
+
+        Returns
+        -------
+        None.
+
+        """
+        interactive = queue.Queue(cfa.PIPELINE_QUEUE_SIZE)
+        met_stage = StageWorkers('style measuring', self.__measure_styles,
+                                 cfa.MEASURE_WORKERS, cfa.PIPELINE_QUEUE_SIZE,
+                                 batch_size = cfa.STAGE_BATCH_SIZE)
+        cor_stage = StageWorkers('typo-correction',
+                                 lambda m: self.__correct_streamed(m, interactive),
+                                 cfa.CORRECTION_WORKERS, cfa.PIPELINE_QUEUE_SIZE,
+                                 met_stage, cfa.STAGE_BATCH_SIZE)
+        prep_stage = StageWorkers('preprocess',
+                                  lambda m: self.__preprocess_streamed(m, sign),
+                                  cfa.PREPROCESS_WORKERS, cfa.PIPELINE_QUEUE_SIZE,
+                                  cor_stage, cfa.STAGE_BATCH_SIZE)
+        # It is obtained before the extraction, so the new messages are not
+        # put twice in the pipeline
+        backlog = self.__get_backlog()
+        errors = []
+        
+        def produce(func, *args):
+            try:
+                func(*args)
+            except Exception as e:
+                log.exception('producer failed', extra = {'user' : self.__user_name})
+                errors.append(e)
+        
+        def finish(producers):
+            for t in producers:
+                t.join()
+            prep_stage.close()
+            cor_stage.close()
+            interactive.put(STOP)
+        
+        for stage in (met_stage, cor_stage, prep_stage):
+            stage.start()
+        listeners = [] if self.__extractor is None else self.__extractor.listeners
+        listeners.append(
+            lambda msgs: [prep_stage.put(m.to_message()) for m in msgs])
+        producers = [threading.Thread(target = produce, daemon = True,
+                                      args = (self.__feed_backlog, backlog,
+                                              prep_stage, cor_stage, met_stage)),
+                     threading.Thread(target = produce, daemon = True,
+                                      args = (self.extract, nextPageToken))]
+        for t in producers:
+            t.start()
+        threading.Thread(target = finish, args = (producers,), daemon = True).start()
+        
+        try:
+            item = interactive.get()
+            while item is not STOP:
+                prep_msg, first = item
+                self.__correct_message(prep_msg, first)
+                cor = self.__get_corrected(prep_msg['_id'])
+                if cor is not None:
+                    met_stage.put(cor)
+                item = interactive.get()
+            met_stage.close()
+        finally:
+            listeners.pop()
+        
+        if errors:
+            raise errors[0]
+
+    def extract(self, nextPageToken = None):
+        """
+        Extracts the sent messages of the user. If the incremental extraction
+        is enabled and the extraction is not resumed, only the messages added
+        since the last extraction are extracted (if it is possible).
+
+        Parameters
+        ----------
+        nextPageToken: str, optional
+            Token of the next page for extracting messages. The default is None,
+            which means that the extraction continues from the checkpoint (if
+            there is one).
+
+        Returns
+        -------
+        int: remaining quota units.
+
+        """
+        if self.__extractor is None:
+            log.info('extraction skipped', extra = {'user' : self.__user_name,
+                                                    'quota' : self.__quota})
+            return self.__quota
+        if cfa.PRELOAD_EXTRACTED_IDS:
+            self.__extractor.load_extracted_ids()
+        if nextPageToken is None:
+            nextPageToken = self.__next_page
+        quota = None
+        if cfa.INCREMENTAL_EXTRACTION and nextPageToken is None:
+            quota = self.__extractor.extract_new_msg()
+        if quota is None:
+            quota = self.__extractor.extract_sent_msg(self.__nres, nextPageToken)
+        self.__quota = quota
+        return quota
+
     def analyse(self, nextPageToken = None, sign = None):
         """
         Analyses all the messages of the given user.
@@ -498,7 +888,9 @@ class Analyser:
         Parameters
         ----------
         nextPageToken: str, optional
-            Token of the next page for extracting messages. The default is None.
+            Token of the next page for extracting messages. The default is None,
+            which means that the extraction continues from the checkpoint (if
+            there is one).
         sign: str, optional
             Signature of the user in his emails. The default value is None.
             
@@ -507,26 +899,37 @@ class Analyser:
         None.
         
         """
-        init_db()
         SessionTypoError.drop_collection()
         # PreprocessedMessage.drop_collection()
         # CorrectedMessage.drop_collection()
         # Metrics.drop_collection()
         
-        self.__quota = self.__extractor.extract_sent_msg(self.__nres, nextPageToken)
+        if self.__stages is None:
+            self.__stages = get_stages()
         
-        for ext in ExtractedMessage.objects():
-            self.__preprocess_message(ext.to_json(), sign)
-            
-        for prep in PreprocessedMessage.objects():
-            self.__correct_message(prep.to_json())
+        try:
+            if cfa.STREAMING_PIPELINE:
+                self.__analyse_streaming(nextPageToken, sign)
+            else:
+                self.extract(nextPageToken)
             
-        for cor in CorrectedMessage.objects():
-            self.__measure_style(cor.to_json())
-        
-        with open('log.txt', 'a') as f:
-            f.write('\nANALYSIS FINISHED:\n')
-            f.write(f'{ExtractedMessage.objects().count()} preprocessed messages.\n')
-            f.write(f'{PreprocessedMessage.objects().count()} typo-corrected messages.\n')
-            f.write(f'{CorrectedMessage.objects().count()} measured messages.\n')
+                for exts in chunked(ExtractedMessage.objects(), cfa.STAGE_BATCH_SIZE):
+                    self.__preprocess_messages([ext.to_message() for ext in exts], sign)
+                
+                for preps in chunked(PreprocessedMessage.objects(), cfa.STAGE_BATCH_SIZE):
+                    _, pending = self.__auto_correct([prep.to_message() for prep in preps])
+                    for prep_msg, first in pending:
+                        self.__correct_message(prep_msg, first)
+                
+                for cors in chunked(CorrectedMessage.objects(), cfa.STAGE_BATCH_SIZE):
+                    self.__measure_styles([cor.to_message() for cor in cors])
+        finally:
+            # It logs the latencies of the stage services
+            self.__stages.close()
+        
+        log.info('analysis finished', extra = {
+            'user' : self.__user_name,
+            'preprocessed' : PreprocessedMessage.objects().count(),
+            'corrected' : CorrectedMessage.objects().count(),
+            'measured' : Metrics.objects().count()})
         
\ No newline at end of file
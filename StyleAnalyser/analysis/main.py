@@ -16,7 +16,6 @@ from stylemeasuring.metrics import Metrics
 from contactclassification.classifiedcontact import ClassifiedContact
 from contactclassification.relationshiptype import RelationshipType
 from contactclassification.contactclassifier import get_relationship_type
-import base64
 from typocorrection.correctedmessage import CorrectedMessage
 import analysis.confanalysis as cf
 import numpy as np
@@ -128,8 +127,7 @@ def convert_recipients_to_relationship_type(to, cc, bcc, ide):
     print(f'Bcc: {bcc}')
     
     print('This is the body of the email:')
-    print(base64.urlsafe_b64decode(
-        CorrectedMessage.objects(msg_id = ide).first().bodyBase64Plain.encode()).decode())
+    print(CorrectedMessage.objects(msg_id = ide).first().bodyPlain)
     
     print('What is the type of relationship of this email?')
     return get_relationship_type()
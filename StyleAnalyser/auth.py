@@ -10,16 +10,16 @@ import os.path
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 
-def get_credentials(scopes, client_secret_file):
+def get_credentials(scopes, client_secret_file, token_file = 'token.pickle'):
     """
     Obtains valid credentials for accessing user's Gmail data
     """
     creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
+    # The token file (token.pickle by default) stores the user's access and
+    # refresh tokens, and is created automatically when the authorization flow
+    # completes for the first time.
+    if os.path.exists(token_file):
+        with open(token_file, 'rb') as token:
             creds = pickle.load(token)
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
@@ -29,7 +29,7 @@ def get_credentials(scopes, client_secret_file):
             flow = InstalledAppFlow.from_client_secrets_file(client_secret_file, scopes)
             creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
+        with open(token_file, 'wb') as token:
             pickle.dump(creds, token)
     return creds
 
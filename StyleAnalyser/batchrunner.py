@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jun 30 10:26:51 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+import config
+import auth
+import quotaunits as qu
+import confanalyser as cfa
+from pipelinelog import get_logger, init_logging
+
+log = get_logger('batch')
+
+def get_account_db(usu):
+    """
+    Obtains the name of the database of the given user.
+
+    Parameters
+    ----------
+    usu : str
+        User name.
+
+    Returns
+    -------
+    str: name of the database.
+
+    """
+    return 'analysis_' + re.sub(r'[^0-9A-Za-z_]', '_', usu)
+
+def load_manifest(path):
+    """
+    Loads the manifest of the accounts which are extracted. It is a json list
+    of objects with the user name ('user') and, optionally, the Gmail API
+    client secret file ('credentials'), the token file ('token'), the
+    database ('database'), the quota units available ('quota') and the path
+    of a mailbox export ('mailbox') which is used instead of Gmail API.
+
+    Parameters
+    ----------
+    path : str
+        Path of the manifest.
+
+    Raises
+    ------
+    ValueError
+        If an account has not user name or two accounts share the same user,
+        token file or database.
+
+    Returns
+    -------
+    list: accounts of the manifest with every field.
+
+    """
+    with open(path) as f:
+        accounts = json.load(f)
+
+    for acc in accounts:
+        if not('user' in acc):
+            raise ValueError(f'Account without user name in {path}: {acc}')
+        acc.setdefault('credentials', config.CREDS)
+        acc.setdefault('token', f"token-{acc['user']}.pickle")
+        acc.setdefault('database', get_account_db(acc['user']))
+        acc.setdefault('quota', qu.QUOTA_UNITS_PER_DAY)
+        acc.setdefault('mailbox', None)
+
+    for field in ('user', 'token', 'database'):
+        values = [acc[field] for acc in accounts if acc[field] is not None]
+        if len(values) != len(set(values)):
+            raise ValueError(f'Accounts of {path} share the same {field}')
+    return accounts
+
+def authorize(accounts):
+    """
+    Obtains the token of every Gmail account before starting the extractions,
+    so the authorization flow (which may open the browser) is not run by the
+    extraction processes.
+
+    Parameters
+    ----------
+    accounts : list
+        Accounts of the manifest.
+
+    Returns
+    -------
+    None.
+
+    """
+    for acc in accounts:
+        if acc['mailbox'] is None:
+            print(f"Authorizing {acc['user']}...")
+            auth.get_credentials(config.SCOPES, acc['credentials'], acc['token'])
+
+def extract_account(acc):
+    """
+    Extracts the sent messages of an account in its own database. It runs in
+    a process of the pool, so it has its own Gmail API session, quota
+    scheduler, database connection and log file.
+
+    Parameters
+    ----------
+    acc : dict
+        Account of the manifest.
+
+    Returns
+    -------
+    dict: user, database, extracted messages, consumed quota units, seconds
+    of the extraction and error (None if it finished).
+
+    """
+    from analyser import Analyser
+    from extraction.extractedmessage import ExtractedMessage
+    from initdb import init_db
+
+    init_logging(f"batch-{get_account_db(acc['user'])}")
+    result = {'user' : acc['user'], 'database' : acc['database'],
+              'extracted' : 0, 'quota' : 0, 'seconds' : 0.0, 'error' : None}
+    start = perf_counter()
+    try:
+        init_db(acc['database'])
+        before = ExtractedMessage.objects().count()
+        if acc['mailbox'] is not None:
+            # Mailbox exports do not consume quota units
+            Analyser(None, acc['user'], mailbox = acc['mailbox'],
+                     db_name = acc['database']).extract()
+        else:
+            from googleapiclient.discovery import build
+            from google_auth_httplib2 import AuthorizedHttp
+            from httplib2 import Http
+            creds = auth.get_credentials(config.SCOPES, acc['credentials'],
+                                         acc['token'])
+            service = build('gmail', 'v1', credentials = creds)
+            http_factory = lambda: AuthorizedHttp(creds, http = Http())
+            async_factory = None
+            if cfa.ASYNC_EXTRACTION:
+                from extraction.asyncgmail import AsyncGmailClient
+                async_factory = lambda: AsyncGmailClient(creds)
+            anls = Analyser(service, acc['user'], acc['quota'],
+                            http_factory = http_factory,
+                            async_factory = async_factory,
+                            db_name = acc['database'])
+            result['quota'] = acc['quota'] - anls.extract()
+        result['extracted'] = ExtractedMessage.objects().count() - before
+    except Exception as e:
+        log.exception('account failed', extra = {'user' : acc['user']})
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['seconds'] = perf_counter() - start
+    log.info('account finished', extra = result)
+    return result
+
+def run(accounts, num_workers = cfa.BATCH_ACCOUNT_WORKERS):
+    """
+    Extracts the given accounts in a pool of processes. Each account is
+    extracted in a new process, so the accounts do not share the GIL, the
+    database connection nor the quota scheduler, and the extraction of an
+    account does not wait for the requests of the others.
+
+    Parameters
+    ----------
+    accounts : list
+        Accounts of the manifest.
+    num_workers : int, optional
+        Number of accounts extracted at the same time. The default is
+        cfa.BATCH_ACCOUNT_WORKERS.
+
+    Returns
+    -------
+    results : list
+        Result of each account (see extract_account), in completion order.
+    elapsed : float
+        Seconds of the whole run.
+
+    """
+    results = []
+    start = perf_counter()
+    # Spawned processes do not inherit the connections nor the logging thread
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = max(1, min(num_workers, len(accounts))),
+                             mp_context = ctx, max_tasks_per_child = 1) as pool:
+        futures = [pool.submit(extract_account, acc) for acc in accounts]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            status = res['error'] or 'ok'
+            print(f"{res['user']:20s} {res['extracted']:7d} messages "
+                  + f"{res['quota']:9d} units {res['seconds']:8.1f} s  {status}")
+    return results, perf_counter() - start
+
+def report(results, elapsed):
+    """
+    Prints the aggregate throughput of the run.
+
+    Parameters
+    ----------
+    results : list
+        Result of each account.
+    elapsed : float
+        Seconds of the whole run.
+
+    Returns
+    -------
+    None.
+
+    """
+    nmsg = sum(r['extracted'] for r in results)
+    quota = sum(r['quota'] for r in results)
+    busy = sum(r['seconds'] for r in results)
+    failed = [r['user'] for r in results if r['error'] is not None]
+    print(f'\n{len(results)} accounts, {nmsg} messages, {quota} quota units in '
+          + f'{elapsed:.1f} s')
+    if elapsed > 0:
+        print(f'Aggregate throughput: {nmsg / elapsed:.1f} messages/s, '
+              + f'{quota / elapsed:.1f} units/s')
+    if busy > 0:
+        print(f'Sum of the account times: {busy:.1f} s (speedup '
+              + f'{busy / elapsed:.2f})')
+    if failed:
+        print(f"Failed accounts: {', '.join(failed)}")
+    log.info('batch finished', extra = {'accounts' : len(results),
+                                        'extracted' : nmsg, 'quota' : quota,
+                                        'duration' : elapsed,
+                                        'failed' : failed})
+
+def main():
+    """
+    Extracts the sent messages of the accounts of a manifest in parallel.
+
+    Returns
+    -------
+    None.
+
+    """
+    if not(os.getcwd() in sys.path):
+        sys.path.append(os.getcwd())
+    parser = argparse.ArgumentParser(description = 'Extracts the sent messages'
+                                     + ' of several accounts in parallel.')
+    parser.add_argument('manifest', help = 'json file with the accounts')
+    parser.add_argument('--workers', type = int,
+                        default = cfa.BATCH_ACCOUNT_WORKERS,
+                        help = 'accounts extracted at the same time')
+    args = parser.parse_args()
+
+    init_logging('batch')
+    accounts = load_manifest(args.manifest)
+    authorize(accounts)
+    results, elapsed = run(accounts, args.workers)
+    report(results, elapsed)
+
+if __name__ == '__main__':
+    main()
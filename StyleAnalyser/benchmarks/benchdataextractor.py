@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jun 18 10:41:15 2020
+
+@author: Carlos Moreno Morera
+"""
+import os, sys
+initial_dir = os.getcwd()
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+if not(os.getcwd() in sys.path):
+    sys.path.append(os.getcwd())
+
+import argparse
+import base64
+import json
+from time import perf_counter
+from extraction.dataextractor import DataExtractor
+import extraction.confextraction as cfe
+
+os.chdir(initial_dir)
+
+def record_payloads(path, nmsg):
+    """
+    Records the given number of sent messages of the Gmail account in a file
+    (one message in json format per line).
+
+    Parameters
+    ----------
+    path : str
+        Path of the file where the messages are recorded.
+    nmsg : int
+        Number of messages which are recorded.
+
+    Returns
+    -------
+    None.
+
+    """
+    from googleapiclient.discovery import build
+    import auth
+    import config
+
+    creds = auth.get_credentials(config.SCOPES, config.CREDS)
+    service = build('gmail', 'v1', credentials = creds)
+    m = service.users().messages()
+    msg_list = m.list(userId = 'me', labelIds = ['SENT'], maxResults = nmsg,
+                      fields = cfe.MSG_LIST_FIELDS).execute()
+    with open(path, 'w') as f:
+        for r in msg_list.get('messages', []):
+            msg = m.get(id = r['id'], userId = 'me', fields = cfe.MSG_FIELDS).execute()
+            f.write(json.dumps(msg) + '\n')
+
+def synthetic_payloads(nmsg):
+    """
+    Generates messages with the structure of the Gmail API ones: a
+    multipart/mixed payload with an attachment and a multipart/alternative
+    part with plain and quoted-printable html text.
+
+    Parameters
+    ----------
+    nmsg : int
+        Number of generated messages.
+
+    Returns
+    -------
+    list: Gmail API users.messages resources.
+
+    """
+    def b64(text):
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    body = 'Hola,\r\nesto es una prueba del extractor.\r\n\r\nUn saludo\r\n' * 20
+    msgs = []
+    for i in range(nmsg):
+        headers = [{'name' : f'X-Header-{j}', 'value' : 'x'} for j in range(20)]
+        headers += [{'name' : 'Subject', 'value' : f'Prueba {i}'},
+                    {'name' : 'From', 'value' : 'me@example.com'},
+                    {'name' : 'To', 'value' : 'a@example.com,b@example.com'},
+                    {'name' : 'References', 'value' : '<a@x> <b@x>'},
+                    {'name' : 'Content-Type', 'value' : 'multipart/mixed'}]
+        qp = [{'name' : 'Content-Transfer-Encoding', 'value' : 'quoted-printable'}]
+        msgs.append({'id' : str(i), 'threadId' : str(i), 'internalDate' : str(i),
+                     'payload' : {'mimeType' : 'multipart/mixed', 'headers' : headers,
+                                  'parts' : [
+            {'mimeType' : 'multipart/alternative', 'headers' : [], 'parts' : [
+                {'mimeType' : 'text/plain', 'headers' : qp,
+                 'body' : {'data' : b64(body)}},
+                {'mimeType' : 'text/html', 'headers' : qp,
+                 'body' : {'data' : b64('<div>' + body + '</div>')}}]},
+            {'mimeType' : 'application/pdf', 'headers' : [],
+             'body' : {'attachmentId' : 'a', 'size' : 1000}}]}})
+    return msgs
+
+def bench(msgs, repeat):
+    """
+    Measures the time that DataExtractor needs to parse the given messages.
+
+    Parameters
+    ----------
+    msgs : list
+        Gmail API users.messages resources.
+    repeat : int
+        Number of times that every message is parsed.
+
+    Returns
+    -------
+    float: mean time (microseconds) of parsing a message.
+
+    """
+    extractor = DataExtractor()
+    start = perf_counter()
+    for _ in range(repeat):
+        for msg in msgs:
+            extractor.set_new_message(msg)
+    return (perf_counter() - start) * 1e6 / (repeat * len(msgs))
+
+def main():
+    """
+    Runs the benchmark of the parse of messages by DataExtractor.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description = 'Benchmark of the parse of'
+                                     + ' Gmail API messages by DataExtractor.')
+    parser.add_argument('payloads', nargs = '?', help = 'file with recorded '
+                        + 'messages (one json per line); synthetic messages are'
+                        + ' used if it is not given')
+    parser.add_argument('--record', type = int, metavar = 'N', help = 'records '
+                        + 'N sent messages of the account in the payloads file')
+    parser.add_argument('--repeat', type = int, default = 20)
+    args = parser.parse_args()
+
+    if args.record:
+        record_payloads(args.payloads, args.record)
+
+    if args.payloads:
+        with open(args.payloads) as f:
+            msgs = [json.loads(line) for line in f if line.strip()]
+    else:
+        msgs = synthetic_payloads(1000)
+
+    print(f'{len(msgs)} messages, {bench(msgs, args.repeat):.1f} us/message')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jun 24 11:03:19 2020
+
+@author: Carlos Moreno Morera
+"""
+import os, sys
+initial_dir = os.getcwd()
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+if not(os.getcwd() in sys.path):
+    sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), 'benchmarks'))
+
+import argparse
+import mongoengine
+from time import perf_counter
+from gmailreplay import ReplayService, ReplayAsyncClient, record_archive
+from extraction.messageextractor import MessageExtractor
+from extraction.threadextractor import ThreadExtractor
+from extraction.adaptiveextractor import AdaptiveExtractor
+from extraction.extractedmessage import ExtractedMessage
+from extraction.checkpoint import ExtractionCheckpoint
+from extraction.syncstate import SyncState
+import quotaunits as qu
+
+os.chdir(initial_dir)
+
+# Database where the benchmark stores the extracted messages
+BENCH_DB = 'benchmark'
+# User name of the benchmark extractions
+BENCH_USER = 'benchmark'
+
+def reset_db():
+    """
+    Removes the messages, checkpoints and synchronization states of previous
+    benchmark runs.
+
+    Returns
+    -------
+    None.
+
+    """
+    ExtractedMessage.drop_collection()
+    ExtractionCheckpoint.drop_collection()
+    SyncState.drop_collection()
+
+def bench(service, resource, batch, num_workers, use_async = False):
+    """
+    Extracts every recorded message (or thread) of the replay service.
+
+    Parameters
+    ----------
+    service : ReplayService
+        Replay service of the archive.
+    resource : str
+        Resources which are requested: 'messages' (MessageExtractor),
+        'threads' (ThreadExtractor) or 'adaptive' (AdaptiveExtractor).
+    batch : bool
+        Whether the resources are obtained with batch requests.
+    num_workers : int
+        Number of fetch workers of the concurrent mode.
+    use_async : bool, optional
+        Whether the asynchronous engine is used. The default is False.
+
+    Returns
+    -------
+    extractor : Extractor
+        Extractor used.
+    nres : int
+        Number of resources of the mailbox.
+    elapsed : float
+        Seconds of the extraction.
+
+    """
+    sent = service.labels().get(userId = 'me', id = 'SENT').execute()
+    http_factory = object if num_workers > 0 else None
+    async_factory = (lambda: ReplayAsyncClient(service)) if use_async else None
+    if resource == 'threads':
+        extractor = ThreadExtractor(service, BENCH_USER, qu.QUOTA_UNITS_PER_DAY,
+                                    batch, num_workers = num_workers,
+                                    http_factory = http_factory,
+                                    async_factory = async_factory)
+        nres = sent['threadsTotal']
+    else:
+        ext_class = AdaptiveExtractor if resource == 'adaptive' else MessageExtractor
+        extractor = ext_class(service, BENCH_USER, qu.QUOTA_UNITS_PER_DAY,
+                              batch, num_workers = num_workers,
+                              http_factory = http_factory,
+                              async_factory = async_factory)
+        nres = sent['messagesTotal']
+    start = perf_counter()
+    extractor.extract_sent_msg(nres)
+    return extractor, nres, perf_counter() - start
+
+def main():
+    """
+    Runs the benchmark of the extraction against a recorded archive.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description = 'Benchmark of the extraction'
+                                     + ' with recorded Gmail API responses.')
+    parser.add_argument('archive', help = 'archive of recorded responses')
+    parser.add_argument('--record', type = int, metavar = 'N', help = 'records '
+                        + 'N sent messages and threads of the account first')
+    parser.add_argument('--resource', choices = ['messages', 'threads', 'adaptive'],
+                        default = 'messages', help = 'resources requested')
+    parser.add_argument('--mode', choices = ['sequential', 'batch', 'concurrent',
+                                           'async'],
+                        default = 'batch')
+    parser.add_argument('--workers', type = int, default = 8)
+    parser.add_argument('--latency', type = float, default = 0.05,
+                        help = 'seconds of each request')
+    parser.add_argument('--error-rate', type = float, default = 0.0,
+                        help = 'probability of a rate limit error')
+    parser.add_argument('--quota-per-sec', type = int, default = None,
+                        help = 'quota units per second enforced by the service')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    if args.record:
+        from googleapiclient.discovery import build
+        import auth
+        import config
+        creds = auth.get_credentials(config.SCOPES, config.CREDS)
+        record_archive(build('gmail', 'v1', credentials = creds), args.archive,
+                       args.record)
+
+    mongoengine.register_connection(alias = 'core', name = BENCH_DB)
+    reset_db()
+    service = ReplayService(args.archive, args.latency, args.error_rate,
+                            args.quota_per_sec, args.seed)
+    workers = args.workers if args.mode == 'concurrent' else 0
+    extractor, nres, elapsed = bench(service, args.resource, args.mode == 'batch',
+                                     workers, args.mode == 'async')
+
+    stats = extractor.scheduler.get_stats()
+    extracted = ExtractedMessage.objects().count()
+    print(f'{extracted} messages of {nres} resources in {elapsed:.2f} s '
+          + f'({extracted / elapsed:.1f} messages/s)')
+    print(f"Quota: {stats['consumed']} units in {stats['requests']} requests, "
+          + f"{stats['utilization']:.2%} of the allowed, "
+          + f"{stats['blockedTime']:.2f} s blocked")
+    print(f"Retries: {stats['retries']} ({stats['backoffTime']:.2f} s of backoff)")
+    print(f'Service calls: {service.calls}, rate limit errors: {service.errors}')
+    reset_db()
+
+if __name__ == '__main__':
+    main()
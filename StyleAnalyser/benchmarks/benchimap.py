@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jun 26 18:20:11 2020
+
+@author: Carlos Moreno Morera
+"""
+import os, sys
+initial_dir = os.getcwd()
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+if not(os.getcwd() in sys.path):
+    sys.path.append(os.getcwd())
+sys.path.append(os.path.join(os.getcwd(), 'benchmarks'))
+
+import argparse
+import mongoengine
+from time import perf_counter
+from imapserver import ImapStandIn, load_messages
+from benchextraction import BENCH_DB, BENCH_USER, reset_db
+from extraction.imapextractor import ImapExtractor
+from extraction.extractedmessage import ExtractedMessage
+import extraction.confextraction as cfe
+
+os.chdir(initial_dir)
+
+def bench(server, batch, depth, num_workers):
+    """
+    Extracts every message of the stand-in server.
+
+    Parameters
+    ----------
+    server : ImapStandIn
+        Stand-in IMAP server.
+    batch : int
+        Messages requested by each UID FETCH command.
+    depth : int
+        UID FETCH commands pipelined.
+    num_workers : int
+        Number of parser processes.
+
+    Returns
+    -------
+    float: seconds of the extraction.
+
+    """
+    cfe.IMAP_FETCH_BATCH = batch
+    cfe.IMAP_PIPELINE_DEPTH = depth
+    reset_db()
+    extractor = ImapExtractor(BENCH_USER, 'benchmark', 'benchmark',
+                              host = '127.0.0.1', port = server.port,
+                              use_ssl = False, num_workers = num_workers)
+    start = perf_counter()
+    extractor.extract_sent_msg()
+    return perf_counter() - start
+
+def main():
+    """
+    Runs the benchmark of the IMAP extraction against a stand-in server.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description = 'Benchmark of the IMAP'
+                                     + ' extraction.')
+    parser.add_argument('mailbox', help = 'mbox file or Maildir directory')
+    parser.add_argument('--latency', type = float, default = 0.05,
+                        help = 'seconds of latency of each IMAP command')
+    parser.add_argument('--batch', type = int, nargs = '+',
+                        default = [1, cfe.IMAP_FETCH_BATCH])
+    parser.add_argument('--depth', type = int, nargs = '+',
+                        default = [1, cfe.IMAP_PIPELINE_DEPTH])
+    parser.add_argument('--workers', type = int, default = 0)
+    args = parser.parse_args()
+
+    server = ImapStandIn(load_messages(args.mailbox), latency = args.latency)
+    server.start()
+    mongoengine.register_connection(alias = 'core', name = BENCH_DB)
+    for batch in args.batch:
+        for depth in args.depth:
+            elapsed = bench(server, batch, depth, args.workers)
+            nmsg = ExtractedMessage.objects().count()
+            print(f'batch {batch:4d}, depth {depth:2d}: {nmsg} messages in '
+                  + f'{elapsed:.2f} s ({nmsg / elapsed:.1f} messages/s)')
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jun 19 12:15:06 2020
+
+@author: Carlos Moreno Morera
+"""
+import os, sys
+initial_dir = os.getcwd()
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+if not(os.getcwd() in sys.path):
+    sys.path.append(os.getcwd())
+
+import argparse
+import json
+from time import perf_counter
+from softbreaks import remove_soft_breaks
+
+os.chdir(initial_dir)
+
+# Regression corpus: outputs of the previous character by character cleaning
+# of html and decoded bodies (the decoded output is missing where it failed)
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'softbreakscorpus.json')
+
+def check_corpus():
+    """
+    Checks that the soft break lines are removed as in the regression corpus.
+
+    Returns
+    -------
+    int: number of texts of the corpus whose output is different.
+
+    """
+    with open(CORPUS, encoding = 'utf-8') as f:
+        corpus = json.load(f)
+
+    errors = 0
+    for case in corpus:
+        if remove_soft_breaks(case['text']) != case['html']:
+            errors += 1
+            print(f"Html mismatch: {case['text']!r}")
+        if ('decoded' in case and
+            remove_soft_breaks(case['text'], decoded = True) != case['decoded']):
+            errors += 1
+            print(f"Decoded mismatch: {case['text']!r}")
+    print(f'{len(corpus)} texts of the corpus checked, {errors} mismatches.')
+    return errors
+
+def quoted_printable_body(size):
+    """
+    Generates a body with the line breaks of a quoted-printable text.
+
+    Parameters
+    ----------
+    size : int
+        Approximate number of characters of the body.
+
+    Returns
+    -------
+    str: generated body.
+
+    """
+    paragraph = ('Hola, te escribo para confirmar la reunión del próximo '
+                 + 'lunes.\r\nSi no puedes venir, avísame y buscamos otro '
+                 + 'día.\r\n\r\n')
+    return paragraph * (size // len(paragraph) + 1)
+
+def bench(text, decoded, repeat):
+    """
+    Measures the throughput of the removal of soft break lines.
+
+    Parameters
+    ----------
+    text : str
+        Message body.
+    decoded : bool
+        Whether it is cleaned as a decoded body or as an html body.
+    repeat : int
+        Number of times that the body is cleaned.
+
+    Returns
+    -------
+    float: throughput in MB/s (of utf-8 encoded input).
+
+    """
+    start = perf_counter()
+    for _ in range(repeat):
+        remove_soft_breaks(text, decoded)
+    elapsed = perf_counter() - start
+    return len(text.encode()) * repeat / elapsed / 1e6
+
+def main():
+    """
+    Checks the regression corpus and runs the benchmark of the removal of
+    soft break lines.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description = 'Benchmark of the removal of'
+                                     + ' soft break lines.')
+    parser.add_argument('--size', type = int, default = 4, help = 'size of the'
+                        + ' body in millions of characters')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    if check_corpus():
+        sys.exit(1)
+
+    text = quoted_printable_body(args.size * 1000000)
+    for decoded in [False, True]:
+        kind = 'decoded' if decoded else 'html'
+        print(f'{kind}: {bench(text, decoded, args.repeat):.1f} MB/s')
+
+if __name__ == '__main__':
+    main()
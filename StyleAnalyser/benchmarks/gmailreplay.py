@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jun 23 16:20:31 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import asyncio
+import gzip
+import json
+import random
+import threading
+from collections import deque
+from time import sleep, time
+import httplib2
+from googleapiclient.errors import HttpError
+import quotaunits as qu
+from extraction.quotascheduler import QuotaScheduler
+
+# Quota units of each replayed method
+METHOD_QUOTA = {'labels.get' : qu.LABELS_GET,
+                'getProfile' : qu.GET_PROFILE,
+                'messages.list' : qu.MSG_LIST,
+                'messages.get' : qu.MSG_GET,
+                'threads.list' : qu.THREADS_LIST,
+                'threads.get' : qu.THREADS_GET,
+                'history.list' : qu.HISTORY_LIST}
+# Maximum number of gets of each batch request of the recorder
+RECORD_BATCH = 50
+
+def load_archive(path):
+    """
+    Loads an archive of recorded Gmail API responses.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive (gzip compressed json).
+
+    Returns
+    -------
+    dict: recorded responses of each method by their key (page token,
+    identifier, ...).
+
+    """
+    with gzip.open(path, 'rt', encoding = 'utf-8') as f:
+        return json.load(f)
+
+def save_archive(archive, path):
+    """
+    Saves an archive of recorded Gmail API responses.
+
+    Parameters
+    ----------
+    archive : dict
+        Recorded responses of each method by their key.
+    path : str
+        Path of the archive (gzip compressed json).
+
+    Returns
+    -------
+    None.
+
+    """
+    with gzip.open(path, 'wt', encoding = 'utf-8') as f:
+        json.dump(archive, f)
+
+def _record_resources(service, archive, coll, max_res, scheduler):
+    """
+    Records the pages of the list of sent resources and the resources of the
+    given collection.
+
+    Parameters
+    ----------
+    service : Gmail resource
+        Gmail API resource with an Gmail user session opened.
+    archive : dict
+        Archive where the responses are recorded.
+    coll : str
+        Collection of resources ('messages' or 'threads').
+    max_res : int
+        Maximum number of recorded resources. If it is None, every resource
+        is recorded.
+    scheduler : QuotaScheduler
+        Rate limiter of the recorder requests.
+
+    Returns
+    -------
+    None.
+
+    """
+    lists = archive.setdefault(f'{coll}.list', {})
+    gets = archive.setdefault(f'{coll}.get', {})
+    resource = getattr(service.users(), coll)()
+    ids = []
+    token = None
+    more_pages = True
+    while more_pages and (max_res is None or len(ids) < max_res):
+        scheduler.acquire(METHOD_QUOTA[f'{coll}.list'])
+        page = resource.list(userId = 'me', labelIds = ['SENT'],
+                             pageToken = token).execute()
+        lists[token or ''] = page
+        ids += [r['id'] for r in page.get(coll, [])]
+        token = page.get('nextPageToken')
+        more_pages = token is not None
+    if max_res is not None:
+        ids = ids[:max_res]
+
+    def store_response(request_id, response, exception):
+        if exception is None:
+            gets[request_id] = response
+
+    size = min(RECORD_BATCH, qu.QUOTA_UNITS_PER_SECOND // METHOD_QUOTA[f'{coll}.get'])
+    for i in range(0, len(ids), size):
+        chunk = ids[i:i + size]
+        scheduler.acquire(METHOD_QUOTA[f'{coll}.get'] * len(chunk))
+        batch = service.new_batch_http_request(callback = store_response)
+        for resId in chunk:
+            batch.add(resource.get(userId = 'me', id = resId), request_id = resId)
+        batch.execute()
+
+def record_archive(service, path, max_res = None):
+    """
+    Records the responses which the extractors need (SENT label, profile,
+    pages of the message and thread lists and the messages and threads) in a
+    local archive.
+
+    Parameters
+    ----------
+    service : Gmail resource
+        Gmail API resource with an Gmail user session opened.
+    path : str
+        Path of the archive (gzip compressed json).
+    max_res : int, optional
+        Maximum number of recorded messages and threads. The default is None
+        (the whole mailbox).
+
+    Returns
+    -------
+    dict: recorded archive.
+
+    """
+    scheduler = QuotaScheduler(qu.QUOTA_UNITS_PER_DAY)
+    archive = {}
+    users = service.users()
+    archive['labels.get'] = {'SENT' : users.labels().get(userId = 'me',
+                                                         id = 'SENT').execute()}
+    archive['getProfile'] = {'' : users.getProfile(userId = 'me').execute()}
+    _record_resources(service, archive, 'messages', max_res, scheduler)
+    _record_resources(service, archive, 'threads', max_res, scheduler)
+    if max_res is not None:
+        # The totals of the label must agree with the recorded resources
+        archive['labels.get']['SENT']['messagesTotal'] = len(archive['messages.get'])
+        archive['labels.get']['SENT']['threadsTotal'] = len(archive['threads.get'])
+    save_archive(archive, path)
+    return archive
+
+class ReplayRequest:
+    """
+    Gmail API request (not executed yet) of a ReplayService.
+
+    Attributes
+    ----------
+    service: ReplayService
+        Service which replays the response.
+    method: str
+        Name of the method (for example, 'messages.get').
+    key: str
+        Key of the recorded response.
+
+    """
+    def __init__(self, service, method, key):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        service : ReplayService
+            Service which replays the response.
+        method : str
+            Name of the method.
+        key : str
+            Key of the recorded response.
+
+        Returns
+        -------
+        Constructed ReplayRequest class.
+
+        """
+        self.service = service
+        self.method = method
+        self.key = key
+
+    def execute(self, http = None, num_retries = 0):
+        """
+        Executes the request after the configured latency.
+
+        Parameters
+        ----------
+        http : object, optional
+            Ignored (kept for compatibility with HttpRequest).
+        num_retries : int, optional
+            Ignored (kept for compatibility with HttpRequest).
+
+        Returns
+        -------
+        dict: recorded response.
+
+        """
+        sleep(self.service.latency)
+        return self.service.respond(self.method, self.key)
+
+class ReplayBatch:
+    """
+    Gmail API batch request of a ReplayService. All its requests are answered
+    after a single latency.
+
+    Attributes
+    ----------
+    service: ReplayService
+        Service which replays the responses.
+    callback: function
+        Function called with each response.
+    requests: list
+        Pairs of request identifier and ReplayRequest.
+
+    """
+    def __init__(self, service, callback):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        service : ReplayService
+            Service which replays the responses.
+        callback : function
+            Function called with the request identifier, the response and the
+            exception of each request.
+
+        Returns
+        -------
+        Constructed ReplayBatch class.
+
+        """
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback = None, request_id = None):
+        """
+        Adds a request to the batch.
+
+        Parameters
+        ----------
+        request : ReplayRequest
+            Request which is added.
+        callback : function, optional
+            Ignored, the callback of the batch is used.
+        request_id : str, optional
+            Identifier of the request. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.requests.append((request_id, request))
+
+    def execute(self, http = None):
+        """
+        Executes every request of the batch.
+
+        Parameters
+        ----------
+        http : object, optional
+            Ignored (kept for compatibility with BatchHttpRequest).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.service.record_batch([request_id for request_id, _ in self.requests])
+        sleep(self.service.latency)
+        for request_id, req in self.requests:
+            try:
+                response = self.service.respond(req.method, req.key)
+                self.callback(request_id, response, None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+class ReplayResource:
+    """
+    Collection of resources (messages, threads, labels or history) of a
+    ReplayService.
+
+    Attributes
+    ----------
+    service: ReplayService
+        Service which replays the responses.
+    name: str
+        Name of the collection.
+
+    """
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def list(self, userId = 'me', pageToken = None, startHistoryId = None, **kwargs):
+        """
+        Obtains the request of a page of the list.
+
+        Returns
+        -------
+        ReplayRequest.
+
+        """
+        if self.name == 'history':
+            return ReplayRequest(self.service, 'history.list',
+                                 f'{startHistoryId}:{pageToken or ""}')
+        return ReplayRequest(self.service, f'{self.name}.list', pageToken or '')
+
+    def get(self, userId = 'me', id = None, **kwargs):
+        """
+        Obtains the request of a resource.
+
+        Returns
+        -------
+        ReplayRequest.
+
+        """
+        return ReplayRequest(self.service, f'{self.name}.get', id)
+
+class ReplayService:
+    """
+    Stand-in of the Gmail API resource which serves the responses of an
+    archive recorded with record_archive. It can add latency to every request
+    and answer with quota errors, either randomly or when the quota units per
+    second are exceeded.
+
+    Attributes
+    ----------
+    archive: dict
+        Recorded responses of each method by their key.
+    latency: float
+        Seconds that each request (or batch request) takes.
+    error_rate: float
+        Probability that a request fails with a rate limit error.
+    quota_per_sec: int
+        Quota units per second from which the requests fail with a rate limit
+        error. If it is None, they are not checked.
+    calls: dict
+        Number of requests answered of each method.
+    batches: list
+        Request identifiers of each batch request executed.
+    errors: int
+        Number of rate limit errors given.
+    __random: Random
+        Random generator of the errors.
+    __consumed: deque
+        Time and quota units of the requests of the last second.
+    __lock: Lock
+        Lock of the counters (fetch workers share the service).
+
+    """
+    def __init__(self, archive, latency = 0.0, error_rate = 0.0,
+                 quota_per_sec = None, seed = None):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        archive : dict or str
+            Recorded responses or path of the archive.
+        latency : float, optional
+            Seconds that each request takes. The default is 0.0.
+        error_rate : float, optional
+            Probability of a rate limit error. The default is 0.0.
+        quota_per_sec : int, optional
+            Quota units per second allowed. The default is None.
+        seed : int, optional
+            Seed of the random errors. The default is None.
+
+        Returns
+        -------
+        Constructed ReplayService class.
+
+        """
+        if isinstance(archive, str):
+            archive = load_archive(archive)
+        self.archive = archive
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_sec = quota_per_sec
+        self.calls = {}
+        self.batches = []
+        self.errors = 0
+        self.__random = random.Random(seed)
+        self.__consumed = deque()
+        self.__lock = threading.Lock()
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return ReplayResource(self, 'messages')
+
+    def threads(self):
+        return ReplayResource(self, 'threads')
+
+    def labels(self):
+        return ReplayResource(self, 'labels')
+
+    def history(self):
+        return ReplayResource(self, 'history')
+
+    def getProfile(self, userId = 'me', **kwargs):
+        return ReplayRequest(self, 'getProfile', '')
+
+    def new_batch_http_request(self, callback = None):
+        return ReplayBatch(self, callback)
+
+    def record_batch(self, request_ids):
+        """
+        Records a batch request which is going to be executed.
+
+        Parameters
+        ----------
+        request_ids : list
+            Identifiers of the requests of the batch.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.__lock:
+            self.batches.append(request_ids)
+
+    def __error(self, status, reason):
+        """
+        Builds a Gmail API error.
+
+        Parameters
+        ----------
+        status : int
+            HTTP status of the error.
+        reason : str
+            Reason of the error.
+
+        Returns
+        -------
+        HttpError.
+
+        """
+        content = json.dumps({'error' : {'code' : status, 'message' : reason,
+                                         'errors' : [{'reason' : reason}]}})
+        return HttpError(httplib2.Response({'status' : status}), content.encode())
+
+    def respond(self, method, key):
+        """
+        Obtains the recorded response of the given request.
+
+        Parameters
+        ----------
+        method : str
+            Name of the method.
+        key : str
+            Key of the recorded response.
+
+        Raises
+        ------
+        HttpError
+            429 if it is a random rate limit error, 403 if the quota units per
+            second are exceeded and 404 if the response was not recorded.
+
+        Returns
+        -------
+        dict: recorded response.
+
+        """
+        with self.__lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            error = None
+            if self.__random.random() < self.error_rate:
+                error = self.__error(429, 'rateLimitExceeded')
+            if self.quota_per_sec is not None:
+                now = time()
+                while self.__consumed and self.__consumed[0][0] <= now - 1:
+                    self.__consumed.popleft()
+                units = METHOD_QUOTA.get(method, 1)
+                used = sum(u for _, u in self.__consumed)
+                if used + units > self.quota_per_sec:
+                    # Gmail answers the per-user rate limit with a 403
+                    error = self.__error(403, 'userRateLimitExceeded')
+                else:
+                    self.__consumed.append((now, units))
+            if error is not None:
+                self.errors += 1
+                raise error
+
+        response = self.archive.get(method, {}).get(key)
+        if response is None:
+            raise self.__error(404, 'notFound')
+        return response
+
+class ReplayAsyncClient:
+    """
+    Stand-in of AsyncGmailClient which answers the requests of a
+    ReplayService. The latency is awaited, so many requests can be in flight.
+
+    Attributes
+    ----------
+    service: ReplayService
+        Service which replays the responses.
+
+    """
+    def __init__(self, service):
+        self.service = service
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    async def execute(self, req):
+        """
+        Executes the request after the latency of the service.
+
+        Parameters
+        ----------
+        req : ReplayRequest
+            Request which is executed.
+
+        Returns
+        -------
+        dict: recorded response.
+
+        """
+        await asyncio.sleep(self.service.latency)
+        return self.service.respond(req.method, req.key)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jun 26 16:45:02 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import mailbox
+import os
+import re
+import select
+import socketserver
+import threading
+from time import sleep
+
+# Folder served by the stand-in server (the default of ImapExtractor)
+SENT_FOLDER = '[Gmail]/Sent Mail'
+# UIDVALIDITY of the served folder
+UID_VALIDITY = 1
+
+def load_messages(path):
+    """
+    Loads the messages of an mbox file or a Maildir directory.
+
+    Parameters
+    ----------
+    path : str
+        Path of the mailbox.
+
+    Returns
+    -------
+    list: messages in RFC 5322 format.
+
+    """
+    if os.path.isdir(path):
+        box = mailbox.Maildir(path, factory = None, create = False)
+    else:
+        box = mailbox.mbox(path, factory = None, create = False)
+    return [box.get_bytes(key) for key in box.iterkeys()]
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a connection of the stand-in IMAP server. It implements the
+    commands which ImapExtractor uses (CAPABILITY, LOGIN, SELECT, EXAMINE,
+    UID SEARCH, UID FETCH, NOOP and LOGOUT), answering them in order, so the
+    commands can be pipelined. The reading of the commands is not buffered,
+    so the server can check whether the next command had already been sent
+    (pipelined) when it answers one.
+
+    """
+    rbufsize = 0
+
+    def send(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        """
+        Reads the commands of the connection and answers them.
+
+        Returns
+        -------
+        None.
+
+        """
+        server = self.server
+        self.send(b'* OK IMAP4rev1 stand-in server ready')
+        for line in self.rfile:
+            parts = line.rstrip(b'\r\n').decode().split(' ', 2)
+            if len(parts) < 2:
+                continue
+            tag, cmd = parts[0].encode(), parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ''
+            if server.latency:
+                sleep(server.latency)
+            # The client did not wait for the answer to send the next command
+            pipelined = bool(select.select([self.connection], [], [], 0)[0])
+            server.record(cmd, args, pipelined)
+
+            if cmd == 'CAPABILITY':
+                self.send(b'* CAPABILITY IMAP4rev1 X-GM-EXT-1')
+            elif cmd in ('SELECT', 'EXAMINE'):
+                if args.strip('"') != server.folder:
+                    self.send(tag + b' NO folder not found')
+                    continue
+                self.send(b'* %d EXISTS' % len(server.messages))
+                self.send(b'* OK [UIDVALIDITY %d] UIDs valid' % server.uid_validity)
+                self.send(b'* OK [UIDNEXT %d] Predicted next UID'
+                          % (len(server.messages) + 1))
+                self.send(tag + b' OK [READ-ONLY] ' + cmd.encode() + b' completed')
+                continue
+            elif cmd == 'UID':
+                self.handle_uid(tag, args)
+                continue
+            elif cmd == 'LOGOUT':
+                self.send(b'* BYE logging out')
+                self.send(tag + b' OK LOGOUT completed')
+                self.wfile.flush()
+                return
+            elif not(cmd in ('LOGIN', 'NOOP')):
+                self.send(tag + b' BAD unknown command')
+                continue
+            self.send(tag + b' OK ' + cmd.encode() + b' completed')
+            self.wfile.flush()
+
+    def parse_set(self, seq_set):
+        """
+        Obtains the UIDs of an IMAP sequence set which exist.
+
+        Parameters
+        ----------
+        seq_set : str
+            Sequence set (for example, '1:50,52,60:*').
+
+        Returns
+        -------
+        list: UIDs.
+
+        """
+        last = len(self.server.messages)
+        uids = []
+        for part in seq_set.split(','):
+            start, _, end = part.partition(':')
+            start = last if start == '*' else int(start)
+            end = start if not(end) else (last if end == '*' else int(end))
+            start, end = min(start, end), max(start, end)
+            uids += range(max(start, 1), min(end, last) + 1)
+        return uids
+
+    def handle_uid(self, tag, args):
+        """
+        Answers the UID SEARCH and UID FETCH commands. The UID of each message
+        is its position (the first one is 1).
+
+        Parameters
+        ----------
+        tag : bytes
+            Tag of the command.
+        args : str
+            Arguments of the command.
+
+        Returns
+        -------
+        None.
+
+        """
+        messages = self.server.messages
+        sub, _, args = args.partition(' ')
+        sub = sub.upper()
+        if sub == 'SEARCH':
+            m = re.search(r'UID (\S+)', args)
+            uids = self.parse_set(m.group(1)) if m else self.parse_set('1:*')
+            self.send(b'* SEARCH ' + ' '.join(map(str, uids)).encode())
+        elif sub == 'FETCH':
+            seq_set, _, items = args.partition(' ')
+            gmail = 'X-GM-MSGID' in items
+            for uid in self.parse_set(seq_set):
+                raw = messages[uid - 1]
+                line = b'* %d FETCH (UID %d ' % (uid, uid)
+                if gmail:
+                    line += b'X-GM-MSGID %d X-GM-THRID %d ' % (
+                        self.server.msgids[uid - 1], self.server.thrids[uid - 1])
+                self.wfile.write(line + b'BODY[] {%d}\r\n' % len(raw) + raw + b')\r\n')
+        else:
+            self.send(tag + b' BAD unknown UID command')
+            self.wfile.flush()
+            return
+        self.send(tag + b' OK UID ' + sub.encode() + b' completed')
+        self.wfile.flush()
+
+class ImapStandIn(socketserver.ThreadingTCPServer):
+    """
+    Local IMAP server (without SSL) which serves a mailbox export as the
+    folder of sent messages, so that ImapExtractor can be tested and measured
+    without a real account.
+
+    Attributes
+    ----------
+    messages: list
+        Messages in RFC 5322 format (the UID of each one is its position).
+    msgids: list
+        X-GM-MSGID of each message.
+    thrids: list
+        X-GM-THRID of each message.
+    folder: str
+        Name of the served folder.
+    uid_validity: int
+        UIDVALIDITY of the folder.
+    latency: float
+        Seconds that the server waits before answering each command.
+    commands: list
+        Received commands: {'command' : str, 'args' : str, 'pipelined' : bool}
+        ('command' is 'UID FETCH' or 'UID SEARCH' for the UID commands).
+    __lock: threading.Lock
+        Lock of the received commands.
+
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages, port = 0, latency = 0.0,
+                 uid_validity = UID_VALIDITY, folder = SENT_FOLDER):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        messages : list
+            Messages in RFC 5322 format.
+        port : int, optional
+            Port of the server. The default is 0 (any free port).
+        latency : float, optional
+            Seconds of latency of each command. The default is 0.0.
+        uid_validity : int, optional
+            UIDVALIDITY of the folder. The default is UID_VALIDITY.
+        folder : str, optional
+            Name of the folder. The default is SENT_FOLDER.
+
+        Returns
+        -------
+        Constructed ImapStandIn class.
+
+        """
+        super().__init__(('127.0.0.1', port), ImapHandler)
+        self.messages = messages
+        self.msgids = [10**15 + i for i in range(len(messages))]
+        self.thrids = [10**15 + i - i % 3 for i in range(len(messages))]
+        self.folder = folder
+        self.uid_validity = uid_validity
+        self.latency = latency
+        self.commands = []
+        self.__lock = threading.Lock()
+
+    def record(self, cmd, args, pipelined):
+        """
+        Records a received command.
+
+        Parameters
+        ----------
+        cmd : str
+            Command.
+        args : str
+            Arguments of the command.
+        pipelined : bool
+            Whether the next command had already been received when it was
+            answered.
+
+        Returns
+        -------
+        None.
+
+        """
+        if cmd == 'UID':
+            sub, _, args = args.partition(' ')
+            cmd = f'UID {sub.upper()}'
+        with self.__lock:
+            self.commands.append({'command' : cmd, 'args' : args,
+                                  'pipelined' : pipelined})
+
+    def get_commands(self, cmd):
+        """
+        Obtains the received commands of the given kind.
+
+        Parameters
+        ----------
+        cmd : str
+            Command (for example, 'UID FETCH').
+
+        Returns
+        -------
+        list: received commands (see commands).
+
+        """
+        with self.__lock:
+            return [c for c in self.commands if c['command'] == cmd]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """
+        Serves the connections in a background thread.
+
+        Returns
+        -------
+        Thread of the server.
+
+        """
+        thread = threading.Thread(target = self.serve_forever, daemon = True)
+        thread.start()
+        return thread
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Stand-in IMAP server of a'
+                                     + ' mailbox export.')
+    parser.add_argument('mailbox', help = 'mbox file or Maildir directory')
+    parser.add_argument('--port', type = int, default = 1143)
+    parser.add_argument('--latency', type = float, default = 0.0)
+    args = parser.parse_args()
+    server = ImapStandIn(load_messages(args.mailbox), args.port, args.latency)
+    print(f'Serving {len(server.messages)} messages on port {server.port}')
+    server.serve_forever()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jun 17 11:26:08 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import base64
+import zlib
+from htmlconversion import html_to_text
+
+# Whether the bodies of the messages are stored as compressed binary fields
+# (otherwise they are stored as Base64 encoded strings)
+COMPRESS_BODIES = True
+# Compression level of zlib (from 1, the fastest, to 9, the smallest)
+COMPRESSION_LEVEL = 6
+
+def compress_body(text):
+    """
+    Compresses the given body of a message.
+
+    Parameters
+    ----------
+    text : str
+        Body of the message.
+
+    Returns
+    -------
+    bytes: body compressed with zlib.
+
+    """
+    return zlib.compress(text.encode(), COMPRESSION_LEVEL)
+
+def decompress_body(data):
+    """
+    Decompresses the given body of a message.
+
+    Parameters
+    ----------
+    data : bytes
+        Body of the message compressed with zlib.
+
+    Returns
+    -------
+    str: body of the message.
+
+    """
+    return zlib.decompress(data).decode()
+
+class CompressedBody:
+    """
+    Mixin of the message documents which gives transparent access to their
+    bodies whichever the format in which they are stored: Base64 encoded
+    strings (bodyBase64Plain and bodyBase64Html fields) or compressed binary
+    fields (bodyCompressedPlain and bodyCompressedHtml fields). Documents
+    without html body do not need to declare its fields. The plain text body
+    of the documents with a bodyHash field can also be stored once in the
+    body store (see bodystore) and linked by its hash.
+
+    The plain text of the messages which only have html body is not stored:
+    it is converted from the html body when the bodyPlain property is read.
+    to_message does not convert it, so the stage which needs it (the
+    preprocessor) does.
+
+    Attributes
+    ----------
+    bodyPlain: str (property)
+        Message's body as plain text (converted from the html body if it has
+        not got plain text body).
+    bodyHtml: str (property)
+        Message's body as html text.
+
+    """
+    def __get_body(self, kind):
+        """
+        Obtains the body of the given kind.
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the body ('Plain' or 'Html').
+
+        Returns
+        -------
+        str: body of the message. It is None if the message has not got it.
+
+        """
+        data = getattr(self, 'bodyCompressed' + kind, None)
+        if data is not None:
+            return decompress_body(data)
+
+        text = getattr(self, 'bodyBase64' + kind, None)
+        if text is not None:
+            return base64.urlsafe_b64decode(text.encode()).decode()
+
+        body_hash = getattr(self, 'bodyHash', None)
+        if kind == 'Plain' and body_hash is not None:
+            # Imported here because the body store uses this mixin
+            from bodystore import load_body
+            return load_body(body_hash)
+        return None
+
+    def __set_body(self, kind, text):
+        """
+        Stores the body of the given kind with the configured format.
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the body ('Plain' or 'Html').
+        text : str
+            Body of the message. If it is None, the body is removed.
+
+        Returns
+        -------
+        None.
+
+        """
+        data = None
+        enc = None
+        if text is not None and COMPRESS_BODIES:
+            data = compress_body(text)
+        elif text is not None:
+            enc = base64.urlsafe_b64encode(text.encode()).decode()
+        setattr(self, 'bodyCompressed' + kind, data)
+        setattr(self, 'bodyBase64' + kind, enc)
+
+    @property
+    def bodyPlain(self):
+        plain = self.__get_body('Plain')
+        if plain is None:
+            html = self.__get_body('Html')
+            if html is not None:
+                plain = html_to_text(html)
+        return plain
+
+    @bodyPlain.setter
+    def bodyPlain(self, text):
+        self.__set_body('Plain', text)
+
+    @property
+    def bodyHtml(self):
+        return self.__get_body('Html')
+
+    @bodyHtml.setter
+    def bodyHtml(self, text):
+        self.__set_body('Html', text)
+
+    def to_message(self):
+        """
+        Obtains the message as the dictionary which is sent to the stages of
+        the analysis. Its bodies are given as text ('bodyPlain' and
+        'bodyHtml' keys) instead of as stored. The html body of a message
+        without plain text body is not converted ('bodyPlain' is missing).
+
+        Returns
+        -------
+        dict: message without the stored bodies.
+
+        """
+        msg = self.to_mongo().to_dict()
+        for field in ['bodyBase64Plain', 'bodyBase64Html', 'bodyCompressedPlain',
+                      'bodyCompressedHtml', 'bodyHash']:
+            msg.pop(field, None)
+
+        plain = self.__get_body('Plain')
+        if plain is not None:
+            msg['bodyPlain'] = plain
+        html = self.bodyHtml
+        if html is not None:
+            msg['bodyHtml'] = html
+        return msg
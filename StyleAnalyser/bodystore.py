@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jul  2 10:41:19 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+import mongoengine as db
+from bodystorage import CompressedBody
+
+# Whether the bodies of the preprocessed and corrected messages are stored
+# once in the body store (and linked by their hash) and the results of the
+# stages are reused by the messages with the same body
+DEDUPLICATE_BODIES = True
+
+# Spaces at the end of the lines
+TRAILING_SPACES = re.compile(r'[ \t]+(?=\r?\n|$)')
+
+def normalise_body(text):
+    """
+    Normalises the given body (NFC form, without spaces at the end of the
+    lines nor at the beginning and the end of the body), so the bodies which
+    only differ in them have the same hash.
+
+    Parameters
+    ----------
+    text : str
+        Body of a message.
+
+    Returns
+    -------
+    str: normalised body.
+
+    """
+    return TRAILING_SPACES.sub('', unicodedata.normalize('NFC', text)).strip()
+
+def get_body_hash(text, *context):
+    """
+    Obtains the hash of the normalised body. The given context (the rest of
+    the data on which the result of a stage depends) is also hashed.
+
+    Parameters
+    ----------
+    text : str
+        Body of a message.
+    *context : tuple
+        Data of the message (json serializable) which changes the result of
+        the stage.
+
+    Returns
+    -------
+    str: SHA-256 hash in hexadecimal.
+
+    """
+    h = hashlib.sha256(normalise_body(text).encode('utf-8', 'surrogatepass'))
+    if context:
+        h.update(b'\0' + json.dumps(context, sort_keys = True).encode())
+    return h.hexdigest()
+
+class StoredBody(CompressedBody, db.Document):
+    """
+    Class which manage the MongoDB table of the content-addressed body store.
+    Each different body is stored once and the messages which have it are
+    linked by its hash.
+
+    Attributes
+    ----------
+    body_hash: db.StringField
+        Hash of the normalised body.
+    bodyBase64Plain: db.StringField
+        Body as a Base64 encoded plain text.
+    bodyCompressedPlain: db.BinaryField
+        Body as a zlib compressed plain text.
+
+    """
+    body_hash = db.StringField(required = True, primary_key = True)
+    bodyBase64Plain = db.StringField()
+    bodyCompressedPlain = db.BinaryField()
+
+    meta = {
+        'db_alias': 'core',
+        'collection': 'storedbody'
+    }
+
+class StageResult(db.Document):
+    """
+    Class which manage the MongoDB table of the results of the stages of the
+    analysis for each different body, so they are computed once.
+
+    Attributes
+    ----------
+    key: db.StringField
+        Stage and hash of the body and its context ('stage:hash').
+    result: db.DictField
+        Result of the stage.
+    hits: db.IntField
+        Number of times that the result has been reused.
+
+    """
+    key = db.StringField(required = True, primary_key = True)
+    result = db.DictField()
+    hits = db.IntField(default = 0)
+
+    meta = {
+        'db_alias': 'core',
+        'collection': 'stageresult'
+    }
+
+def store_body(text):
+    """
+    Stores the given body in the body store if it was not stored before.
+
+    Parameters
+    ----------
+    text : str
+        Body of a message.
+
+    Returns
+    -------
+    str: hash of the body.
+
+    """
+    body_hash = get_body_hash(text)
+    if StoredBody.objects(body_hash = body_hash).count() == 0:
+        stored = StoredBody(body_hash = body_hash)
+        stored.bodyPlain = text
+        try:
+            stored.save(force_insert = True)
+        except db.NotUniqueError:
+            # Another process has stored it at the same time
+            pass
+    return body_hash
+
+def load_body(body_hash):
+    """
+    Obtains the body with the given hash.
+
+    Parameters
+    ----------
+    body_hash : str
+        Hash of the body.
+
+    Returns
+    -------
+    str: body. It is None if it is not stored.
+
+    """
+    stored = StoredBody.objects(body_hash = body_hash).first()
+    if stored is None:
+        return None
+    return stored.bodyPlain
+
+def set_body(doc, text):
+    """
+    Sets the plain text body of the given message document. If the bodies are
+    deduplicated, it is stored in the body store and the document is linked
+    to it by its hash.
+
+    Parameters
+    ----------
+    doc : Document
+        Message document with a bodyHash field.
+    text : str
+        Body of the message.
+
+    Returns
+    -------
+    None.
+
+    """
+    if DEDUPLICATE_BODIES:
+        doc.bodyPlain = None
+        doc.bodyHash = store_body(text)
+    else:
+        doc.bodyPlain = text
+
+def get_result(stage, key):
+    """
+    Obtains the result of the given stage for a body.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    key : str
+        Hash of the body and its context.
+
+    Returns
+    -------
+    dict: result of the stage. It is None if it has not been computed or the
+    bodies are not deduplicated.
+
+    """
+    if not(DEDUPLICATE_BODIES):
+        return None
+    res = StageResult.objects(key = f'{stage}:{key}').modify(inc__hits = 1)
+    if res is None:
+        return None
+    return res.result
+
+def has_result(stage, key):
+    """
+    Checks whether the result of the given stage for a body has been computed
+    (without counting it as reused).
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    key : str
+        Hash of the body and its context.
+
+    Returns
+    -------
+    bool: whether it is stored. It is False if the bodies are not
+    deduplicated.
+
+    """
+    if not(DEDUPLICATE_BODIES):
+        return False
+    return StageResult.objects(key = f'{stage}:{key}').count() > 0
+
+def save_result(stage, key, result):
+    """
+    Saves the result of the given stage for a body.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    key : str
+        Hash of the body and its context.
+    result : dict
+        Result of the stage.
+
+    Returns
+    -------
+    None.
+
+    """
+    if DEDUPLICATE_BODIES:
+        StageResult.objects(key = f'{stage}:{key}').update_one(
+            set__result = result, upsert = True)
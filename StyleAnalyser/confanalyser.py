@@ -8,13 +8,60 @@ Created on Tue Dec 24 16:28:45 2019
 import spacy
 
 NUM_RESOURCE_PER_LIST = 100
+# Whether the resources of each list page are obtained with batch requests
+BATCH_EXTRACTION = True
+# Number of fetch workers of the concurrent extraction (0 disables it)
+NUM_FETCH_WORKERS = 8
+# Number of parser processes of the extraction of mailbox exports (0 parses
+# them in the main process)
+NUM_PARSE_WORKERS = 4
+# Whether the extractor chooses for each thread of a list page between
+# requesting its messages or the whole thread (otherwise it only requests
+# messages or only threads, depending on the label totals)
+ADAPTIVE_EXTRACTION = True
+# Whether the resources are fetched by the asynchronous engine (it needs
+# aiohttp) instead of the fetch workers
+ASYNC_EXTRACTION = False
+# Whether the identifiers of the extracted messages are loaded in memory once
+# instead of being queried for each list page
+PRELOAD_EXTRACTED_IDS = False
+# Whether only the messages added since the last extraction are extracted
+INCREMENTAL_EXTRACTION = True
+# Number of accounts extracted at the same time by the batch runner (each one
+# in its own process)
+BATCH_ACCOUNT_WORKERS = 4
+
+# Whether the stages of the analysis (preprocessor, typographic corrector and
+# style meter) run in the analyser process instead of as services
+IN_PROCESS_STAGES = True
+# Whether the messages flow through the stages of the analysis as soon as they
+# are extracted (see streaming.py) instead of in a full pass per stage
+STREAMING_PIPELINE = True
+# Maximum number of messages waiting in the queue of each stage
+PIPELINE_QUEUE_SIZE = 200
+# Maximum number of messages sent together to a stage
+STAGE_BATCH_SIZE = 100
+# Maximum number of kept-alive connections to each stage service
+HTTP_POOL_SIZE = 8
+# Seconds to connect to a stage service and to wait for its response
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 120
+# Whether the bodies of the requests to the stage services are compressed
+HTTP_GZIP = True
+# Number of worker threads of each stage of the streaming pipeline
+PREPROCESS_WORKERS = 2
+CORRECTION_WORKERS = 2
+MEASURE_WORKERS = 2
 
 NLP = spacy.load('es_core_news_md')
 
 URL_PREP = "http://localhost:5000/preprocessor"
+URL_PREP_BATCH = "http://localhost:5000/preprocessor/batch"
 URL_TYPO_CORRECT = "http://localhost:4000/typocorrector/correct"
 URL_TYPO_SAVE = "http://localhost:4000/typocorrector/saveoov"
+URL_TYPO_BATCH = "http://localhost:4000/typocorrector/batch"
 URL_MET = "http://localhost:6000/stylemeter"
+URL_MET_BATCH = "http://localhost:6000/stylemeter/batch"
 
 IS_LPUNCT = 'Is it left punctuation?'
 IS_RPUNCT = 'Is it right punctuation?'
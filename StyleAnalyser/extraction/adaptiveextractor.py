@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jun 27 11:34:05 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from __future__ import print_function
+from extraction.messageextractor import MessageExtractor
+from extraction.extractedmessage import ExtractedMessage
+import extraction.confextraction as cfe
+import quotaunits as qu
+from pipelinelog import get_logger
+
+log = get_logger('extraction')
+
+# Prefix of the identifiers of the threads requested by the AdaptiveExtractor
+THREAD_KEY = 'thread:'
+
+class AdaptiveExtractor(MessageExtractor):
+    """
+    Implements MessageExtractor class choosing, for each thread of a list
+    page, whether its pending sent messages are requested one by one or the
+    whole thread is requested. A thread is requested when it is cheaper than
+    its pending messages, taking into account the sent messages of other pages
+    which the previous threads contained (they do not need to be requested
+    again).
+
+    Attributes
+    ----------
+    __groups: dict
+        Pending messages (in the page where it was planned) of each thread
+        which has been requested in this extraction.
+    __threads: int
+        Number of threads obtained.
+    __thread_msgs: int
+        Number of messages of the threads obtained.
+    __thread_extra: int
+        Number of sent messages obtained from threads which were not pending in
+        their page.
+
+    """
+    def __init__(self, service, usu, quota, batch = False, scheduler = None,
+                 num_workers = 0, http_factory = None, async_factory = None):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        service: Gmail resource
+            Gmail API resource with an Gmail user session opened.
+        usu: str
+            Gmail user name.
+        quota: int
+            Gmail API quota units available for message extraction.
+        batch: bool, optional
+            Indicates whether the resources are obtained with batch requests.
+            The default is False.
+        scheduler: QuotaScheduler, optional
+            Rate limiter shared with other extractors. The default is None.
+        num_workers: int, optional
+            Number of fetch workers of the concurrent mode. The default is 0.
+        http_factory: function, optional
+            Function that creates an authorized http object for each fetch
+            worker. The default is None.
+        async_factory: function, optional
+            Function that creates the asynchronous Gmail API client of the
+            asynchronous engine. The default is None.
+
+        Returns
+        -------
+        Constructed AdaptiveExtractor class.
+
+        """
+        super().__init__(service, usu, quota, batch, scheduler, num_workers,
+                         http_factory, async_factory)
+        # It has to be able to send its most expensive request (a thread)
+        self.min_qu = qu.MIN_QUNITS_THRD
+        self.__groups = {}
+        self.__threads = 0
+        self.__thread_msgs = 0
+        self.__thread_extra = 0
+
+    def __is_thread_cheaper(self, npending):
+        """
+        Checks whether requesting a thread is cheaper than requesting its
+        pending messages. The sent messages of other pages which the thread is
+        expected to contain are estimated with the threads obtained before. If
+        both cost the same quota units, the thread is requested (a single
+        request) unless the observed threads are too long.
+
+        Parameters
+        ----------
+        npending : int
+            Number of pending messages of the thread in the list page.
+
+        Returns
+        -------
+        bool: True if the thread has to be requested.
+
+        """
+        expected = npending
+        if self.__threads > 0:
+            expected += self.__thread_extra / self.__threads
+        if qu.THREADS_GET < expected * qu.MSG_GET:
+            return True
+        if qu.THREADS_GET > npending * qu.MSG_GET:
+            return False
+        return (self.__threads == 0 or self.__thread_msgs / self.__threads
+                <= cfe.ADAPTIVE_TIE_THREAD_LENGTH)
+
+    def plan_resources(self, res_list, pending):
+        """
+        Groups the pending messages of a list page by their thread and decides
+        for each thread whether it is requested instead of its messages. The
+        messages of threads which have already been requested are skipped.
+
+        Parameters
+        ----------
+        res_list : list
+            Messages of the list page (with their thread identifier).
+        pending : list
+            Identifiers of the messages which have to be extracted.
+
+        Returns
+        -------
+        list: identifiers of the messages and threads (with the THREAD_KEY
+        prefix) which are requested.
+
+        """
+        pending_ids = set(pending)
+        groups = {}
+        for r in res_list:
+            if r['id'] in pending_ids:
+                groups.setdefault(r.get('threadId', r['id']), []).append(r['id'])
+
+        planned = []
+        nthreads = 0
+        for thread, group in groups.items():
+            if thread in self.__groups and not(self.metadata_first):
+                for resId in group:
+                    log.info('covered by thread', extra = {'user' : self.user_name,
+                                                           'res_id' : resId,
+                                                           'threadId' : thread})
+            elif self.__is_thread_cheaper(len(group)):
+                self.__groups[thread] = set(group)
+                planned.append(THREAD_KEY + thread)
+                nthreads += 1
+            else:
+                planned += group
+
+        log.info('plan', extra = {'user' : self.user_name,
+                                  'pending' : len(pending),
+                                  'threads' : nthreads,
+                                  'messages' : len(planned) - nthreads,
+                                  'quota' : sum(map(self.get_request_qu, planned))})
+        return planned
+
+    def get_request_qu(self, resId):
+        """
+        Obtains the quota units of the request of the given message or thread.
+
+        Parameters
+        ----------
+        resId : str
+            Message's identifier or thread's identifier with the THREAD_KEY
+            prefix.
+
+        Returns
+        -------
+        int: quota units of the request.
+
+        """
+        if resId.startswith(THREAD_KEY):
+            return qu.THREADS_GET
+        return qu.MSG_GET
+
+    def get_request(self, resId):
+        """
+        Obtains the Gmail API request which gets the message or the thread.
+
+        Parameters
+        ----------
+        resId : str
+            Message's identifier or thread's identifier with the THREAD_KEY
+            prefix.
+
+        Returns
+        -------
+        HttpRequest which gets the Gmail API users.messages or users.threads
+        resource.
+
+        """
+        if resId.startswith(THREAD_KEY):
+            t = self.service.users().threads()
+            return t.get(id = resId[len(THREAD_KEY):], userId = 'me',
+                         fields = cfe.ADAPTIVE_THREAD_FIELDS)
+        return super().get_request(resId)
+
+    def get_resource(self, resId):
+        """
+        Obtains the Gmail API message or thread.
+
+        Parameters
+        ----------
+        resId : str
+            Message's identifier or thread's identifier with the THREAD_KEY
+            prefix.
+
+        Returns
+        -------
+        Gmail API users.messages or users.threads resource.
+
+        """
+        if resId.startswith(THREAD_KEY):
+            self.wait_for_request(qu.THREADS_GET)
+            t = self.execute_request(self.get_request(resId), qu.THREADS_GET)
+            self.update_attributes(qu.THREADS_GET)
+            return t
+        return super().get_resource(resId)
+
+    def __get_new_sent_msgs(self, thread, group):
+        """
+        Obtains the sent messages of a thread which were not pending in the
+        page where it was planned and which were not extracted before.
+
+        Parameters
+        ----------
+        thread : Gmail API resource
+            Gmail API users.threads resource.
+        group : set
+            Pending messages of the thread in the page where it was planned.
+
+        Returns
+        -------
+        set: identifiers of the messages.
+
+        """
+        if self.metadata_first:
+            # The messages of other pages have not passed the filters yet
+            return set()
+        sent = [m['id'] for m in thread['messages']
+                if not(m['id'] in group) and 'SENT' in m.get('labelIds', [])]
+        if not(sent):
+            return set()
+        if self.extracted_ids is not None:
+            return set(sent) - self.extracted_ids
+        return set(sent) - set(ExtractedMessage.objects(msg_id__in = sent)
+                               .scalar('msg_id'))
+
+    def extract_msgs_from_resource(self, res):
+        """
+        Obtains a list of extracted messages. If it is a thread, only its
+        pending messages and its sent messages which were not extracted before
+        are extracted.
+
+        Parameters
+        ----------
+        res : Gmail API resource
+            Gmail API users.messages or users.threads resource.
+
+        Returns
+        -------
+        A list of ExtractedMessage objects.
+
+        """
+        if not('messages' in res):
+            return super().extract_msgs_from_resource(res)
+
+        group = self.__groups.get(res['id'], set())
+        new_sent = self.__get_new_sent_msgs(res, group)
+        self.__threads += 1
+        self.__thread_msgs += len(res['messages'])
+        self.__thread_extra += len(new_sent)
+
+        l_msgs = []
+        for m in res['messages']:
+            if m['id'] in group or m['id'] in new_sent:
+                l_msgs += super().extract_msgs_from_resource(m)
+        return l_msgs
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jun 29 09:48:16 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import asyncio
+import json
+import aiohttp
+import httplib2
+from google.auth.transport.requests import Request
+from googleapiclient.errors import HttpError
+import extraction.confextraction as cfe
+
+class AsyncGmailClient:
+    """
+    Asynchronous client of the Gmail REST API. It executes the requests built
+    by the discovery client (HttpRequest objects, which are not executed) with
+    a single aiohttp session, so the connections are reused by every request.
+    It is used as an asynchronous context manager.
+
+    Attributes
+    ----------
+    creds: Credentials
+        Credentials of the Gmail user session.
+    concurrency: int
+        Maximum number of open connections.
+    timeout: float
+        Seconds after which a request is cancelled.
+    __session: aiohttp.ClientSession
+        Session of the client (None if it is closed).
+    __refresh_lock: asyncio.Lock
+        Lock which makes the concurrent requests refresh the credentials once.
+
+    """
+    def __init__(self, creds, concurrency = cfe.ASYNC_CONCURRENCY,
+                 timeout = cfe.ASYNC_TIMEOUT):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        creds : Credentials
+            Credentials of the Gmail user session.
+        concurrency : int, optional
+            Maximum number of open connections. The default is
+            cfe.ASYNC_CONCURRENCY.
+        timeout : float, optional
+            Seconds after which a request is cancelled. The default is
+            cfe.ASYNC_TIMEOUT.
+
+        Returns
+        -------
+        Constructed AsyncGmailClient class.
+
+        """
+        self.creds = creds
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.__session = None
+        self.__refresh_lock = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit = self.concurrency)
+        self.__session = aiohttp.ClientSession(
+            connector = connector,
+            timeout = aiohttp.ClientTimeout(total = self.timeout))
+        self.__refresh_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.__session.close()
+        self.__session = None
+
+    def __refresh(self):
+        """
+        Refreshes the credentials (it blocks until the new token is obtained).
+
+        Returns
+        -------
+        None.
+
+        """
+        self.creds.refresh(Request())
+
+    async def __get_token(self):
+        """
+        Obtains the access token of the credentials. If it has expired, it is
+        refreshed in a thread of the default executor, so the event loop is
+        not blocked.
+
+        Returns
+        -------
+        str: access token.
+
+        """
+        if not(self.creds.valid):
+            async with self.__refresh_lock:
+                if not(self.creds.valid):
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, self.__refresh)
+        return self.creds.token
+
+    async def execute(self, req):
+        """
+        Executes the given Gmail API request.
+
+        Parameters
+        ----------
+        req : HttpRequest
+            Gmail API request built by the discovery client.
+
+        Raises
+        ------
+        HttpError
+            If the response is an error (as the discovery client does).
+        ConnectionError
+            If the connection fails (aiohttp errors are raised as the errors
+            of the synchronous transport, so they are retried in the same way).
+        TimeoutError
+            If the request is cancelled because of the timeout.
+
+        Returns
+        -------
+        dict: response of the Gmail API request.
+
+        """
+        headers = dict(req.headers)
+        headers['authorization'] = f'Bearer {await self.__get_token()}'
+        try:
+            async with self.__session.request(req.method, req.uri,
+                                              data = req.body,
+                                              headers = headers) as resp:
+                content = await resp.read()
+                status = resp.status
+                info = {k.lower() : v for k, v in resp.headers.items()}
+        except asyncio.TimeoutError as e:
+            raise TimeoutError(f'{req.method} {req.uri} timed out') from e
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f'{req.method} {req.uri}: {e!r}') from e
+        
+        if status >= 300:
+            info['status'] = status
+            raise HttpError(httplib2.Response(info), content, uri = req.uri)
+        return json.loads(content)
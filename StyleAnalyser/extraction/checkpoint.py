@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jun 25 11:08:19 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import mongoengine as db
+import quotaunits as qu
+from datetime import datetime
+from datetime import timedelta
+
+class ExtractionCheckpoint(db.Document):
+    """
+    Class which manage the MongoDB table about the progress of the extraction
+    of each user and extractor type, so an interrupted extraction can be
+    resumed automatically.
+    
+    Attributes
+    ----------
+    checkpoint_id: db.StringField
+        Identifier of the checkpoint (user name and extractor type).
+    user_name: db.StringField
+        Gmail user name.
+    extractor: db.StringField
+        Type of the extractor (key of its list of resources: 'messages' or
+        'threads').
+    pageToken: db.StringField
+        Page token of the page from which the extraction has to continue.
+    doneIds: db.ListField
+        Identifiers of the resources of that page which are already done.
+    extracted: db.IntField
+        Number of resources extracted since the extraction started.
+    quota: db.IntField
+        Remaining Gmail API quota units when the checkpoint was saved.
+    updated: db.DateTimeField
+        Moment in which the checkpoint was saved.
+    finished: db.BooleanField
+        Indicates whether the extraction has finished.
+        
+    """
+    checkpoint_id = db.StringField(required = True, primary_key = True)
+    user_name = db.StringField(required = True)
+    extractor = db.StringField(required = True)
+    pageToken = db.StringField()
+    doneIds = db.ListField(db.StringField())
+    extracted = db.IntField(default = 0)
+    quota = db.IntField()
+    updated = db.DateTimeField()
+    finished = db.BooleanField(default = False)
+    
+    meta = {
+        'db_alias': 'core',
+        'collection': 'extractioncheckpoint'
+    }
+    
+    def get_remaining_quota(self):
+        """
+        Obtains the remaining Gmail API quota units. If a day has passed since
+        the checkpoint was saved, the quota units of a whole day are available.
+
+        Returns
+        -------
+        int: remaining quota units.
+
+        """
+        if (self.quota is None or self.updated is None or 
+            datetime.utcnow() - self.updated >= timedelta(days = 1)):
+            return qu.QUOTA_UNITS_PER_DAY
+        return self.quota
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jun 15 10:12:41 2020
+
+@author: Carlos Moreno Morera
+"""
+
+# Maximum number of requests that Gmail API accepts in a batch request
+MAX_BATCH_REQUESTS = 100
+
+# Maximum number of extracted messages buffered before inserting them
+WRITER_MAX_DOCS = 500
+# Maximum size (bytes of BSON) of the buffered extracted messages
+WRITER_MAX_BYTES = 8 * 1024 * 1024
+
+# Partial responses: fields of a message part which are read by DataExtractor
+PART_FIELDS = 'mimeType,headers(name,value),body/data'
+# Fields of a message which are read by the extractors (parts nested deeper
+# than three levels are requested entirely)
+MSG_FIELDS = ('id,threadId,internalDate,payload(' + PART_FIELDS + ',parts('
+              + PART_FIELDS + ',parts(' + PART_FIELDS + ',parts)))')
+# Fields of a thread which are read by the extractors
+THREAD_FIELDS = 'id,messages(' + MSG_FIELDS + ')'
+# Fields of a page of the message and thread lists (the AdaptiveExtractor needs
+# the thread of each message)
+MSG_LIST_FIELDS = 'messages(id,threadId),nextPageToken'
+THREAD_LIST_FIELDS = 'threads/id,nextPageToken'
+# Fields of a page of the history list
+HISTORY_FIELDS = ('history/messagesAdded/message(id,threadId,labelIds),'
+                  + 'nextPageToken,historyId')
+
+# Whether the messages are first requested with format metadata so that only
+# the ones which pass the following filters are requested entirely. Both
+# requests cost the same quota units, so it only saves transferred bytes.
+METADATA_FIRST = False
+# Headers requested with format metadata
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Cc', 'Bcc', 'References',
+                    'Content-Type']
+# Fields of a message requested with format metadata
+METADATA_FIELDS = 'id,sizeEstimate,payload/headers'
+# Maximum depth (number of references) of an extracted message (None: no limit)
+MAX_DEPTH = None
+# Minimum and maximum size estimate (bytes) of an extracted message (None: no
+# limit)
+MIN_SIZE_ESTIMATE = None
+MAX_SIZE_ESTIMATE = None
+
+# Labels (X-Gmail-Labels header of Google Takeout exports) of the sent
+# messages of a mailbox export
+MAILBOX_SENT_LABELS = ['Sent', 'Enviados']
+# Number of messages of a mailbox export parsed by each task of the pool
+MAILBOX_CHUNK = 64
+# Tasks read in advance per parser process (bounds the memory used)
+MAILBOX_TASKS_PER_WORKER = 4
+
+# IMAP server of the IMAP extraction (it needs an app password)
+IMAP_HOST = 'imap.gmail.com'
+IMAP_PORT = 993
+# Folder of the sent messages (quoted because of the space)
+IMAP_SENT_FOLDER = '"[Gmail]/Sent Mail"'
+# Maximum number of messages requested by each UID FETCH command
+IMAP_FETCH_BATCH = 200
+# Number of UID FETCH commands sent before reading their responses
+IMAP_PIPELINE_DEPTH = 4
+
+# Fields of a thread requested by the AdaptiveExtractor (the labels are needed
+# to keep only its sent messages)
+ADAPTIVE_THREAD_FIELDS = 'id,messages(labelIds,' + MSG_FIELDS + ')'
+# If requesting a thread costs the same quota units as requesting its pending
+# messages one by one, the AdaptiveExtractor requests the thread only if the
+# observed mean number of messages per thread does not exceed this one
+ADAPTIVE_TIE_THREAD_LENGTH = 3
+
+# Retries of the Gmail API requests which fail because of rate limit errors or
+# transient errors. HTTP statuses which are always retried:
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Reasons of 403 errors which are retried (the rest are permanent)
+RETRY_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'backendError'}
+# Maximum number of retries of a request
+MAX_RETRIES = 6
+# Seconds of the first backoff (it is doubled in each retry) and maximum
+# seconds of a backoff. Each backoff is a random time up to this limit.
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 64
+
+# Maximum number of Gmail API requests in flight of the asynchronous engine
+# (it is also limited by the quota units per second of a request)
+ASYNC_CONCURRENCY = 50
+# Seconds after which a request of the asynchronous engine is cancelled
+ASYNC_TIMEOUT = 60
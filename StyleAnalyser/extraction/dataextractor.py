@@ -7,8 +7,7 @@ Created on Tue Nov 12 14:32:54 2019
 
 from __future__ import print_function
 import base64
-
-NUM_HEADERS = 7
+from softbreaks import remove_soft_breaks
 
 class DataExtractor:
     """
@@ -98,118 +97,52 @@ class DataExtractor:
         """
         return ('body' in part and 'data' in part['body'])
 
-    def __get_headers(self, headers):
+    def __index_headers(self, part):
         """
-        Obtains the attributes of this class that we can find in the headers
-        list of a MIME message.
+        Builds the index of the headers of the given MIME message part. The
+        names of the headers are case-insensitive, so they are stored in lower
+        case. If a header is repeated, its first value is kept.
 
         Parameters
         ----------
-        headers: list
-            List of MIME message headers.
+        part : dict
+            MIME message part (or payload of the message).
 
         Returns
         -------
-        str: header Content-Type of the MIME message.
+        dict: value of each header by its name in lower case.
 
         """
-        i = 0
-        found = 0
-        cont_type = None
-        while (i < len(headers) and found < NUM_HEADERS):
-            if (headers[i]['name'] == 'Content-Type'):
-                cont_type = headers[i]['value']
-                found += 1
-            elif (headers[i]['name'] == 'Subject'):
-                self.__subject = headers[i]['value']
-                found += 1
-            elif (headers[i]['name'] == 'From'):
-                self.__sender = headers[i]['value']
-                found += 1
-            elif (headers[i]['name'] == 'To' 
-                  and headers[i]['value'] != 'undisclosed-recipients:;'):
-                self.__to = headers[i]['value'].split(',')
-                found += 1
-            elif (headers[i]['name'] == 'Cc'):
-                self.__cc = headers[i]['value'].split(',')
-                found += 1
-            elif (headers[i]['name'] == 'Bcc'):
-                self.__bcc = headers[i]['value'].split(',')
-                found += 1
-            elif (headers[i]['name'] == 'References'):
-                self.__references = headers[i]['value']
-                found += 1
-            i += 1
-        return cont_type
+        return {h['name'].lower() : h['value']
+                for h in reversed(part.get('headers', []))}
 
-    def __get_Content_Type(self, message):
+    def __get_headers(self, headers):
         """
-        Gets the content type of a message or a part of a message.
+        Obtains the attributes of this class that we can find in the headers
+        of a MIME message.
 
         Parameters
         ----------
-        message : Gmail API users.messages resource
-            Message resource we want to extract the Content-Type MIME message
-            header.
+        headers: dict
+            Index of the MIME message headers.
 
         Returns
         -------
         str: header Content-Type of the MIME message.
 
         """
-        i = 0
-        headers = message['headers']
-        n = len(headers)
-    
-        while (i < n and headers[i]['name'] != 'Content-Type'):
-            i = i + 1
-    
-        if i < n:
-            return headers[i]['value']
-        
-    def __get_Content_Encoding(self, part):
-        """
-        Gets the content type of a message or a part of a message.
-
-        Parameters
-        ----------
-        part : dict
-            MIME part we want to extract the Content-Transfer-Encoding MIME 
-            message header.
-
-        Returns
-        -------
-        str: header Content-Transfer-Encoding of the MIME message.
-
-        """
-        i = 0
-        headers = part['headers']
-        n = len(headers)
-    
-        while (i < n and headers[i]['name'] != 'Content-Transfer-Encoding'):
-            i = i + 1
-    
-        if i < n:
-            return headers[i]['value']
-
-    def __get_part_type(self, part):
-        """
-        Gets the MIME type of the given MIME message part.
-
-        Parameters
-        ----------
-        part: dict
-            MIME message part.
-
-        Returns
-        -------
-        str: type of the MIME message part.
+        self.__subject = headers.get('subject')
+        self.__sender = headers.get('from')
+        self.__references = headers.get('references')
         
-        """
-        if ('mimeType' in part):
-            return part['mimeType']
-        else:
-            return self.__get_Content_Type(part)
+        to = headers.get('to')
+        if (to is not None and to != 'undisclosed-recipients:;'):
+            self.__to = to.split(',')
+        if 'cc' in headers:
+            self.__cc = headers['cc'].split(',')
+        if 'bcc' in headers:
+            self.__bcc = headers['bcc'].split(',')
+        return headers.get('content-type')
 
     def __is_type(self, t, part, p_type):
         """
@@ -232,40 +165,55 @@ class DataExtractor:
         """
         return p_type.startswith(t) and self.__is_there_data(part)
     
-    def __clean_html_text(self, text):
+    def __read_text_part(self, part, p_type, headers):
         """
-        Removes soft break lines of the message body.
+        Stores the body of the given MIME message part if it is a leaf of the
+        MIME type tree with plain or html text.
 
         Parameters
         ----------
-        text: str
-            Message body
+        part: dict
+            MIME message part.
+        p_type: str
+            Type of the given MIME message part.
+        headers: dict
+            Index of the headers of the given MIME message part. It is None if
+            it has not been built yet.
 
         Returns
         -------
-        str: Message body without soft break lines.
+        str: 'plain' or 'html' depending on the stored body, None if the part
+        has not got text.
         
         """
-        new_text = ""
-        i = 0
-        n = len(text)
-        while i < n:
-            if (text[i] == '\r' and (i + 1 < n) and text[i + 1] == '\n'):
-                i += 2
-                while((i + 1 < n) and text[i] == '\r' and text[i + 1] == '\n'):
-                    new_text = new_text + text[i] + text[i + 1]
-                    i += 2
+        if (self.__is_type('text/plain', part, p_type)):
+            if headers is None:
+                headers = self.__index_headers(part)
+            self.__plain_text = self.__dec_b64(part['body']['data'])
+            self.__plain_encod = headers.get('content-transfer-encoding')
+            return 'plain'
+        
+        if (self.__is_type('text/html', part, p_type)):
+            if headers is None:
+                headers = self.__index_headers(part)
+            if (headers.get('content-transfer-encoding') == 'quoted-printable'):
+                self.__html_text = remove_soft_breaks(
+                    self.__dec_b64(part['body']['data']))
             else:
-                new_text += text[i]
-                i += 1
-    
-        return new_text
+                self.__html_text = self.__dec_b64(part['body']['data'])
+            return 'html'
+        return None
 
     def __get_text_content(self, msg_parts):
         """
         Get the body of the message as plain text and as html text if they
         exist. This function visits the tree nodes following the pre-order 
-        traversal until it finds what it is looking for.
+        traversal until it finds what it is looking for. The traversal is
+        iterative: when it visits a multipart node, the list of parts and the
+        position of the node are pushed on a stack, and when every part of the
+        node has been visited (or both bodies have been found among them) it
+        continues with the next sibling of the node keeping the found flags of
+        its parts.
 
         Parameters
         ----------
@@ -274,39 +222,45 @@ class DataExtractor:
 
         Returns
         -------
-        plain_found: bool
-            Indicates if the body of the message as plain text has been found.
-        html_found: bool
-            Indicates if the body of the message as html text has been found.
+        None.
 
         """
+        stack = []
+        parts = msg_parts
         i = 0
-        n = len(msg_parts)
         plain_found = False
         html_found = False
-    
-        while ((not(plain_found) or not(html_found)) and i < n):
-            part = msg_parts[i]
-
-            p_type = self.__get_part_type(part)
+        while True:
+            if ((plain_found and html_found) or i >= len(parts)):
+                if not stack:
+                    break
+                parts, i = stack.pop()
+                i += 1
+                continue
+            
+            part = parts[i]
+            headers = None
+            if 'mimeType' in part:
+                p_type = part['mimeType']
+            else:
+                headers = self.__index_headers(part)
+                p_type = headers.get('content-type')
+                
             if (p_type is not None):
                 if (p_type.startswith('multipart') and 'parts' in part):
-                    plain_found, html_found = self.__get_text_content(part['parts'])
-                elif (self.__is_type('text/plain', part, p_type)):
-                    self.__plain_text = self.__dec_b64(part['body']['data'])
-                    self.__plain_encod = self.__get_Content_Encoding(part)
+                    stack.append((parts, i))
+                    parts = part['parts']
+                    i = 0
+                    plain_found = False
+                    html_found = False
+                    continue
+                
+                found = self.__read_text_part(part, p_type, headers)
+                if found == 'plain':
                     plain_found = True
-                elif (self.__is_type('text/html', part, p_type)):
-                    if (self.__get_Content_Encoding(part) == 'quoted-printable'):
-                        self.__html_text = self.__clean_html_text(
-                            self.__dec_b64(part['body']['data']))
-                    else:
-                        self.__html_text = self.__dec_b64(part['body']['data'])
+                elif found == 'html':
                     html_found = True
-    
             i += 1
-            
-        return plain_found, html_found
     
     def __get_message_text(self, message):
         """
@@ -323,22 +277,16 @@ class DataExtractor:
         
         """
         pld = message['payload']
-        mimetype = self.__get_headers(pld['headers'])
+        headers = self.__index_headers(pld)
+        mimetype = self.__get_headers(headers)
         if 'mimeType' in pld:
             mimetype = pld['mimeType']
 
         if mimetype is not None:
             if mimetype.startswith('multipart/'):
                 self.__get_text_content(pld['parts'])
-            elif (self.__is_type('text/plain', pld, mimetype)):
-                self.__plain_text = self.__dec_b64(pld['body']['data'])
-                self.__plain_encod = self.__get_Content_Encoding(pld)
-            elif (self.__is_type('text/html', pld, mimetype)):
-                if (self.__get_Content_Encoding(pld) == 'quoted-printable'):
-                    self.__html_text = self.__clean_html_text(
-                        self.__dec_b64(pld['body']['data']))
-                else:
-                    self.__html_text = self.__dec_b64(pld['body']['data'])
+            else:
+                self.__read_text_part(pld, mimetype, headers)
 
     def set_new_message(self, msg):
         """
@@ -6,8 +6,9 @@ Created on Mon Mar  9 17:45:20 2020
 """
 
 import mongoengine as db
+from bodystorage import CompressedBody
 
-class ExtractedMessage(db.Document):
+class ExtractedMessage(CompressedBody, db.Document):
     """
     Class which manage the MongoDB table about the extracted messages.
     
@@ -37,8 +38,12 @@ class ExtractedMessage(db.Document):
         Message's subject.
     bodyBase64Plain: db.StringField
         Message's body as a Base64 encoded plain text.
+    bodyCompressedPlain: db.BinaryField
+        Message's body as a zlib compressed plain text.
     bodyBase64Html: db.StringField
         Message's body as a Base64 encoded html text.
+    bodyCompressedHtml: db.BinaryField
+        Message's body as a zlib compressed html text.
     plainEncoding: db.StringField
         Original message's encoding.
     charLength: db.IntField
@@ -56,6 +61,8 @@ class ExtractedMessage(db.Document):
     subject = db.StringField()
     bodyBase64Plain = db.StringField()
     bodyBase64Html = db.StringField()
+    bodyCompressedPlain = db.BinaryField()
+    bodyCompressedHtml = db.BinaryField()
     plainEncoding = db.StringField()
     charLength = db.IntField()
     
@@ -7,14 +7,30 @@ Created on Tue Nov 12 14:32:54 2019
 
 from __future__ import print_function
 import abc
+import asyncio
 import quotaunits as qu
 from abc import ABC
 from abc import ABCMeta
+import threading
 from time import time
 from time import sleep
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from extraction.dataextractor import DataExtractor
-from html2text import HTML2Text
 from extraction.extractedmessage import ExtractedMessage
+import extraction.confextraction as cfe
+from extraction.quotascheduler import QuotaScheduler
+from extraction.messagewriter import MessageWriter
+from extraction.syncstate import SyncState
+from extraction.checkpoint import ExtractionCheckpoint
+from extraction.quotausage import QuotaUsage
+from datetime import datetime
+from googleapiclient.errors import HttpError
+from extraction.retrypolicy import is_retryable, is_not_found, get_backoff_delay
+from pipelinelog import get_logger
+
+log = get_logger('extraction')
 
 class Extractor(ABC):
     """
@@ -28,27 +44,66 @@ class Extractor(ABC):
         Gmail API resource with an Gmail user session opened.
     user_name: str
         Gmail user name.
-    quota: int
+    quota: int (read-only property)
         Gmail API quota units available for message extraction. Represents the
         remaining quota units available to carry out the extraction operations.
-    init_time: float 
-        Moment in which the second of operations begins.
+    quota_sec: int (read-only property)
+        Gmail API quota units that can be consumed right now without exceeding
+        the quota units per second.
+    scheduler: QuotaScheduler
+        Token-bucket rate limiter which manages the Gmail API quota units. It
+        can be shared by several extractors or fetch workers.
     last_req_time: float
         Moment in which the last Gmail API request was made.
-    quota_sec: int
-        Remaining Gmail API quota units per second from init_time moment.
     data_extractor: DataExtractor
         Class that allows us to extract the information from a message.
     min_qu: int (abstract attribute)
         Minimum quota units needed to make a request of the resource.
+    get_qu: int (abstract attribute)
+        Quota units needed to get one resource.
+    list_qu: int
+        Quota units needed to get a page of the list of resources (only the
+        Gmail API extractors have it).
     list_key: str (abstract attribute)
         Key of the dictionary given by the list request for accessing to the
         list of the resource.
-    html_converter: HTML2Text
-        Class that converts the HTML code in plain text.
+    history_key: str (abstract attribute)
+        Key of the messages given by the history request whose value is the
+        identifier of the resource which contains them.
+    batch: bool
+        Indicates whether the resources of each list page are obtained by
+        grouping their requests in Gmail API batch requests. In the concurrent
+        mode, each fetch worker executes batch requests.
+    num_workers: int
+        Number of fetch workers of the concurrent mode. If it is 0, the
+        resources are fetched by the thread which parses and saves them.
+    http_factory: function
+        Function without parameters that creates an authorized http object.
+        Each fetch worker uses its own http object because they can not be
+        shared between threads.
+    async_factory: function
+        Function without parameters that creates the asynchronous Gmail API
+        client (see AsyncGmailClient) of the asynchronous engine. If it is not
+        None, the resources are fetched by the asynchronous engine.
+    extracted_ids: set
+        Identifiers of the messages stored in the database. It is None unless
+        they have been loaded with load_extracted_ids, in which case it is
+        used instead of querying the database.
+    writer: MessageWriter
+        Buffered writer which inserts the extracted messages in the database.
+    listeners: list
+        Functions which are called with the ExtractedMessage objects that
+        have been inserted in the database in each flush of the writer.
+    checkpoint: ExtractionCheckpoint
+        Progress of the current extraction, which is saved after each page.
+    metadata_first: bool
+        Indicates whether the metadata of the resources is requested before
+        them so that only the ones which pass the filters of the specific
+        extractor are requested entirely.
     
     """
-    def __init__(self, service, usu, quota):
+    def __init__(self, service, usu, quota, batch = False, scheduler = None,
+                 num_workers = 0, http_factory = None, async_factory = None):
         """
         Class constructor.
 
@@ -60,6 +115,21 @@ class Extractor(ABC):
             Gmail user name.
         quota: int
             Gmail API quota units available for message extraction.
+        batch: bool, optional
+            Indicates whether the resources are obtained with batch requests.
+            The default is False.
+        scheduler: QuotaScheduler, optional
+            Rate limiter shared with other extractors. The default is None,
+            which means that a new one is created with the given quota.
+        num_workers: int, optional
+            Number of fetch workers of the concurrent mode. The default is 0
+            (concurrent mode disabled).
+        http_factory: function, optional
+            Function that creates an authorized http object for each fetch
+            worker. It is needed in the concurrent mode. The default is None.
+        async_factory: function, optional
+            Function that creates the asynchronous Gmail API client. It enables
+            the asynchronous engine. The default is None.
 
         Returns
         -------
@@ -69,21 +139,45 @@ class Extractor(ABC):
         __metaclass__ = ABCMeta
         self.service = service
         self.user_name = usu
-        self.quota = quota
-        self.quota_sec = qu.QUOTA_UNITS_PER_SECOND
+        if scheduler is None:
+            scheduler = QuotaScheduler(quota)
+        self.scheduler = scheduler
         self.data_extractor = DataExtractor()
-        self.html_converter = HTML2Text()
-        self.html_converter.ignore_emphasis = True
-        self.html_converter.ignore_links = True
-        self.html_converter.ignore_images = True
-        self.html_converter.ignore_tables = True
-        self.init_time = time()
         self.last_req_time = time()
+        self.batch = batch
+        self.num_workers = num_workers
+        self.http_factory = http_factory
+        self.async_factory = async_factory
+        self.__thread_data = threading.local()
+        self.extracted_ids = None
+        self.writer = MessageWriter(self.user_name, self.__register_inserted)
+        self.listeners = []
+        self.checkpoint = None
+        self.__base_extracted = 0
+        self.__done_ids = set()
+        self.__skip_stored = False
+        self.__reached_end = False
+        self.metadata_first = False
+        
+    @property
+    def quota(self):
+        """
+        Remaining Gmail API quota units available for message extraction.
+        """
+        return self.scheduler.get_remaining()
+    
+    @property
+    def quota_sec(self):
+        """
+        Gmail API quota units available in the current second.
+        """
+        return self.scheduler.get_available_per_second()
 
     def update_attributes(self, req_quota):
         """
-        Update the quota, quota_sec and last_req_time attributes of this class
-        after making a Gmail API request with the req_quota quota units.
+        Update the last_req_time attribute of this class after making a Gmail
+        API request with the req_quota quota units. The quota units were
+        already consumed from the scheduler by wait_for_request.
 
         Parameters
         ----------
@@ -96,15 +190,12 @@ class Extractor(ABC):
 
         """
         self.last_req_time = time()
-        self.quota = self.quota - req_quota
-        self.quota_sec = self.quota_sec - req_quota
 
     def wait_for_request(self, req_quota):
         """
-        Avoid exceeding Gmail API quota units per second by waiting for the time
-        needed to make the request with req_quota quota units. Besides this
-        method updates the init_time attribute if from init_time until now more
-        than a second has passed.
+        Avoid exceeding Gmail API quota units per second (and per day) by
+        waiting until the scheduler has the req_quota quota units available.
+        These quota units are consumed when the method returns.
 
         Parameters
         ----------
@@ -116,19 +207,7 @@ class Extractor(ABC):
         None.
 
         """
-        slept = False
-        t_now = time()
-        # If we are going to exceed the quota units per second in this last second
-        # or the init_time attribute is not updated
-        if ((t_now - self.init_time <= 1 and req_quota >= self.quota_sec)
-            or (t_now - self.init_time > 1 and t_now - self.last_req_time <= 1)):
-            slept = True
-            sleep(1.1 - (t_now - self.last_req_time))
-
-        if slept or (t_now - self.init_time > 1):
-            self.quota_sec = qu.QUOTA_UNITS_PER_SECOND
-            self.init_time = time()
-            self.last_req_time = time()
+        self.scheduler.acquire(req_quota)
 
     @abc.abstractmethod
     def get_list(self, nextPage):
@@ -155,6 +234,48 @@ class Extractor(ABC):
         """
         pass
 
+    def get_list_request(self, nextPage):
+        """
+        Obtains the Gmail API request which gets a page of the list of
+        resources. The Gmail API extractors implement it, the asynchronous
+        engine needs it.
+
+        Parameters
+        ----------
+        nextPage : str
+            Page token to retrieve a specific page of results in the list.
+
+        Raises
+        ------
+        NotImplementedError
+            If the extractor does not use Gmail API.
+
+        Returns
+        -------
+        HttpRequest which gets the page of the list.
+
+        """
+        raise NotImplementedError(f'{type(self).__name__} has not list requests.')
+
+    @abc.abstractmethod
+    def get_request(self, resId):
+        """
+        Obtains the Gmail API request (not executed yet) which gets the resource
+        of the specific extractor.
+
+        Parameters
+        ----------
+        resId : str
+            Resource's identifier that we want to retrieve.
+
+        Returns
+        -------
+        HttpRequest which gets the resource (thread or message) depending on
+        the specific extractor.
+
+        """
+        pass
+
     @abc.abstractmethod
     def get_resource(self, resId):
         """
@@ -190,6 +311,1211 @@ class Extractor(ABC):
         """
         pass
 
+    def get_metadata_request(self, resId):
+        """
+        Obtains the Gmail API request (not executed yet) which gets only the
+        metadata of the resource of the specific extractor. It is needed if
+        metadata_first is True.
+
+        Parameters
+        ----------
+        resId : str
+            Resource's identifier whose metadata we want to retrieve.
+
+        Returns
+        -------
+        HttpRequest which gets the metadata of the resource.
+
+        """
+        pass
+
+    def is_worth_extracting(self, metadata):
+        """
+        Checks whether a resource passes the filters of the specific extractor
+        and so it has to be requested entirely.
+
+        Parameters
+        ----------
+        metadata : dict
+            Response of the request given by get_metadata_request.
+
+        Returns
+        -------
+        bool: True if the resource has to be extracted.
+
+        """
+        return True
+
+    def get_request_qu(self, resId):
+        """
+        Obtains the quota units of the request of the given resource. Every
+        request of the specific extractors costs get_qu, but an extractor can
+        combine requests of several kinds of resources.
+
+        Parameters
+        ----------
+        resId : str
+            Resource's identifier.
+
+        Returns
+        -------
+        int: quota units of the request.
+
+        """
+        return self.get_qu
+
+    def plan_resources(self, res_list, pending):
+        """
+        Obtains the identifiers of the resources which are requested to
+        extract the pending resources of a list page. The specific extractors
+        request the pending resources themselves, but an extractor can replace
+        some of them by other resources which contain them.
+
+        Parameters
+        ----------
+        res_list : list
+            Resources of the list page.
+        pending : list
+            Identifiers of the resources which have to be extracted.
+
+        Returns
+        -------
+        list: identifiers of the resources which are requested.
+
+        """
+        return pending
+
+    def __get_http(self):
+        """
+        Obtains the http object of the current thread. Each fetch worker
+        creates its own one with http_factory.
+
+        Returns
+        -------
+        Authorized http object. It is None if there is not http_factory (the
+        one of the service is used).
+
+        """
+        if self.http_factory is None:
+            return None
+        if not hasattr(self.__thread_data, 'http'):
+            self.__thread_data.http = self.http_factory()
+        return self.__thread_data.http
+
+    def get_resources(self, res_ids, get_request = None, acquired = False):
+        """
+        Obtains the Gmail API resources of the specific extractor by grouping
+        their requests in a single batch request. Every request of the batch is
+        charged against the quota units. The requests which fail because of a
+        rate limit error or a transient error are retried (only them) in a new
+        batch request with jittered exponential backoff. The resources which
+        no longer exist (404) are skipped, so the rest of the batch is kept.
+
+        Parameters
+        ----------
+        res_ids : list
+            Identifiers of the resources that we want to retrieve. Its length
+            must not exceed cfe.MAX_BATCH_REQUESTS.
+        get_request : function, optional
+            Function which creates the request of each resource. It must cost
+            the quota units given by get_request_qu. The default is None, which
+            means get_request.
+        acquired : bool, optional
+            Whether the quota units of the requests have already been consumed
+            (by the concurrent mode). The default is False.
+
+        Raises
+        ------
+        HttpError
+            If a request fails with a permanent error (other than 404) or it
+            fails again after the last retry.
+
+        Returns
+        -------
+        list: Gmail API resources (threads or messages) in the same order as
+        their identifiers in res_ids. It is None for the resources which were
+        not found.
+
+        """
+        responses = {}
+        errors = {}
+
+        def store_response(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                responses[request_id] = response
+
+        if get_request is None:
+            get_request = self.get_request
+        pending = list(res_ids)
+        req_quota = sum(self.get_request_qu(resId) for resId in pending)
+        if not(acquired):
+            self.wait_for_request(req_quota)
+        http = self.__get_http()
+        attempt = 0
+        while pending:
+            errors.clear()
+            batch = self.service.new_batch_http_request(callback = store_response)
+            for resId in pending:
+                batch.add(get_request(resId), request_id = resId)
+            try:
+                if http is None:
+                    batch.execute()
+                else:
+                    batch.execute(http = http)
+            except Exception as e:
+                # The whole batch request has failed
+                if attempt >= cfe.MAX_RETRIES or not(is_retryable(e)):
+                    raise
+                errors.update((resId, e) for resId in pending
+                              if not(resId in responses))
+            self.update_attributes(req_quota)
+
+            pending = [resId for resId in pending if resId in errors]
+            for resId in pending:
+                if is_not_found(errors[resId]):
+                    log.warning('not found', extra = {'user' : self.user_name,
+                                                      'res_id' : resId})
+            pending = [resId for resId in pending if not(is_not_found(errors[resId]))]
+            if pending:
+                failed = [errors[resId] for resId in pending]
+                permanent = [e for e in failed if not(is_retryable(e))]
+                if permanent:
+                    raise permanent[0]
+                if attempt >= cfe.MAX_RETRIES:
+                    raise failed[0]
+                req_quota = sum(self.get_request_qu(resId) for resId in pending)
+                self.__backoff(failed[0], attempt, req_quota)
+                attempt += 1
+        return [responses.get(resId) for resId in res_ids]
+
+    def __get_batch_size(self, res_ids):
+        """
+        Obtains the number of resources that can be requested in the next batch
+        request without exceeding the Gmail API quota units per second or the
+        remaining quota units.
+
+        Parameters
+        ----------
+        res_ids : list
+            Identifiers of the resources which have not been requested yet.
+
+        Returns
+        -------
+        int: number of resources of the next batch request (the first ones of
+        res_ids).
+
+        """
+        max_quota = min(qu.QUOTA_UNITS_PER_SECOND, self.quota)
+        size = 0
+        req_quota = 0
+        while size < min(len(res_ids), cfe.MAX_BATCH_REQUESTS):
+            req_quota += self.get_request_qu(res_ids[size])
+            if req_quota > max_quota:
+                break
+            size += 1
+        return size
+
+    def __save_resource(self, res, extracted):
+        """
+        Extracts the messages of the given resource and adds them to the
+        buffered writer, which will save them in the database.
+
+        Parameters
+        ----------
+        res : Gmail API resource
+            Gmail API resource (threads or messages) the specific extractor.
+        extracted : int
+            Number of resources extracted before this one.
+
+        Returns
+        -------
+        None.
+
+        """
+        msgs = self.extract_msgs_from_resource(res)
+        if self.__skip_stored:
+            # The resource can contain messages which were extracted before
+            stored = self.__get_extracted_ids([m.msg_id for m in msgs])
+            msgs = [m for m in msgs if not(m.msg_id in stored)]
+        for m in msgs:
+            self.writer.add(m, extracted)
+
+    def __register_inserted(self, msgs):
+        """
+        Adds the given messages, which have just been inserted in the database,
+        to the identifiers loaded in memory (if they were loaded) and gives
+        them to the listeners.
+
+        Parameters
+        ----------
+        msgs : list
+            Inserted ExtractedMessage objects.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.extracted_ids is not None:
+            self.extracted_ids.update(m.msg_id for m in msgs)
+        for listener in self.listeners:
+            listener(msgs)
+    
+    def load_extracted_ids(self):
+        """
+        Loads in memory the identifiers of the messages stored in the database,
+        so the extractor does not need to query it for each list page.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.extracted_ids = set(ExtractedMessage.objects().scalar('msg_id'))
+    
+    def __get_extracted_ids(self, res_ids):
+        """
+        Obtains which of the given identifiers belong to messages which were
+        extracted before. It needs a single query for all of them (or none if
+        the identifiers were loaded in memory).
+
+        Parameters
+        ----------
+        res_ids : list
+            Identifiers of the resources of a list page.
+
+        Returns
+        -------
+        set: identifiers of res_ids which were extracted before.
+
+        """
+        done = self.__done_ids.intersection(res_ids)
+        if self.extracted_ids is not None:
+            return done.union(self.extracted_ids.intersection(res_ids))
+        return done.union(ExtractedMessage.objects(msg_id__in = res_ids).scalar('msg_id'))
+    
+    def __open_checkpoint(self):
+        """
+        Loads the checkpoint of the unfinished extraction of this user and
+        extractor type, or creates a new one if there is none.
+
+        Returns
+        -------
+        None.
+
+        """
+        cp_id = f'{self.user_name}:{self.list_key}'
+        self.checkpoint = ExtractionCheckpoint.objects(checkpoint_id = cp_id).first()
+        if self.checkpoint is None or self.checkpoint.finished:
+            self.checkpoint = ExtractionCheckpoint(checkpoint_id = cp_id,
+                                                   user_name = self.user_name,
+                                                   extractor = self.list_key)
+        self.__base_extracted = self.checkpoint.extracted
+        self.__done_ids = set(self.checkpoint.doneIds)
+        self.__reached_end = False
+        
+    def __restore_quota_usage(self):
+        """
+        Continues the quota day of the previous executions of this user, so
+        the quota units that they consumed are not available again until the
+        day finishes.
+
+        Returns
+        -------
+        None.
+
+        """
+        usage = QuotaUsage.objects(user_name = self.user_name).first()
+        if usage is not None and usage.is_current():
+            self.scheduler.restore_day_usage(usage.dayStart, usage.consumed)
+
+    def __save_quota_usage(self):
+        """
+        Saves the quota units consumed by this user in the current quota day.
+
+        Returns
+        -------
+        None.
+
+        """
+        day_start, consumed = self.scheduler.get_day_usage()
+        QuotaUsage(user_name = self.user_name, dayStart = day_start,
+                   consumed = consumed, updated = datetime.utcnow()).save()
+
+    def __save_checkpoint(self, pageToken, nextPage, res_list, extracted,
+                          complete):
+        """
+        Saves the checkpoint after extracting a list page. If the page has been
+        completed, the extraction will continue from the next one (or it has
+        reached the end of the list if it was the last one). Otherwise, it will
+        continue from this one skipping its done resources.
+
+        Parameters
+        ----------
+        pageToken : str
+            Page token of the page which has just been extracted.
+        nextPage : str
+            Page token of the next page (None if it is the last one).
+        res_list : list
+            Resources of the list page.
+        extracted : int
+            Number of resources extracted in this execution.
+        complete : bool
+            Whether every pending resource of the page has been requested.
+
+        Returns
+        -------
+        None.
+
+        """
+        if complete:
+            self.checkpoint.pageToken = nextPage
+            self.checkpoint.doneIds = []
+            self.__reached_end = nextPage is None
+        else:
+            self.checkpoint.pageToken = pageToken
+            self.checkpoint.doneIds = list(self.__get_extracted_ids(
+                [r['id'] for r in res_list]))
+        self.checkpoint.extracted = self.__base_extracted + extracted
+        self.checkpoint.quota = self.quota
+        self.checkpoint.updated = datetime.utcnow()
+        self.checkpoint.save()
+        self.__save_quota_usage()
+        log.info('page', extra = {'user' : self.user_name, 'pageToken' : pageToken,
+                                  'extracted' : self.checkpoint.extracted,
+                                  'quota' : self.quota})
+
+    def __select_res_ids(self, res_ids):
+        """
+        Requests in batches the metadata of the given resources and keeps the
+        ones which pass the filters of the specific extractor.
+
+        Parameters
+        ----------
+        res_ids : list
+            Identifiers of the resources.
+
+        Returns
+        -------
+        list: identifiers of the resources which passed the filters. If there
+        are not enough quota units, the remaining ones are not included.
+
+        """
+        selected = []
+        i = 0
+        while (i < len(res_ids) and self.quota >= self.min_qu):
+            batch_size = self.__get_batch_size(res_ids[i:])
+            if batch_size == 0:
+                break
+            ids = res_ids[i:i + batch_size]
+            metadata = self.get_resources(ids, self.get_metadata_request)
+            for resId, meta in zip(ids, metadata):
+                if meta is None:
+                    continue
+                if self.is_worth_extracting(meta):
+                    selected.append(resId)
+                else:
+                    log.info('filtered', extra = {'user' : self.user_name,
+                                                  'res_id' : resId})
+            i += batch_size
+        return selected
+
+    def __get_pending_ids(self, res_list, key = 'id'):
+        """
+        Obtains the identifiers of the resources of a list page which were not
+        extracted before (and which pass the filters if metadata_first is True).
+
+        Parameters
+        ----------
+        res_list : list
+            Resources of the list page (only their identifiers are needed).
+        key : str, optional
+            Key of the identifier of the resource which is requested for each
+            item of res_list. The items of the history are messages, so their
+            resource is given by history_key. The default is 'id'.
+
+        Returns
+        -------
+        list: identifiers of the resources which have to be requested (see
+        plan_resources).
+
+        """
+        pending = {}
+        repeated = self.__get_extracted_ids([r['id'] for r in res_list])
+        for r in res_list:
+            # If the resource was not extracted before
+            if not(r['id'] in repeated):
+                pending[r[key]] = True
+            else:
+                log.info('repeated', extra = {'user' : self.user_name,
+                                              'res_id' : r['id']})
+        
+        pending = list(pending)
+        if self.metadata_first:
+            pending = self.__select_res_ids(pending)
+        return self.plan_resources(res_list, pending)
+
+    def __extract_page_sequentially(self, res_list, extracted, key = 'id'):
+        """
+        Extracts one by one the resources of a list page which were not
+        extracted before.
+
+        Parameters
+        ----------
+        res_list : list
+            Resources of the list page (only their identifiers are needed).
+        extracted : int
+            Number of resources extracted before this page.
+        key : str, optional
+            Key of the identifier of the resource of each item of res_list
+            (see __get_pending_ids). The default is 'id'.
+
+        Returns
+        -------
+        extracted : int
+            Number of resources extracted after this page.
+        complete : bool
+            Whether every pending resource of the page has been requested.
+
+        """
+        pending = self.__get_pending_ids(res_list, key)
+        i = 0
+        while (i < len(pending) and 
+               self.quota >= max(self.min_qu, self.get_request_qu(pending[i]))):
+            # Obtains the resource (message or thread) with the given id
+            res = self.get_resource(pending[i])
+            self.__save_resource(res, extracted)
+            extracted += 1
+            i += 1
+        self.writer.flush()
+        return extracted, i == len(pending)
+
+    def __extract_page_in_batches(self, res_list, extracted, key = 'id'):
+        """
+        Extracts the resources of a list page which were not extracted before
+        by grouping their requests in batch requests.
+
+        Parameters
+        ----------
+        res_list : list
+            Resources of the list page (only their identifiers are needed).
+        extracted : int
+            Number of resources extracted before this page.
+        key : str, optional
+            Key of the identifier of the resource of each item of res_list
+            (see __get_pending_ids). The default is 'id'.
+
+        Returns
+        -------
+        extracted : int
+            Number of resources extracted after this page.
+        complete : bool
+            Whether every pending resource of the page has been requested.
+
+        """
+        pending = self.__get_pending_ids(res_list, key)
+        i = 0
+        while (i < len(pending) and self.quota >= self.min_qu):
+            batch_size = self.__get_batch_size(pending[i:])
+            if batch_size == 0:
+                break
+            for res in self.get_resources(pending[i:i + batch_size]):
+                # The resources which were not found are skipped
+                if res is not None:
+                    self.__save_resource(res, extracted)
+                    extracted += 1
+            i += batch_size
+        self.writer.flush()
+        return extracted, i >= len(pending)
+
+    def __backoff(self, error, attempt, req_quota):
+        """
+        Waits before retrying a failed request. The scheduler is paused during
+        a jittered exponential backoff, so the rest of workers also slow down,
+        and the quota units of the retry are consumed.
+
+        Parameters
+        ----------
+        error : Exception
+            Error raised by the request.
+        attempt : int
+            Number of retries of the request made before this one.
+        req_quota : int
+            Quota units of the retry.
+
+        Returns
+        -------
+        None.
+
+        """
+        delay = get_backoff_delay(attempt, error)
+        self.scheduler.backoff(delay)
+        log.warning('retry', extra = {'user' : self.user_name,
+                                      'attempt' : attempt + 1,
+                                      'delay' : delay,
+                                      'status' : getattr(getattr(error, 'resp', None),
+                                                         'status', None),
+                                      'error' : str(error)})
+        self.wait_for_request(req_quota)
+
+    def execute_request(self, req, req_quota = 0):
+        """
+        Executes the given Gmail API request. Fetch workers execute it with
+        their own http object. If it fails because of a rate limit error or a
+        transient error, it is retried up to cfe.MAX_RETRIES times with
+        jittered exponential backoff.
+
+        Parameters
+        ----------
+        req : HttpRequest
+            Gmail API request which is going to be executed.
+        req_quota : int, optional
+            Quota units of the request, which are consumed again by each
+            retry. The default is 0.
+
+        Raises
+        ------
+        HttpError
+            If the request fails with a permanent error or it fails again
+            after the last retry.
+
+        Returns
+        -------
+        Response of the Gmail API request.
+
+        """
+        attempt = 0
+        while True:
+            try:
+                http = self.__get_http()
+                if http is None:
+                    return req.execute()
+                return req.execute(http = http)
+            except Exception as e:
+                if attempt >= cfe.MAX_RETRIES or not(is_retryable(e)):
+                    raise
+                self.__backoff(e, attempt, req_quota)
+                attempt += 1
+
+    def __fetch_resource(self, resId):
+        """
+        Obtains the Gmail API resource of the specific extractor in a fetch
+        worker. Its quota units must have been consumed before.
+
+        Parameters
+        ----------
+        resId : str
+            Resource's identifier that we want to retrieve.
+
+        Returns
+        -------
+        list: Gmail API resource (thread or message) depending on the specific
+        extractor (as the only item, like __fetch_batch).
+
+        """
+        req_quota = self.get_request_qu(resId)
+        res = self.execute_request(self.get_request(resId), req_quota)
+        self.update_attributes(req_quota)
+        return [res]
+
+    def __fetch_batch(self, res_ids):
+        """
+        Obtains the Gmail API resources of the specific extractor with a batch
+        request in a fetch worker. Their quota units must have been consumed
+        before.
+
+        Parameters
+        ----------
+        res_ids : list
+            Identifiers of the resources that we want to retrieve.
+
+        Returns
+        -------
+        list: Gmail API resources (see get_resources).
+
+        """
+        return self.get_resources(res_ids, acquired = True)
+    
+    def __list_page(self, pageToken):
+        """
+        Lists a page of resources and obtains the record with which the
+        concurrent mode follows its extraction.
+
+        Parameters
+        ----------
+        pageToken : str
+            Page token of the page which is going to be listed.
+
+        Returns
+        -------
+        dict: record of the page with the following structure:
+            {
+                'token' : str,         # Page token of the page
+                'next' : str,          # Page token of the next page or None
+                'list' : [ dict ],     # Resources of the page
+                'ids' : [ str ],       # Resources which have to be extracted
+                'submitted' : int,     # Number of resources submitted
+                'futures' : deque      # Fetches (lists of resources) not
+                                       # consumed yet
+            }
+
+        """
+        res_list = self.get_list(pageToken)
+        return {'token' : pageToken,
+                'next' : res_list.get('nextPageToken'),
+                'list' : res_list[self.list_key],
+                'ids' : self.__get_pending_ids(res_list[self.list_key]),
+                'submitted' : 0,
+                'futures' : deque()}
+    
+    def __submit_fetches(self, pool, pages):
+        """
+        Submits to the fetch workers the resources of the given pages (in
+        order) while there are quota units available. If the batch mode is
+        enabled, each fetch is a batch request of the next resources of the
+        page. The quota units of each fetch are consumed when it is submitted,
+        so the accounting is exact.
+
+        Parameters
+        ----------
+        pool : ThreadPoolExecutor
+            Pool of fetch workers.
+        pages : deque
+            Records of the pages whose resources are being extracted.
+
+        Returns
+        -------
+        float: seconds to wait until the quota scheduler allows the next fetch
+        (0 if there is nothing else to submit).
+
+        """
+        for page in pages:
+            while page['submitted'] < len(page['ids']):
+                res_ids = page['ids'][page['submitted']:]
+                if self.batch:
+                    res_ids = res_ids[:self.__get_batch_size(res_ids)]
+                else:
+                    res_ids = res_ids[:1]
+                req_quota = sum(map(self.get_request_qu, res_ids))
+                if not(res_ids) or self.quota < max(self.min_qu, req_quota):
+                    return 0.0
+                
+                waiting = self.scheduler.try_acquire(req_quota)
+                if waiting > 0:
+                    return waiting
+                
+                if self.batch:
+                    fetch = pool.submit(self.__fetch_batch, res_ids)
+                else:
+                    fetch = pool.submit(self.__fetch_resource, res_ids[0])
+                page['futures'].append(fetch)
+                page['submitted'] += len(res_ids)
+        return 0.0
+    
+    def __extract_concurrently(self, nmsg, nextPage):
+        """
+        Extracts the sent messages with a bounded pool of fetch workers which
+        prefetch the resources of the current page and the next one, while this
+        thread parses and saves the fetched resources in order.
+
+        Parameters
+        ----------
+        nmsg: int
+            Number of messages or threads to be extracted.
+        nextPage: str
+            Page token to retrieve a specific page of results in the list.
+
+        Returns
+        -------
+        extracted: int
+            Number of extracted resources.
+        actual_page: str
+            Page token of the page where the extraction stopped.
+        nextPage: str
+            Page token of the page after actual_page.
+
+        """
+        extracted = 0
+        actual_page = nextPage
+        # Number of resources of the listed pages which have to be extracted
+        planned = 0
+        pages = deque()
+        
+        with ThreadPoolExecutor(max_workers = self.num_workers) as pool:
+            if self.quota >= self.min_qu:
+                pages.append(self.__list_page(nextPage))
+                planned += len(pages[-1]['ids'])
+                nextPage = pages[-1]['next']
+                
+            while pages:
+                waiting = self.__submit_fetches(pool, pages)
+                last = pages[-1]
+                
+                # Prefetch the next page when the last one has been submitted
+                if (len(pages) < 2 and last['next'] is not None and planned < nmsg
+                    and last['submitted'] == len(last['ids']) and 
+                    self.quota >= self.min_qu):
+                    pages.append(self.__list_page(last['next']))
+                    planned += len(pages[-1]['ids'])
+                    
+                else:
+                    page = pages[0]
+                    if page['futures']:
+                        if waiting > 0 and not page['futures'][0].done():
+                            # Waits for the fetch or for the next quota units
+                            wait([page['futures'][0]], timeout = waiting)
+                        else:
+                            for res in page['futures'].popleft().result():
+                                # The resources which were not found are skipped
+                                if res is not None:
+                                    self.__save_resource(res, extracted)
+                                    extracted += 1
+                            actual_page = page['token']
+                            nextPage = page['next']
+                    elif page['submitted'] < len(page['ids']) and waiting > 0:
+                        sleep(waiting)
+                    elif page['submitted'] == len(page['ids']) and len(pages) > 1:
+                        self.writer.flush()
+                        self.__save_checkpoint(page['token'], page['next'],
+                                               page['list'], extracted, True)
+                        pages.popleft()
+                    else:
+                        # Nothing else can be extracted
+                        self.writer.flush()
+                        self.__save_checkpoint(page['token'], page['next'],
+                                               page['list'], extracted,
+                                               page['submitted'] == len(page['ids']))
+                        pages.clear()
+                    
+        return extracted, actual_page, nextPage
+
+    async def __acquire_async(self, req_quota):
+        """
+        Waits (without blocking the event loop) until the scheduler gives the
+        given quota units and consumes them.
+
+        Parameters
+        ----------
+        req_quota : int
+            Quota units of the request that is going to be made.
+
+        Returns
+        -------
+        bool: True if the quota units have been consumed, False if there are
+        not enough remaining quota units.
+
+        """
+        while self.quota >= req_quota:
+            waiting = self.scheduler.try_acquire(req_quota)
+            if waiting == 0:
+                return True
+            await asyncio.sleep(waiting)
+        return False
+
+    async def execute_request_async(self, client, req, req_quota = 0):
+        """
+        Executes the given Gmail API request with the asynchronous client. It
+        is retried as in execute_request.
+
+        Parameters
+        ----------
+        client : AsyncGmailClient
+            Asynchronous Gmail API client.
+        req : HttpRequest
+            Gmail API request which is going to be executed.
+        req_quota : int, optional
+            Quota units of the request, which are consumed again by each
+            retry. The default is 0.
+
+        Raises
+        ------
+        HttpError
+            If the request fails with a permanent error, it fails again after
+            the last retry or there are not quota units for the retry.
+
+        Returns
+        -------
+        Response of the Gmail API request.
+
+        """
+        attempt = 0
+        while True:
+            try:
+                return await client.execute(req)
+            except Exception as e:
+                if attempt >= cfe.MAX_RETRIES or not(is_retryable(e)):
+                    raise
+                delay = get_backoff_delay(attempt, e)
+                self.scheduler.backoff(delay)
+                log.warning('retry', extra = {'user' : self.user_name,
+                                              'attempt' : attempt + 1,
+                                              'delay' : delay,
+                                              'error' : str(e)})
+                if not(await self.__acquire_async(req_quota)):
+                    raise
+                attempt += 1
+
+    async def __fetch_async(self, client, limit, resId):
+        """
+        Obtains a Gmail API resource with the asynchronous client.
+
+        Parameters
+        ----------
+        client : AsyncGmailClient
+            Asynchronous Gmail API client.
+        limit : asyncio.Semaphore
+            Limit of requests in flight.
+        resId : str
+            Resource's identifier.
+
+        Returns
+        -------
+        list: Gmail API resource as the only item, like __fetch_resource (it is
+        empty if the resource was not found). It is None if there are not
+        enough quota units.
+
+        """
+        async with limit:
+            req_quota = self.get_request_qu(resId)
+            if (self.quota < self.min_qu or 
+                not(await self.__acquire_async(req_quota))):
+                return None
+            try:
+                res = await self.execute_request_async(
+                    client, self.get_request(resId), req_quota)
+            except HttpError as e:
+                # The resource may have been deleted after listing the page
+                if not(is_not_found(e)):
+                    raise
+                log.warning('not found', extra = {'user' : self.user_name,
+                                                  'res_id' : resId})
+                res = None
+            self.update_attributes(req_quota)
+            return [] if res is None else [res]
+
+    async def __list_page_async(self, client, limit, pageToken):
+        """
+        Lists a page of resources with the asynchronous client and starts the
+        fetches of the resources which have to be extracted.
+
+        Parameters
+        ----------
+        client : AsyncGmailClient
+            Asynchronous Gmail API client.
+        limit : asyncio.Semaphore
+            Limit of requests in flight.
+        pageToken : str
+            Page token of the page which is going to be listed.
+
+        Returns
+        -------
+        dict: record of the page with the following structure (None if there
+        are not enough quota units):
+            {
+                'token' : str,         # Page token of the page
+                'next' : str,          # Page token of the next page or None
+                'list' : [ dict ],     # Resources of the page
+                'tasks' : [ Task ]     # Fetches of the resources (in order)
+            }
+
+        """
+        if not(await self.__acquire_async(self.list_qu)):
+            return None
+        res_list = await self.execute_request_async(
+            client, self.get_list_request(pageToken), self.list_qu)
+        self.update_attributes(self.list_qu)
+        resources = res_list.get(self.list_key, [])
+        # It queries the database, so it does not block the event loop
+        loop = asyncio.get_running_loop()
+        ids = await loop.run_in_executor(None, self.__get_pending_ids, resources)
+        return {'token' : pageToken,
+                'next' : res_list.get('nextPageToken'),
+                'list' : resources,
+                'tasks' : [asyncio.ensure_future(self.__fetch_async(client, limit, resId))
+                           for resId in ids]}
+
+    async def iter_sent_msgs_async(self, client, nmsg, nextPage = None,
+                                   progress = None):
+        """
+        Asynchronous generator of the extracted messages of the sent resources.
+        The resources of the current page and the next one are requested
+        concurrently (the requests in flight are limited by
+        cfe.ASYNC_CONCURRENCY and by the quota units per second), but the
+        messages are given in order. The checkpoint is saved after each page,
+        once its messages have been given to the writer.
+
+        Parameters
+        ----------
+        client : AsyncGmailClient
+            Asynchronous Gmail API client.
+        nmsg : int
+            Number of messages or threads to be extracted.
+        nextPage : str, optional
+            Page token to retrieve a specific page of results in the list. The
+            default is None.
+        progress : dict, optional
+            Dictionary where the progress is recorded: 'extracted' (number of
+            extracted resources), 'actualPage' (page token of the page where
+            the extraction is) and 'nextPage' (page token of the next one).
+            The default is None.
+
+        Yields
+        ------
+        ExtractedMessage: next extracted message.
+
+        """
+        if progress is None:
+            progress = {}
+        progress.update({'extracted' : 0, 'actualPage' : nextPage,
+                         'nextPage' : nextPage})
+        limit = asyncio.Semaphore(min(cfe.ASYNC_CONCURRENCY,
+                                      qu.QUOTA_UNITS_PER_SECOND // self.get_qu))
+        page = None
+        following = None
+        if self.quota >= self.min_qu:
+            page = await self.__list_page_async(client, limit, nextPage)
+        planned = len(page['tasks']) if page is not None else 0
+        try:
+            while page is not None:
+                if (page['next'] is not None and planned < nmsg and 
+                    self.quota >= self.min_qu):
+                    # The next page is listed while this one is fetched
+                    following = asyncio.ensure_future(
+                        self.__list_page_async(client, limit, page['next']))
+                    
+                complete = True
+                for task in page['tasks']:
+                    resources = await task
+                    if resources is None:
+                        complete = False
+                        break
+                    for res in resources:
+                        progress['extracted'] += 1
+                        progress['actualPage'] = page['token']
+                        progress['nextPage'] = page['next']
+                        for msg in self.extract_msgs_from_resource(res):
+                            yield msg
+                        
+                self.writer.flush()
+                self.__save_checkpoint(page['token'], page['next'], page['list'],
+                                       progress['extracted'], complete)
+                if (following is None or not(complete) or 
+                    self.quota < self.min_qu):
+                    break
+                page = await following
+                following = None
+                if page is not None:
+                    planned += len(page['tasks'])
+        finally:
+            pending = [] if page is None else page['tasks']
+            if following is not None:
+                following.cancel()
+            for task in pending:
+                task.cancel()
+
+    async def __extract_async(self, nmsg, nextPage):
+        """
+        Extracts the sent messages with the asynchronous engine and gives them
+        to the writer.
+
+        Parameters
+        ----------
+        nmsg: int
+            Number of messages or threads to be extracted.
+        nextPage: str
+            Page token to retrieve a specific page of results in the list.
+
+        Returns
+        -------
+        extracted: int
+            Number of extracted resources.
+        actual_page: str
+            Page token of the page where the extraction stopped.
+        nextPage: str
+            Page token of the page after actual_page.
+
+        """
+        progress = {}
+        async with self.async_factory() as client:
+            async for msg in self.iter_sent_msgs_async(client, nmsg, nextPage,
+                                                       progress):
+                self.writer.add(msg, progress['extracted'] - 1)
+        return progress['extracted'], progress['actualPage'], progress['nextPage']
+
+    def get_history_id(self):
+        """
+        Obtains the current history identifier of the user's mailbox.
+
+        Returns
+        -------
+        str: history identifier.
+
+        """
+        self.wait_for_request(qu.GET_PROFILE)
+        profile = self.execute_request(self.service.users().getProfile(userId = 'me'),
+                                       qu.GET_PROFILE)
+        self.update_attributes(qu.GET_PROFILE)
+        return profile['historyId']
+    
+    def get_history(self, startHistoryId, nextPage = None):
+        """
+        Obtains a page of the history of sent messages added to the mailbox
+        since the given history identifier.
+
+        Parameters
+        ----------
+        startHistoryId : str
+            History identifier from which the changes are returned.
+        nextPage : str, optional
+            Page token to retrieve a specific page of results in the list. The
+            default is None.
+
+        Returns
+        -------
+        If successful, this method returns a response body with the following 
+        structure:
+        {
+            "history": [
+                {
+                    "id": string,
+                    "messagesAdded": [ { "message": users.messages resource } ]
+                }
+            ],
+            "nextPageToken": string,
+            "historyId": string
+        }
+
+        """
+        self.wait_for_request(qu.HISTORY_LIST)
+        h = self.service.users().history()
+        l = self.execute_request(h.list(userId = 'me', startHistoryId = startHistoryId,
+                                        labelId = 'SENT', 
+                                        historyTypes = ['messageAdded'],
+                                        pageToken = nextPage,
+                                        fields = cfe.HISTORY_FIELDS),
+                                 qu.HISTORY_LIST)
+        self.update_attributes(qu.HISTORY_LIST)
+        return l
+    
+    def __get_added_msgs(self, startHistoryId):
+        """
+        Obtains the sent messages added to the mailbox since the given history
+        identifier.
+
+        Parameters
+        ----------
+        startHistoryId : str
+            History identifier from which the changes are requested.
+
+        Returns
+        -------
+        msgs : list
+            Added messages (without repetitions) with their identifier and
+            their thread identifier. It is None if the history identifier is
+            no longer available.
+        historyId : str
+            History identifier of the mailbox after these changes. It is None
+            if there was not enough quota to obtain every change.
+
+        """
+        msgs = {}
+        historyId = None
+        nextPage = None
+        more_pages = True
+        while (more_pages and self.quota >= qu.HISTORY_LIST):
+            try:
+                hist = self.get_history(startHistoryId, nextPage)
+            except HttpError as e:
+                # The history identifier is too old or invalid
+                if e.resp.status == 404:
+                    return None, None
+                raise
+                
+            for record in hist.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    m = added['message']
+                    if 'SENT' in m.get('labelIds', ['SENT']):
+                        msgs[m['id']] = {'id' : m['id'],
+                                         'threadId' : m.get('threadId', m['id'])}
+                        
+            more_pages = 'nextPageToken' in hist
+            nextPage = hist.get('nextPageToken')
+            if not(more_pages):
+                historyId = hist['historyId']
+                
+        return list(msgs.values()), historyId
+    
+    def __start_sync(self):
+        """
+        Obtains the synchronization state of the user and, if a full extraction
+        is not already in progress, records the current history identifier so
+        the next incremental extraction starts from it.
+
+        Returns
+        -------
+        SyncState: synchronization state of the user.
+
+        """
+        state = SyncState.objects(user_name = self.user_name).first()
+        if state is None:
+            state = SyncState(user_name = self.user_name)
+            
+        if (state.pendingHistoryId is None and 
+            self.quota >= qu.GET_PROFILE + self.min_qu):
+            state.pendingHistoryId = self.get_history_id()
+            state.save()
+        return state
+    
+    def extract_new_msg(self):
+        """
+        Extracts the sent messages added to the mailbox since the last complete
+        extraction by using the Gmail history. Besides it saves all the 
+        extracted messages.
+
+        Returns
+        -------
+        quota: int
+            Remaining quota units of Gmail API. It is None if there is not a
+            valid history identifier, so a full extraction is needed.
+
+        """
+        state = SyncState.objects(user_name = self.user_name).first()
+        if state is None or state.historyId is None:
+            return None
+        
+        self.__restore_quota_usage()
+        msgs, historyId = self.__get_added_msgs(state.historyId)
+        if msgs is None:
+            return None
+        
+        # The new messages are requested through their resources, which may
+        # contain messages extracted before (e.g. the start of a thread)
+        self.__skip_stored = True
+        try:
+            if self.batch:
+                extracted, complete = self.__extract_page_in_batches(
+                    msgs, 0, self.history_key)
+            else:
+                extracted, complete = self.__extract_page_sequentially(
+                    msgs, 0, self.history_key)
+        finally:
+            self.__skip_stored = False
+        
+        # The history identifier only advances if every change was extracted
+        if historyId is not None and complete:
+            state.historyId = historyId
+            state.save()
+        self.__save_quota_usage()
+            
+        log.info('incremental extraction finished', extra = {
+            'user' : self.user_name, 'extracted' : extracted,
+            'total' : len(msgs), 'quota' : self.quota,
+            'historyId' : state.historyId})
+            
+        return self.quota
+
     def extract_sent_msg(self, nmsg, nextPage = None):
         """
         Extracts all the sent messages by using the Gmail API. Besides it saves
@@ -208,48 +1534,63 @@ class Extractor(ABC):
             Remaining quota units of Gmail API.
 
         """
-        extracted = 0
-        self.init_time = time()
-        actual_page = ''
-        while (extracted < nmsg and self.quota >= self.min_qu):
-            msg_list = self.get_list(nextPage)
-            actual_page = nextPage
-
-            lst_size = len(msg_list[self.list_key])
-            if (extracted + lst_size < nmsg):
-                nextPage = msg_list['nextPageToken']
-
-            msg_list = msg_list[self.list_key]
-            i = 0
-            while (i < lst_size and self.quota >= self.min_qu):
-                # If the resource was not extracted before
-                if not(ExtractedMessage.objects(msg_id = msg_list[i]['id']).first()):
-                    # Obtains the resource (message or thread) with the given id
-                    res = self.get_resource(msg_list[i]['id'])
-                    extracted_msgs = self.extract_msgs_from_resource(res)
-                   
-                    # Save the message in database
-                    for m in extracted_msgs:
-                        m.save()
-                        print(f"Extraction succesfull {m.msg_id}.")
-                        
-                        with open(self.user_name + 'log.txt', 'a') as f:
-                            f.write(f'{extracted}.- Extracted {m.msg_id}.\n')
-                        
-                    extracted += 1
-                
+        self.__restore_quota_usage()
+        state = self.__start_sync()
+        self.__open_checkpoint()
+        log.info('extraction mode', extra = {
+            'user' : self.user_name, 'async' : self.async_factory is not None,
+            'workers' : self.num_workers, 'batch' : self.batch})
+        if self.async_factory is not None:
+            extracted, actual_page, nextPage = asyncio.run(
+                self.__extract_async(nmsg, nextPage))
+        elif self.num_workers > 0:
+            extracted, actual_page, nextPage = self.__extract_concurrently(nmsg, 
+                                                                        nextPage)
+        else:
+            extracted = 0
+            actual_page = ''
+            last_page = False
+            complete = True
+            while (extracted < nmsg and self.quota >= self.min_qu and 
+                   not(last_page) and complete):
+                msg_list = self.get_list(nextPage)
+                actual_page = nextPage
+
+                # Repeated resources are not counted as extracted, so the page
+                # token must advance even if this page completes nmsg
+                last_page = not('nextPageToken' in msg_list)
+                if not(last_page):
+                    nextPage = msg_list['nextPageToken']
+
+                msg_list = msg_list[self.list_key]
+                if self.batch:
+                    extracted, complete = self.__extract_page_in_batches(
+                        msg_list, extracted)
                 else:
-                    with open(self.user_name + 'log.txt', 'a') as f:
-                        f.write(f'REPEATED ID {msg_list[i]["id"]}.\n')
-                i += 1
+                    extracted, complete = self.__extract_page_sequentially(
+                        msg_list, extracted)
+                self.__save_checkpoint(actual_page, 
+                                       None if last_page else nextPage,
+                                       msg_list, extracted, complete)
         
-        with open('log.txt', 'a') as f:
-            f.write('\nEXTRACTION FINISHED:\n')
-            f.write(f'Extracted resources: {extracted}/{nmsg}\n')
-            f.write(f'Remaining quota: {self.quota}\n')
-                    
-            if extracted < nmsg:
-                f.write('Actual Page Token: ' + actual_page + '\n')
-                f.write('Next Page Token: '+ nextPage + '\n')
+        self.writer.flush()
+        # If the last list page has been completed, the mailbox is synchronized
+        if self.__reached_end and state.pendingHistoryId is not None:
+            state.historyId = state.pendingHistoryId
+            state.pendingHistoryId = None
+            state.save()
+        if self.__reached_end:
+            self.checkpoint.finished = True
+            self.checkpoint.save()
+        self.__save_quota_usage()
+        self.__done_ids = set()
+            
+        fields = {'user' : self.user_name, 'extracted' : extracted,
+                  'total' : nmsg, 'quota' : self.quota}
+        fields.update(self.scheduler.get_stats())
+        if extracted < nmsg:
+            fields['actualPage'] = actual_page
+            fields['nextPage'] = nextPage
+        log.info('extraction finished', extra = fields)
                 
         return self.quota
\ No newline at end of file
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jun 26 10:12:38 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from __future__ import print_function
+import imaplib
+import re
+from extraction.mailboxextractor import MailboxExtractor
+from extraction.syncstate import SyncState
+import extraction.confextraction as cfe
+from pipelinelog import get_logger
+
+log = get_logger('extraction')
+
+# Gmail extensions whose values are added as headers of the fetched messages
+GMAIL_ATTRIBUTES = [b'X-GM-MSGID', b'X-GM-THRID']
+
+def uid_set(uids):
+    """
+    Builds the IMAP sequence set of the given UIDs, joining the consecutive
+    ones in ranges (for example, '1:50,52,60:70').
+
+    Parameters
+    ----------
+    uids : list
+        Sorted UIDs.
+
+    Returns
+    -------
+    str: sequence set.
+
+    """
+    ranges = []
+    start = prev = uids[0]
+    for uid in uids[1:]:
+        if uid != prev + 1:
+            ranges.append(str(start) if start == prev else f'{start}:{prev}')
+            start = uid
+        prev = uid
+    ranges.append(str(start) if start == prev else f'{start}:{prev}')
+    return ','.join(ranges)
+
+def parse_fetch_response(data):
+    """
+    Obtains the messages of the data of UID FETCH responses. The values of the
+    Gmail extensions (X-GM-MSGID and X-GM-THRID) are added to the message as
+    headers, as Google Takeout exports them.
+
+    Parameters
+    ----------
+    data : list
+        Untagged FETCH data given by imaplib. Each message is a tuple of the
+        response line and the literal (BODY[]), followed by the rest of the
+        response line.
+
+    Returns
+    -------
+    dict: message in RFC 5322 format of each UID.
+
+    """
+    responses = []
+    for item in data:
+        if isinstance(item, tuple):
+            responses.append([item[0], item[1]])
+        elif item and responses:
+            responses[-1][0] += b' ' + item
+
+    messages = {}
+    for line, raw in responses:
+        uid = re.search(rb'\bUID (\d+)', line)
+        if uid is None:
+            continue
+        headers = b''
+        for attr in GMAIL_ATTRIBUTES:
+            value = re.search(re.escape(attr) + rb' (\d+)', line)
+            if value is not None:
+                headers += attr + b': ' + value.group(1) + b'\r\n'
+        messages[int(uid.group(1))] = headers + raw
+    return messages
+
+class ImapExtractor(MailboxExtractor):
+    """
+    Implements MailboxExtractor class for the folder of sent messages of an
+    IMAP server, so it does not consume Gmail API quota units. The messages
+    are requested by UID ranges with pipelined UID FETCH commands and the UID
+    of the last extracted message is saved with the UIDVALIDITY of the folder,
+    so the next extractions only request the new messages.
+
+    Attributes
+    ----------
+    address: str
+        Email address used to log in the IMAP server.
+    host: str
+        IMAP server.
+    port: int
+        Port of the IMAP server.
+    use_ssl: bool
+        Whether the connection uses SSL.
+    folder: str
+        Folder of the sent messages.
+    uid_validity: int
+        UIDVALIDITY of the selected folder.
+    uid_next: int
+        UIDNEXT of the selected folder (None if the server does not give it).
+    __password: str
+        Password of the IMAP account.
+    __conn: IMAP4
+        Connection with the IMAP server (None if it is closed).
+    __uids: list
+        UIDs of the messages of the current extraction.
+
+    """
+    def __init__(self, usu, address, password, host = cfe.IMAP_HOST,
+                 port = cfe.IMAP_PORT, use_ssl = True,
+                 folder = cfe.IMAP_SENT_FOLDER, num_workers = 0):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        usu: str
+            User name.
+        address: str
+            Email address of the IMAP account.
+        password: str
+            Password of the IMAP account (an app password in Gmail).
+        host: str, optional
+            IMAP server. The default is cfe.IMAP_HOST.
+        port: int, optional
+            Port of the IMAP server. The default is cfe.IMAP_PORT.
+        use_ssl: bool, optional
+            Whether the connection uses SSL. The default is True.
+        folder: str, optional
+            Folder of the sent messages. The default is cfe.IMAP_SENT_FOLDER.
+        num_workers: int, optional
+            Number of parser processes. The default is 0.
+
+        Returns
+        -------
+        Constructed ImapExtractor class.
+
+        """
+        super().__init__(None, usu, num_workers)
+        self.path = f'{host}:{port}/{folder}'
+        self.address = address
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.folder = folder
+        self.uid_validity = None
+        self.uid_next = None
+        self.__password = password
+        self.__conn = None
+        self.__uids = []
+
+    def __response_code(self, code):
+        """
+        Obtains the value of a response code of the SELECT command.
+
+        Parameters
+        ----------
+        code : str
+            Response code (UIDVALIDITY or UIDNEXT).
+
+        Returns
+        -------
+        int: value of the response code. It is None if the server did not give
+        it.
+
+        """
+        typ, data = self.__conn.response(code)
+        if data[-1] is None:
+            return None
+        return int(data[-1])
+
+    def __open(self):
+        """
+        Opens the connection with the IMAP server and selects (read only) the
+        folder of the sent messages.
+
+        Raises
+        ------
+        IMAP4.error
+            If the folder cannot be selected.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.use_ssl:
+            self.__conn = imaplib.IMAP4_SSL(self.host, self.port)
+        else:
+            self.__conn = imaplib.IMAP4(self.host, self.port)
+        self.__conn.login(self.address, self.__password)
+        typ, data = self.__conn.select(self.folder, readonly = True)
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(f'{self.folder} cannot be selected: {data}')
+        self.uid_validity = self.__response_code('UIDVALIDITY')
+        self.uid_next = self.__response_code('UIDNEXT')
+
+    def __close(self):
+        """
+        Closes the connection with the IMAP server.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.__conn is not None:
+            try:
+                self.__conn.logout()
+            finally:
+                self.__conn = None
+
+    def __search(self, from_uid):
+        """
+        Obtains the UIDs of the messages of the folder from the given one.
+
+        Parameters
+        ----------
+        from_uid : int
+            First UID.
+
+        Returns
+        -------
+        list: sorted UIDs.
+
+        """
+        typ, data = self.__conn.uid('SEARCH', None, f'UID {from_uid}:*')
+        # n:* always includes the last message, even if its UID is lower
+        return sorted(u for u in map(int, data[0].split()) if u >= from_uid)
+
+    def __fetch_items(self):
+        """
+        Obtains the data items requested by UID FETCH commands.
+
+        Returns
+        -------
+        str: data items.
+
+        """
+        if 'X-GM-EXT-1' in self.__conn.capabilities:
+            return '(UID X-GM-MSGID X-GM-THRID BODY.PEEK[])'
+        return '(UID BODY.PEEK[])'
+
+    def __fetch_pipelined(self, batches):
+        """
+        Fetches the given batches of messages sending every UID FETCH command
+        before reading the responses, so the round trips of the commands
+        overlap. imaplib does not pipeline commands by itself, so its command
+        sending and response reading steps are used separately.
+
+        Parameters
+        ----------
+        batches : list
+            Lists of sorted UIDs of each command.
+
+        Raises
+        ------
+        IMAP4.error
+            If a command fails.
+
+        Returns
+        -------
+        dict: message in RFC 5322 format of each UID.
+
+        """
+        items = self.__fetch_items()
+        tags = [self.__conn._command('UID', 'FETCH', uid_set(b), items)
+                for b in batches]
+        for tag in tags:
+            typ, data = self.__conn._command_complete('UID', tag)
+            if typ != 'OK':
+                raise imaplib.IMAP4.error(f'UID FETCH failed: {data}')
+        typ, data = self.__conn._untagged_response('OK', [None], 'FETCH')
+        return parse_fetch_response(data)
+
+    def iter_chunks(self):
+        """
+        Fetches the messages of the current extraction in windows of
+        cfe.IMAP_PIPELINE_DEPTH commands of cfe.IMAP_FETCH_BATCH messages.
+
+        Yields
+        ------
+        list: pairs of UID and message in RFC 5322 format, in UID order.
+
+        """
+        batches = [self.__uids[i:i + cfe.IMAP_FETCH_BATCH]
+                   for i in range(0, len(self.__uids), cfe.IMAP_FETCH_BATCH)]
+        for i in range(0, len(batches), cfe.IMAP_PIPELINE_DEPTH):
+            fetched = self.__fetch_pipelined(batches[i:i + cfe.IMAP_PIPELINE_DEPTH])
+            uids = sorted(fetched)
+            for j in range(0, len(uids), cfe.MAILBOX_CHUNK):
+                yield [(uid, fetched[uid]) for uid in uids[j:j + cfe.MAILBOX_CHUNK]]
+
+    def __save_uid_next(self, uid_next):
+        """
+        Saves the UIDVALIDITY of the folder and the UID from which the next
+        extraction continues.
+
+        Parameters
+        ----------
+        uid_next : int
+            Every message with a lower UID has been extracted.
+
+        Returns
+        -------
+        None.
+
+        """
+        SyncState.objects(user_name = self.user_name).update_one(
+            set__uidValidity = self.uid_validity, set__uidNext = uid_next,
+            upsert = True)
+
+    def save_progress(self, keys):
+        """
+        Writes the messages of the processed chunk and saves the UID from
+        which the extraction continues.
+
+        Parameters
+        ----------
+        keys : list
+            UIDs of the messages of the chunk which have been processed.
+
+        Returns
+        -------
+        None.
+
+        """
+        if not(keys):
+            return
+        self.writer.flush()
+        uid_next = keys[-1] + 1
+        if keys[-1] >= self.__uids[-1] and self.uid_next is not None:
+            uid_next = max(uid_next, self.uid_next)
+        self.__save_uid_next(uid_next)
+
+    def __extract(self, from_uid, nmsg):
+        """
+        Extracts the messages of the folder from the given UID.
+
+        Parameters
+        ----------
+        from_uid : int
+            First UID.
+        nmsg : int
+            Maximum number of messages which are extracted (None if there is
+            no limit).
+
+        Returns
+        -------
+        int: remaining quota units (they are not consumed).
+
+        """
+        self.__uids = self.__search(from_uid)
+        log.info('imap search', extra = {'user' : self.user_name,
+                                         'fromUid' : from_uid,
+                                         'uidValidity' : self.uid_validity,
+                                         'found' : len(self.__uids)})
+        if not(self.__uids):
+            self.__save_uid_next(self.uid_next or from_uid)
+            return self.quota
+        return super().extract_sent_msg(nmsg)
+
+    def get_list(self, nextPage):
+        """
+        Obtains the UIDs of every message of the folder in a single page.
+
+        Parameters
+        ----------
+        nextPage : str
+            Ignored (there is only one page).
+
+        Returns
+        -------
+        dict: {'messages' : [ { 'id' : uid } ]}
+
+        """
+        if self.__conn is None:
+            self.__open()
+        return {self.list_key : [{'id' : uid} for uid in self.__search(1)]}
+
+    def get_resource(self, resId):
+        """
+        Obtains a message of the folder.
+
+        Parameters
+        ----------
+        resId : int
+            UID of the message.
+
+        Returns
+        -------
+        bytes: message in RFC 5322 format.
+
+        """
+        if self.__conn is None:
+            self.__open()
+        return self.__fetch_pipelined([[resId]]).get(resId)
+
+    def extract_new_msg(self):
+        """
+        Extracts the messages added to the folder since the last extraction.
+
+        Returns
+        -------
+        int: remaining quota units. It is None if there was not a previous
+        extraction with the current UIDVALIDITY of the folder, so a full
+        extraction is needed.
+
+        """
+        state = SyncState.objects(user_name = self.user_name).first()
+        self.__open()
+        try:
+            if (state is None or state.uidNext is None
+                or state.uidValidity != self.uid_validity):
+                log.info('incremental extraction unavailable', extra = {
+                    'user' : self.user_name, 'uidValidity' : self.uid_validity})
+                return None
+            return self.__extract(state.uidNext, None)
+        finally:
+            self.__close()
+
+    def extract_sent_msg(self, nmsg = None, nextPage = None):
+        """
+        Extracts every sent message of the folder and saves them. The messages
+        which were extracted before are skipped.
+
+        Parameters
+        ----------
+        nmsg : int, optional
+            Maximum number of messages which are extracted. The default is
+            None (every message).
+        nextPage : str, optional
+            Ignored (kept for compatibility with the Gmail extractors).
+
+        Returns
+        -------
+        int: remaining quota units (they are not consumed).
+
+        """
+        self.__open()
+        try:
+            return self.__extract(1, nmsg)
+        finally:
+            self.__close()
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Jun 25 09:51:27 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from __future__ import print_function
+import email
+import email.policy
+import email.utils
+import hashlib
+import mailbox
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from extraction.extractor import Extractor
+from extraction.extractedmessage import ExtractedMessage
+import extraction.confextraction as cfe
+import quotaunits as qu
+from softbreaks import remove_soft_breaks
+from pipelinelog import get_logger
+
+log = get_logger('extraction')
+
+def _gmail_id(value):
+    """
+    Converts a Gmail identifier given in decimal by the X-GM-MSGID and
+    X-GM-THRID headers to the hexadecimal form of Gmail API.
+
+    Parameters
+    ----------
+    value : str
+        Header value.
+
+    Returns
+    -------
+    str: identifier as Gmail API gives it, None if it is not a number.
+
+    """
+    try:
+        return format(int(str(value).strip()), 'x')
+    except ValueError:
+        return None
+
+def _strip_id(value):
+    """
+    Removes the angle brackets and blanks of a Message-ID.
+
+    Parameters
+    ----------
+    value : str
+        Message-ID.
+
+    Returns
+    -------
+    str: identifier without brackets.
+
+    """
+    return str(value).strip().strip('<>').strip()
+
+def _split_recipients(value):
+    """
+    Splits a recipients header as DataExtractor does.
+
+    Parameters
+    ----------
+    value : str
+        Header value. It can be None.
+
+    Returns
+    -------
+    list: recipients.
+
+    """
+    if value is None:
+        return []
+    value = str(value)
+    if value == 'undisclosed-recipients:;':
+        return []
+    return value.split(',')
+
+def _is_sent(msg, sender):
+    """
+    Checks whether a message of the export is a sent message.
+
+    Parameters
+    ----------
+    msg : EmailMessage
+        Parsed message.
+    sender : str
+        Address of the user. If it is None, only the Gmail labels of the
+        export (if there are) are checked.
+
+    Returns
+    -------
+    bool: True if it is a sent message.
+
+    """
+    labels = msg['X-Gmail-Labels']
+    if labels is not None:
+        labels = [l.strip() for l in str(labels).split(',')]
+        if not(any(l in cfe.MAILBOX_SENT_LABELS for l in labels)):
+            return False
+    if sender is not None:
+        return sender.lower() in str(msg['From'] or '').lower()
+    return True
+
+def parse_message(raw, sender = None):
+    """
+    Parses a message of a mailbox export with the email package and obtains
+    the fields of its ExtractedMessage. It runs in the parser processes.
+
+    Parameters
+    ----------
+    raw : bytes
+        Message in RFC 5322 format.
+    sender : str, optional
+        Address of the user (only the messages sent by it are extracted). The
+        default is None.
+
+    Returns
+    -------
+    dict: fields of the extracted message. It is None if it is not a sent
+    message.
+
+    """
+    msg = email.message_from_bytes(raw, policy = email.policy.default)
+    if not(_is_sent(msg, sender)):
+        return None
+
+    fields = {}
+    msg_id = None
+    if msg['X-GM-MSGID'] is not None:
+        msg_id = _gmail_id(msg['X-GM-MSGID'])
+    if msg_id is None and msg['Message-ID'] is not None:
+        msg_id = _strip_id(msg['Message-ID'])
+    if not(msg_id):
+        msg_id = hashlib.sha1(raw).hexdigest()
+    fields['id'] = msg_id
+
+    refs = str(msg['References'] or '')
+    ref_ids = re.findall(r'<([^>]*)>', refs)
+    thread_id = None
+    if msg['X-GM-THRID'] is not None:
+        thread_id = _gmail_id(msg['X-GM-THRID'])
+    if thread_id is None and ref_ids:
+        thread_id = ref_ids[0]
+    if thread_id is None and msg['In-Reply-To'] is not None:
+        thread_id = _strip_id(msg['In-Reply-To'])
+    fields['threadId'] = thread_id or msg_id
+
+    fields['to'] = _split_recipients(msg['To'])
+    fields['cc'] = _split_recipients(msg['Cc'])
+    fields['bcc'] = _split_recipients(msg['Bcc'])
+    fields['sender'] = str(msg['From'] or '')
+    fields['depth'] = len(ref_ids)
+    fields['subject'] = None if msg['Subject'] is None else str(msg['Subject'])
+    try:
+        date = email.utils.parsedate_to_datetime(str(msg['Date']))
+        fields['date'] = int(date.timestamp() * 1000)
+    except (TypeError, ValueError):
+        fields['date'] = 0
+
+    fields['charLength'] = 0
+    plain = msg.get_body(('plain',))
+    if plain is not None:
+        fields['bodyPlain'] = plain.get_content()
+        fields['plainEncoding'] = plain['Content-Transfer-Encoding']
+        fields['charLength'] = len(fields['bodyPlain'])
+
+    html = msg.get_body(('html',))
+    if html is not None:
+        html_text = html.get_content()
+        if html['Content-Transfer-Encoding'] == 'quoted-printable':
+            html_text = remove_soft_breaks(html_text)
+        fields['bodyHtml'] = html_text
+        if plain is None:
+            # Its plain text, and so its length, is obtained when it is
+            # preprocessed
+            fields['charLength'] = None
+    return fields
+
+def parse_messages(raws, sender = None):
+    """
+    Parses a chunk of messages of a mailbox export.
+
+    Parameters
+    ----------
+    raws : list
+        Pairs of mailbox key and message in RFC 5322 format.
+    sender : str, optional
+        Address of the user. The default is None.
+
+    Returns
+    -------
+    list: pairs of mailbox key and fields of the extracted message (None if
+    it is not a sent message) or error message.
+
+    """
+    parsed = []
+    for key, raw in raws:
+        try:
+            parsed.append((key, parse_message(raw, sender)))
+        except Exception as e:
+            parsed.append((key, f'Parse error: {e}'))
+    return parsed
+
+class MailboxExtractor(Extractor):
+    """
+    Implements Extractor class for mailbox exports (mbox files or Maildir
+    directories) instead of Gmail API, so it does not consume quota units.
+    The messages are parsed with the email package in a process pool.
+
+    Attributes
+    ----------
+    path: str
+        Path of the mbox file or the Maildir directory.
+    mailbox: mailbox.Mailbox
+        Mailbox of the export. It is None if a subclass obtains the messages
+        from another source (see iter_chunks).
+    sender: str
+        Address of the user. If it is given, only the messages sent by it are
+        extracted.
+
+    """
+    def __init__(self, path, usu, num_workers = 0, sender = None):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        path: str
+            Path of the mbox file or the Maildir directory. If it is None, no
+            mailbox is opened.
+        usu: str
+            User name.
+        num_workers: int, optional
+            Number of parser processes. If it is 0, the messages are parsed
+            by this process. The default is 0.
+        sender: str, optional
+            Address of the user. The default is None.
+
+        Returns
+        -------
+        Constructed MailboxExtractor class.
+
+        """
+        super().__init__(None, usu, qu.QUOTA_UNITS_PER_DAY,
+                         num_workers = num_workers)
+        self.min_qu = 0
+        self.get_qu = 0
+        self.list_key = 'messages'
+        self.history_key = 'id'
+        self.path = path
+        self.sender = sender
+        self.mailbox = None
+        if path is None:
+            pass
+        elif os.path.isdir(path):
+            self.mailbox = mailbox.Maildir(path, factory = None, create = False)
+        else:
+            self.mailbox = mailbox.mbox(path, factory = None, create = False)
+
+    def get_list(self, nextPage):
+        """
+        Obtains the keys of every message of the mailbox in a single page.
+
+        Parameters
+        ----------
+        nextPage : str
+            Ignored (there is only one page).
+
+        Returns
+        -------
+        dict: {'messages' : [ { 'id' : key } ]}
+
+        """
+        return {self.list_key : [{'id' : key} for key in self.mailbox.keys()]}
+
+    def get_request(self, resId):
+        """
+        There are not requests in a mailbox export.
+
+        Returns
+        -------
+        None.
+
+        """
+        return None
+
+    def get_resource(self, resId):
+        """
+        Obtains a message of the mailbox.
+
+        Parameters
+        ----------
+        resId : str
+            Key of the message in the mailbox.
+
+        Returns
+        -------
+        bytes: message in RFC 5322 format.
+
+        """
+        return self.mailbox.get_bytes(resId)
+
+    def __build_message(self, fields):
+        """
+        Builds the ExtractedMessage with the fields given by parse_message.
+
+        Parameters
+        ----------
+        fields : dict
+            Fields of the extracted message.
+
+        Returns
+        -------
+        ExtractedMessage.
+
+        """
+        msg = ExtractedMessage()
+        msg.msg_id = fields['id']
+        msg.threadId = fields['threadId']
+        msg.to = fields['to']
+        msg.cc = fields['cc']
+        msg.bcc = fields['bcc']
+        msg.sender = fields['sender']
+        msg.depth = fields['depth']
+        msg.date = fields['date']
+        msg.subject = fields['subject']
+        msg.charLength = fields['charLength']
+        if 'bodyPlain' in fields:
+            msg.bodyPlain = fields['bodyPlain']
+            msg.plainEncoding = fields.get('plainEncoding')
+        if 'bodyHtml' in fields:
+            msg.bodyHtml = fields['bodyHtml']
+        return msg
+
+    def extract_msgs_from_resource(self, res):
+        """
+        Obtains a list of extracted messages.
+
+        Parameters
+        ----------
+        res : bytes
+            Message of the mailbox in RFC 5322 format.
+
+        Returns
+        -------
+        A list with the ExtractedMessage object (empty if it is not a sent
+        message).
+
+        """
+        fields = parse_message(res, self.sender)
+        if fields is None:
+            return []
+        return [self.__build_message(fields)]
+
+    def iter_chunks(self):
+        """
+        Reads the messages of the mailbox in chunks of cfe.MAILBOX_CHUNK. The
+        subclasses which obtain the messages from another source override it.
+
+        Yields
+        ------
+        list: pairs of mailbox key and message in RFC 5322 format.
+
+        """
+        chunk = []
+        for key in self.mailbox.iterkeys():
+            chunk.append((key, self.mailbox.get_bytes(key)))
+            if len(chunk) == cfe.MAILBOX_CHUNK:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def __iter_parsed(self, chunks):
+        """
+        Parses the given chunks of messages in order, in the process pool if
+        there are parser processes. At most cfe.MAILBOX_TASKS_PER_WORKER chunks
+        per process are read in advance.
+
+        Parameters
+        ----------
+        chunks : iterator
+            Chunks of pairs of key and message in RFC 5322 format.
+
+        Yields
+        ------
+        list: pairs of mailbox key and fields given by parse_messages.
+
+        """
+        if self.num_workers <= 0:
+            for chunk in chunks:
+                yield parse_messages(chunk, self.sender)
+            return
+
+        max_pending = self.num_workers * cfe.MAILBOX_TASKS_PER_WORKER
+        with ProcessPoolExecutor(max_workers = self.num_workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(parse_messages, chunk, self.sender))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def save_progress(self, keys):
+        """
+        It is called after the messages of each parsed chunk have been given
+        to the writer, so that the subclasses can save their progress. A
+        mailbox export is always extracted entirely, so it does nothing.
+
+        Parameters
+        ----------
+        keys : list
+            Keys of the messages of the chunk which have been processed, in
+            order.
+
+        Returns
+        -------
+        None.
+
+        """
+        pass
+
+    def extract_new_msg(self):
+        """
+        A mailbox export has not history, so it always needs a full
+        extraction.
+
+        Returns
+        -------
+        None.
+
+        """
+        return None
+
+    def extract_sent_msg(self, nmsg = None, nextPage = None):
+        """
+        Extracts the sent messages of the mailbox export and saves them. The
+        messages which were extracted before are skipped.
+
+        Parameters
+        ----------
+        nmsg : int, optional
+            Maximum number of messages which are extracted. The default is
+            None (every message).
+        nextPage : str, optional
+            Ignored (kept for compatibility with the Gmail extractors).
+
+        Returns
+        -------
+        int: remaining quota units (they are not consumed).
+
+        """
+        extracted = 0
+        skipped = 0
+        seen = set()
+        for parsed in self.__iter_parsed(self.iter_chunks()):
+            ids = [f['id'] for _, f in parsed if isinstance(f, dict)]
+            if self.extracted_ids is not None:
+                repeated = self.extracted_ids.intersection(ids)
+            else:
+                repeated = set(ExtractedMessage.objects(msg_id__in = ids)
+                               .scalar('msg_id'))
+
+            processed = []
+            for key, fields in parsed:
+                if nmsg is not None and extracted >= nmsg:
+                    break
+                processed.append(key)
+                if isinstance(fields, str):
+                    log.error('parse error', extra = {'user' : self.user_name,
+                                                      'key' : key,
+                                                      'error' : fields})
+                elif fields is None:
+                    skipped += 1
+                elif fields['id'] in repeated or fields['id'] in seen:
+                    log.info('repeated', extra = {'user' : self.user_name,
+                                                  'res_id' : fields['id']})
+                else:
+                    seen.add(fields['id'])
+                    self.writer.add(self.__build_message(fields), extracted)
+                    extracted += 1
+            self.save_progress(processed)
+            if nmsg is not None and extracted >= nmsg:
+                break
+
+        self.writer.flush()
+        log.info('extraction finished', extra = {'user' : self.user_name,
+                                                 'path' : self.path,
+                                                 'extracted' : extracted,
+                                                 'notSent' : skipped})
+        return self.quota
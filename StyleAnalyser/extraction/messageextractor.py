@@ -8,14 +8,15 @@ Created on Tue Nov 12 14:32:54 2019
 from __future__ import print_function
 from extraction.extractor import Extractor
 import quotaunits as qu
-import base64
+import extraction.confextraction as cfe
 from extraction.extractedmessage import ExtractedMessage
 
 class MessageExtractor(Extractor):
     """
     Implements Extractor class
     """
-    def __init__(self, service, usu, quota):
+    def __init__(self, service, usu, quota, batch = False, scheduler = None,
+                 num_workers = 0, http_factory = None, async_factory = None):
         """
         Class constructor.
 
@@ -27,15 +28,33 @@ class MessageExtractor(Extractor):
             Gmail user name.
         quota: int
             Gmail API quota units available for message extraction.
+        batch: bool, optional
+            Indicates whether the resources are obtained with batch requests.
+            The default is False.
+        scheduler: QuotaScheduler, optional
+            Rate limiter shared with other extractors. The default is None.
+        num_workers: int, optional
+            Number of fetch workers of the concurrent mode. The default is 0.
+        http_factory: function, optional
+            Function that creates an authorized http object for each fetch
+            worker. The default is None.
+        async_factory: function, optional
+            Function that creates the asynchronous Gmail API client of the
+            asynchronous engine. The default is None.
 
         Returns
         -------
         Constructed MessageExtractor class.
 
         """
-        super().__init__(service, usu, quota)
+        super().__init__(service, usu, quota, batch, scheduler, num_workers,
+                         http_factory, async_factory)
         self.min_qu = qu.MIN_QUNITS_MSG
+        self.get_qu = qu.MSG_GET
+        self.list_qu = qu.MSG_LIST
         self.list_key = 'messages'
+        self.history_key = 'id'
+        self.metadata_first = cfe.METADATA_FIRST
 
     def get_list(self, nextPage):
         """
@@ -60,11 +79,96 @@ class MessageExtractor(Extractor):
 
         """
         self.wait_for_request(qu.MSG_LIST)
-        m = self.service.users().messages()
-        l = m.list(userId = 'me', labelIds = ['SENT'], pageToken = nextPage).execute()
+        l = self.execute_request(self.get_list_request(nextPage), qu.MSG_LIST)
         self.update_attributes(qu.MSG_LIST)
         return l
 
+    def get_list_request(self, nextPage):
+        """
+        Obtains the Gmail API request which gets a page of the list of sent
+        messages.
+
+        Parameters
+        ----------
+        nextPage : str
+            Page token to retrieve a specific page of results in the list.
+
+        Returns
+        -------
+        HttpRequest which gets the page of the list.
+
+        """
+        m = self.service.users().messages()
+        return m.list(userId = 'me', labelIds = ['SENT'], pageToken = nextPage,
+                      fields = cfe.MSG_LIST_FIELDS)
+
+    def get_request(self, resId):
+        """
+        Obtains the Gmail API request which gets the messages resource.
+
+        Parameters
+        ----------
+        resId : str
+            Message resource's identifier that we want to retrieve.
+
+        Returns
+        -------
+        HttpRequest which gets the Gmail API users.messages resource.
+
+        """
+        m = self.service.users().messages()
+        return m.get(id = resId, userId = 'me', fields = cfe.MSG_FIELDS)
+
+    def get_metadata_request(self, resId):
+        """
+        Obtains the Gmail API request which gets the metadata (size estimate
+        and headers) of the messages resource.
+
+        Parameters
+        ----------
+        resId : str
+            Message resource's identifier whose metadata we want to retrieve.
+
+        Returns
+        -------
+        HttpRequest which gets the metadata of the Gmail API users.messages
+        resource.
+
+        """
+        m = self.service.users().messages()
+        return m.get(id = resId, userId = 'me', format = 'metadata',
+                     metadataHeaders = cfe.METADATA_HEADERS,
+                     fields = cfe.METADATA_FIELDS)
+
+    def is_worth_extracting(self, metadata):
+        """
+        Checks whether a message passes the depth and size estimate filters.
+
+        Parameters
+        ----------
+        metadata : dict
+            Gmail API users.messages resource obtained with format metadata.
+
+        Returns
+        -------
+        bool: True if the message has to be extracted.
+
+        """
+        size = metadata.get('sizeEstimate', 0)
+        if cfe.MIN_SIZE_ESTIMATE is not None and size < cfe.MIN_SIZE_ESTIMATE:
+            return False
+        if cfe.MAX_SIZE_ESTIMATE is not None and size > cfe.MAX_SIZE_ESTIMATE:
+            return False
+        
+        if cfe.MAX_DEPTH is not None:
+            depth = 0
+            for h in metadata.get('payload', {}).get('headers', []):
+                if h['name'] == 'References':
+                    depth = self.__count_num_ref(h['value'])
+            if depth > cfe.MAX_DEPTH:
+                return False
+        return True
+
     def get_resource(self, resId):
         """
         Obtains the Gmail API messages resource.
@@ -80,8 +184,7 @@ class MessageExtractor(Extractor):
 
         """
         self.wait_for_request(qu.MSG_GET)
-        m = self.service.users().messages()
-        msg = m.get(id = resId, userId = 'me').execute()
+        msg = self.execute_request(self.get_request(resId), qu.MSG_GET)
         self.update_attributes(qu.MSG_GET)
         return msg
     
@@ -141,18 +244,15 @@ class MessageExtractor(Extractor):
 
         plain_text = self.data_extractor.get_plain_text()
         if plain_text is not None:
-            msg.bodyBase64Plain = base64.urlsafe_b64encode(
-                plain_text.encode()).decode()
+            msg.bodyPlain = plain_text
             msg.plainEncoding = self.data_extractor.get_plain_encod()
             msg.charLength = len(plain_text)
 
         html_text = self.data_extractor.get_html_text()
         if html_text is not None:
-            msg.bodyBase64Html = base64.urlsafe_b64encode(
-                html_text.encode()).decode()
-            if (plain_text is None):
-                p_text = self.html_converter.handle(html_text)
-                msg.bodyBase64Plain = base64.urlsafe_b64encode(
-                    p_text.encode()).decode()
-                msg.charLength = len(p_text)
+            msg.bodyHtml = html_text
+            if plain_text is None:
+                # Its plain text, and so its length, is obtained when it is
+                # preprocessed
+                msg.charLength = None
         return [msg]
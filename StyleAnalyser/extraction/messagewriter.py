@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jun 20 12:41:08 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from __future__ import print_function
+import mongoengine as db
+from bson import BSON
+from pymongo.errors import BulkWriteError
+import extraction.confextraction as cfe
+from extraction.extractedmessage import ExtractedMessage
+from pipelinelog import get_logger
+from time import perf_counter
+
+log = get_logger('extraction')
+
+class MessageWriter:
+    """
+    The MessageWriter class collects ExtractedMessage documents and inserts
+    them in the database with a single unordered insert_many when the buffer
+    reaches a number of documents or a size in bytes.
+    
+    Attributes
+    ----------
+    __user_name: str
+        Gmail user name (used for the log records).
+    __listener: function
+        Function which is called with the list of ExtractedMessage objects that
+        have been inserted in each flush. It can be None.
+    __max_docs: int
+        Maximum number of documents buffered.
+    __max_bytes: int
+        Maximum size in bytes of the buffered documents.
+    __buffer: list
+        Buffered ExtractedMessage objects.
+    __docs: list
+        BSON documents of the buffered ExtractedMessage objects.
+    __indexes: list
+        Number of the resource of each buffered message (for the log records).
+    __size: int
+        Size in bytes of the buffered documents.
+        
+    """
+    def __init__(self, user_name, listener = None, max_docs = cfe.WRITER_MAX_DOCS,
+                 max_bytes = cfe.WRITER_MAX_BYTES):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        user_name : str
+            Gmail user name.
+        listener : function, optional
+            Function which is called with the inserted ExtractedMessage objects
+            after each flush. The default is None.
+        max_docs : int, optional
+            Maximum number of documents buffered. The default is 
+            cfe.WRITER_MAX_DOCS.
+        max_bytes : int, optional
+            Maximum size in bytes of the buffered documents. The default is
+            cfe.WRITER_MAX_BYTES.
+
+        Returns
+        -------
+        Constructed MessageWriter class.
+
+        """
+        self.__user_name = user_name
+        self.__listener = listener
+        self.__max_docs = max_docs
+        self.__max_bytes = max_bytes
+        self.__buffer = []
+        self.__docs = []
+        self.__indexes = []
+        self.__size = 0
+        
+    def __len__(self):
+        """
+        Obtains the number of buffered messages.
+
+        Returns
+        -------
+        int: number of buffered messages.
+
+        """
+        return len(self.__buffer)
+        
+    def add(self, msg, extracted):
+        """
+        Adds the given message to the buffer. The buffer is flushed if it
+        reaches its maximum number of documents or size.
+
+        Parameters
+        ----------
+        msg : ExtractedMessage
+            Message which is going to be saved.
+        extracted : int
+            Number of resources extracted before the one of this message.
+
+        Returns
+        -------
+        None.
+
+        """
+        try:
+            msg.validate()
+        except db.ValidationError as e:
+            log.error('validation error', extra = {'user' : self.__user_name,
+                                                   'msg_id' : msg.msg_id,
+                                                   'error' : str(e)})
+            return
+        
+        doc = msg.to_mongo()
+        self.__buffer.append(msg)
+        self.__docs.append(doc)
+        self.__indexes.append(extracted)
+        self.__size += len(BSON.encode(doc))
+        
+        if (len(self.__buffer) >= self.__max_docs or 
+            self.__size >= self.__max_bytes):
+            self.flush()
+            
+    def flush(self):
+        """
+        Inserts the buffered messages with an unordered insert_many. Only the
+        messages which have actually failed are logged as errors.
+
+        Returns
+        -------
+        list: inserted ExtractedMessage objects.
+
+        """
+        if not self.__buffer:
+            return []
+        
+        failed = {}
+        start = perf_counter()
+        try:
+            ExtractedMessage._get_collection().insert_many(self.__docs, 
+                                                           ordered = False)
+        except BulkWriteError as e:
+            for err in e.details['writeErrors']:
+                failed[err['index']] = err
+                
+        duration = perf_counter() - start
+                
+        inserted = []
+        for i, m in enumerate(self.__buffer):
+            if not(i in failed):
+                inserted.append(m)
+                print(f"Extraction succesfull {m.msg_id}.")
+                log.info('extracted', extra = {'user' : self.__user_name,
+                                               'msg_id' : m.msg_id,
+                                               'index' : self.__indexes[i]})
+            else:
+                log.error('insertion error', extra = {
+                    'user' : self.__user_name, 'msg_id' : m.msg_id,
+                    'code' : failed[i]['code'], 'error' : failed[i]['errmsg']})
+        log.info('flush', extra = {'user' : self.__user_name,
+                                   'inserted' : len(inserted),
+                                   'failed' : len(failed),
+                                   'duration' : duration})
+                    
+        self.__buffer = []
+        self.__docs = []
+        self.__indexes = []
+        self.__size = 0
+        
+        if self.__listener is not None and inserted:
+            self.__listener(inserted)
+        return inserted
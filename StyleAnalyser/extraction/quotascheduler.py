@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jun 17 18:02:37 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import threading
+import quotaunits as qu
+from datetime import datetime
+from datetime import timedelta
+from time import monotonic
+from time import sleep
+
+SECONDS_PER_DAY = 86400
+
+class TokenBucket:
+    """
+    The TokenBucket class represents a bucket of quota units. If it has no
+    period, it is refilled continuously (sub-second refill) at a constant rate.
+    Otherwise it is refilled completely each time a period finishes. This class
+    is not thread safe by itself, QuotaScheduler protects it.
+    
+    Attributes
+    ----------
+    capacity: float
+        Maximum number of quota units that the bucket can store.
+    rate: float
+        Quota units added to the bucket per second (continuous refill).
+    period: float
+        Seconds of each window of the bucket (refill per period). None if the
+        bucket is refilled continuously.
+    tokens: float
+        Quota units currently available in the bucket.
+    last_refill: float
+        Moment (monotonic clock) in which the bucket was refilled for the last
+        time (or in which the current period started).
+        
+    """
+    def __init__(self, capacity, rate = None, tokens = None, period = None):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        capacity : float
+            Maximum number of quota units that the bucket can store.
+        rate : float, optional
+            Quota units added to the bucket per second. The default is None.
+        tokens : float, optional
+            Quota units initially available. The default is None, which means
+            that the bucket starts full.
+        period : float, optional
+            Seconds after which the bucket is completely refilled. It replaces
+            the continuous refill. The default is None.
+
+        Returns
+        -------
+        Constructed TokenBucket class.
+
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.period = period
+        self.tokens = capacity if tokens is None else min(tokens, capacity)
+        self.last_refill = monotonic()
+        
+    def refill(self, now):
+        """
+        Adds to the bucket the quota units earned since the last refill.
+
+        Parameters
+        ----------
+        now : float
+            Current moment (monotonic clock).
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.period is not None:
+            if now - self.last_refill >= self.period:
+                self.tokens = self.capacity
+                self.last_refill += self.period * ((now - self.last_refill) // 
+                                                   self.period)
+        elif now > self.last_refill:
+            self.tokens = min(self.capacity, 
+                              self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            
+    def get_wait_time(self, units, now):
+        """
+        Obtains how long it is needed to wait until the bucket has the given
+        quota units. The bucket must be refilled before calling this method.
+
+        Parameters
+        ----------
+        units : int
+            Quota units that are going to be consumed.
+        now : float
+            Current moment (monotonic clock).
+
+        Returns
+        -------
+        float: seconds to wait (0 if the units are already available).
+
+        """
+        if self.tokens >= units:
+            return 0.0
+        elif self.period is not None:
+            return self.last_refill + self.period - now
+        return (units - self.tokens) / self.rate
+
+class QuotaScheduler:
+    """
+    The QuotaScheduler class is a thread safe token-bucket rate limiter for the
+    Gmail API quota units. It has a per-second bucket, which is refilled
+    continuously, and a daily bucket, which is refilled when the day finishes.
+    A request can only be made when both of them have enough quota units.
+    Several extraction workers can share the same scheduler.
+    
+    Attributes
+    ----------
+    __second_bucket: TokenBucket
+        Bucket of the Gmail API quota units per second.
+    __day_bucket: TokenBucket
+        Bucket of the Gmail API quota units per day.
+    __lock: threading.Lock
+        Lock which protects the buckets and the statistics.
+    __start_time: float
+        Moment (monotonic clock) in which the scheduler was created.
+    __consumed: int
+        Quota units consumed through the scheduler.
+    __requests: int
+        Number of acquisitions made through the scheduler.
+    __blocked_time: float
+        Seconds spent waiting for quota units.
+    __paused_until: float
+        Moment (monotonic clock) until which no quota units are given because
+        a request failed (see backoff).
+    __retries: int
+        Number of retried requests.
+    __backoff_time: float
+        Seconds of the backoffs of the retried requests.
+        
+    """
+    def __init__(self, quota = qu.QUOTA_UNITS_PER_DAY, 
+                 units_per_sec = qu.QUOTA_UNITS_PER_SECOND,
+                 units_per_day = qu.QUOTA_UNITS_PER_DAY):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        quota : int, optional
+            Remaining Gmail API quota units of the day. The default is
+            qu.QUOTA_UNITS_PER_DAY.
+        units_per_sec : int, optional
+            Gmail API quota units per second. The default is 
+            qu.QUOTA_UNITS_PER_SECOND.
+        units_per_day : int, optional
+            Gmail API quota units per day. The default is 
+            qu.QUOTA_UNITS_PER_DAY.
+
+        Returns
+        -------
+        Constructed QuotaScheduler class.
+
+        """
+        self.__second_bucket = TokenBucket(units_per_sec, units_per_sec)
+        self.__day_bucket = TokenBucket(units_per_day, tokens = quota,
+                                        period = SECONDS_PER_DAY)
+        self.__lock = threading.Lock()
+        self.__start_time = monotonic()
+        self.__consumed = 0
+        self.__requests = 0
+        self.__blocked_time = 0.0
+        self.__paused_until = 0.0
+        self.__retries = 0
+        self.__backoff_time = 0.0
+        
+    def try_acquire(self, units):
+        """
+        Consumes the given quota units if both buckets have them available.
+
+        Parameters
+        ----------
+        units : int
+            Quota units of the Gmail API request that is going to be made.
+
+        Raises
+        ------
+        ValueError
+            If the request needs more quota units than the per-second bucket
+            can ever store.
+
+        Returns
+        -------
+        float: 0 if the quota units have been consumed or the seconds that it
+        is needed to wait before trying again.
+
+        """
+        if units > self.__second_bucket.capacity:
+            raise ValueError(f'A request of {units} quota units exceeds the ' +
+                             'quota units per second.')
+        with self.__lock:
+            now = monotonic()
+            self.__second_bucket.refill(now)
+            self.__day_bucket.refill(now)
+            wait = max(self.__second_bucket.get_wait_time(units, now),
+                       self.__day_bucket.get_wait_time(units, now),
+                       self.__paused_until - now, 0.0)
+            if wait == 0:
+                self.__second_bucket.tokens -= units
+                self.__day_bucket.tokens -= units
+                self.__consumed += units
+                self.__requests += 1
+            return wait
+        
+    def acquire(self, units):
+        """
+        Waits until the given quota units are available and consumes them.
+
+        Parameters
+        ----------
+        units : int
+            Quota units of the Gmail API request that is going to be made.
+
+        Returns
+        -------
+        float: seconds spent waiting.
+
+        """
+        waited = 0.0
+        wait = self.try_acquire(units)
+        while wait > 0:
+            sleep(wait)
+            waited += wait
+            wait = self.try_acquire(units)
+            
+        if waited > 0:
+            with self.__lock:
+                self.__blocked_time += waited
+        return waited
+    
+    def backoff(self, seconds):
+        """
+        Pauses the acquisitions of quota units during the given seconds because
+        a request has failed with a rate limit or transient error, so every
+        worker which shares the scheduler slows down. It is counted as a retry.
+
+        Parameters
+        ----------
+        seconds : float
+            Seconds of the backoff.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, monotonic() + seconds)
+            self.__retries += 1
+            self.__backoff_time += seconds
+
+    def get_remaining(self):
+        """
+        Obtains the remaining Gmail API quota units of the day.
+
+        Returns
+        -------
+        int: remaining quota units.
+
+        """
+        with self.__lock:
+            self.__day_bucket.refill(monotonic())
+            return int(self.__day_bucket.tokens)
+        
+    def get_day_usage(self):
+        """
+        Obtains the moment in which the current quota day started and the
+        quota units consumed since then, so they can be saved and restored
+        with restore_day_usage after a restart.
+
+        Returns
+        -------
+        dayStart: datetime
+            Moment (UTC) in which the current quota day started.
+        consumed: int
+            Quota units consumed in the current quota day.
+
+        """
+        with self.__lock:
+            now = monotonic()
+            self.__day_bucket.refill(now)
+            day_start = datetime.utcnow() - timedelta(
+                seconds = now - self.__day_bucket.last_refill)
+            return day_start, int(self.__day_bucket.capacity - 
+                                  self.__day_bucket.tokens)
+
+    def restore_day_usage(self, day_start, consumed):
+        """
+        Continues the quota day of a previous execution: the daily bucket is
+        refilled when that day finishes and the quota units consumed in it are
+        not available. If that day has already finished, nothing changes.
+
+        Parameters
+        ----------
+        day_start : datetime
+            Moment (UTC) in which the quota day started.
+        consumed : int
+            Quota units consumed in that quota day.
+
+        Returns
+        -------
+        None.
+
+        """
+        elapsed = (datetime.utcnow() - day_start).total_seconds()
+        with self.__lock:
+            if 0 <= elapsed < self.__day_bucket.period:
+                self.__day_bucket.last_refill = monotonic() - elapsed
+                self.__day_bucket.tokens = min(self.__day_bucket.tokens, 
+                                               max(0, self.__day_bucket.capacity - 
+                                                   consumed))
+
+    def get_available_per_second(self):
+        """
+        Obtains the Gmail API quota units that can be consumed right now 
+        without exceeding the quota units per second.
+
+        Returns
+        -------
+        int: available quota units.
+
+        """
+        with self.__lock:
+            self.__second_bucket.refill(monotonic())
+            return int(self.__second_bucket.tokens)
+        
+    def get_stats(self):
+        """
+        Obtains the utilization of the scheduler.
+
+        Returns
+        -------
+        dict: statistics with the following structure:
+            {
+                'consumed' : int,        # Quota units consumed
+                'requests' : int,        # Number of acquisitions
+                'blockedTime' : float,   # Seconds waiting (summed over threads)
+                'elapsed' : float,       # Seconds since its creation
+                'utilization' : float,   # Fraction of the allowed units used
+                'retries' : int,         # Number of retried requests
+                'backoffTime' : float    # Seconds of the backoffs
+            }
+
+        """
+        with self.__lock:
+            elapsed = monotonic() - self.__start_time
+            # Quota units that could have been consumed since its creation
+            limit = (self.__second_bucket.capacity + 
+                     elapsed * self.__second_bucket.rate)
+            return {'consumed' : self.__consumed,
+                    'requests' : self.__requests,
+                    'blockedTime' : self.__blocked_time,
+                    'elapsed' : elapsed,
+                    'utilization' : self.__consumed / limit if limit > 0 else 0.0,
+                    'retries' : self.__retries,
+                    'backoffTime' : self.__backoff_time}
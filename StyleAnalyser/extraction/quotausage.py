@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 13:32:10 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import mongoengine as db
+import quotaunits as qu
+from datetime import datetime
+from datetime import timedelta
+
+class QuotaUsage(db.Document):
+    """
+    Class which manage the MongoDB table about the Gmail API quota units
+    consumed by each user in the current quota day, so the daily limit is not
+    reset when the extraction is restarted.
+
+    Attributes
+    ----------
+    user_name: db.StringField
+        Gmail user name.
+    dayStart: db.DateTimeField
+        Moment (UTC) in which the current quota day started.
+    consumed: db.IntField
+        Quota units consumed since dayStart.
+    updated: db.DateTimeField
+        Moment in which the usage was saved.
+
+    """
+    user_name = db.StringField(required = True, primary_key = True)
+    dayStart = db.DateTimeField()
+    consumed = db.IntField(default = 0)
+    updated = db.DateTimeField()
+
+    meta = {
+        'db_alias': 'core',
+        'collection': 'quotausage'
+    }
+
+    def is_current(self):
+        """
+        Checks whether the quota day of the usage has not finished yet.
+
+        Returns
+        -------
+        bool: True if the consumed quota units still count.
+
+        """
+        return (self.dayStart is not None and
+                datetime.utcnow() - self.dayStart < timedelta(days = 1))
+
+    def get_remaining_quota(self):
+        """
+        Obtains the remaining Gmail API quota units of the day. If the quota
+        day has finished, the quota units of a whole day are available.
+
+        Returns
+        -------
+        int: remaining quota units.
+
+        """
+        if not(self.is_current()):
+            return qu.QUOTA_UNITS_PER_DAY
+        return max(0, qu.QUOTA_UNITS_PER_DAY - self.consumed)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Jun 28 10:21:47 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import json
+import random
+import socket
+import ssl
+import http.client
+from httplib2 import ServerNotFoundError
+from googleapiclient.errors import HttpError
+import extraction.confextraction as cfe
+
+# Transport errors raised by httplib2 and http.client when the connection fails
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout, ssl.SSLError,
+                    http.client.HTTPException, ServerNotFoundError)
+
+def get_error_reasons(error):
+    """
+    Obtains the reasons of a Gmail API error (for example, rateLimitExceeded).
+
+    Parameters
+    ----------
+    error : HttpError
+        Gmail API error.
+
+    Returns
+    -------
+    set: reasons of the error (empty if its content has not them).
+
+    """
+    try:
+        content = json.loads(error.content.decode('utf-8'))
+        return {e.get('reason') for e in content['error'].get('errors', [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+def is_retryable(error):
+    """
+    Checks whether a failed request can succeed if it is retried: rate limit
+    errors, server errors and transport errors (except certificate errors,
+    which fail again).
+
+    Parameters
+    ----------
+    error : Exception
+        Error raised by the request.
+
+    Returns
+    -------
+    bool: True if the request has to be retried.
+
+    """
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        return (status in cfe.RETRY_STATUS or 
+                (status == 403 and bool(get_error_reasons(error) & cfe.RETRY_REASONS)))
+    if isinstance(error, ssl.SSLCertVerificationError):
+        return False
+    return isinstance(error, TRANSIENT_ERRORS)
+
+def is_not_found(error):
+    """
+    Checks whether a failed request asked for a resource which does not exist
+    (for example, a message deleted after the list page was obtained).
+
+    Parameters
+    ----------
+    error : Exception
+        Error raised by the request.
+
+    Returns
+    -------
+    bool: True if the resource was not found.
+
+    """
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+def get_backoff_delay(attempt, error = None):
+    """
+    Obtains the seconds to wait before retrying a request with jittered
+    exponential backoff: a random time between 0 and the exponential limit of
+    the attempt, so the workers which failed at the same time do not retry at
+    the same time. If the error has a Retry-After header, it is waited at
+    least that time.
+
+    Parameters
+    ----------
+    attempt : int
+        Number of retries of the request made before this one.
+    error : Exception, optional
+        Error raised by the request. The default is None.
+
+    Returns
+    -------
+    float: seconds to wait.
+
+    """
+    delay = random.uniform(0, min(cfe.RETRY_MAX_DELAY,
+                                  cfe.RETRY_BASE_DELAY * 2 ** attempt))
+    if isinstance(error, HttpError):
+        try:
+            delay = max(delay, float(error.resp.get('retry-after', 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
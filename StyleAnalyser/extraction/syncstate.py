@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jun 23 17:26:54 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import mongoengine as db
+
+class SyncState(db.Document):
+    """
+    Class which manage the MongoDB table about the synchronization state of
+    each user's mailbox, so the next extractions only request the messages
+    added since the last one.
+    
+    Attributes
+    ----------
+    user_name: db.StringField
+        Gmail user name.
+    historyId: db.StringField
+        Gmail history identifier of the mailbox when the last complete
+        extraction started. Every sent message before it has been extracted.
+    pendingHistoryId: db.StringField
+        Gmail history identifier of the mailbox when the current (unfinished)
+        full extraction started.
+    uidValidity: db.IntField
+        UIDVALIDITY of the IMAP folder of the sent messages when uidNext was
+        saved. If it changes, the UIDs are not valid anymore.
+    uidNext: db.IntField
+        Every sent message of the IMAP folder with a lower UID has been
+        extracted.
+        
+    """
+    user_name = db.StringField(required = True, primary_key = True)
+    historyId = db.StringField()
+    pendingHistoryId = db.StringField()
+    uidValidity = db.IntField()
+    uidNext = db.IntField()
+    
+    meta = {
+        'db_alias': 'core',
+        'collection': 'syncstate'
+    }
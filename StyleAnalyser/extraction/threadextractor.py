@@ -8,14 +8,15 @@ Created on Tue Nov 12 14:32:54 2019
 from __future__ import print_function
 from extraction.extractor import Extractor
 import quotaunits as qu
-import base64
+import extraction.confextraction as cfe
 from extraction.extractedmessage import ExtractedMessage
 
 class ThreadExtractor(Extractor):
     """
     Implements Extractor class
     """
-    def __init__(self, service, usu, quota):
+    def __init__(self, service, usu, quota, batch = False, scheduler = None,
+                 num_workers = 0, http_factory = None, async_factory = None):
         """
         Class constructor.
 
@@ -27,15 +28,32 @@ class ThreadExtractor(Extractor):
             Gmail user name.
         quota: int
             Gmail API quota units available for message extraction.
+        batch: bool, optional
+            Indicates whether the resources are obtained with batch requests.
+            The default is False.
+        scheduler: QuotaScheduler, optional
+            Rate limiter shared with other extractors. The default is None.
+        num_workers: int, optional
+            Number of fetch workers of the concurrent mode. The default is 0.
+        http_factory: function, optional
+            Function that creates an authorized http object for each fetch
+            worker. The default is None.
+        async_factory: function, optional
+            Function that creates the asynchronous Gmail API client of the
+            asynchronous engine. The default is None.
 
         Returns
         -------
         Constructed ThreadExtractor class.
 
         """
-        super().__init__(service, usu, quota)
+        super().__init__(service, usu, quota, batch, scheduler, num_workers,
+                         http_factory, async_factory)
         self.min_qu = qu.MIN_QUNITS_THRD
+        self.get_qu = qu.THREADS_GET
+        self.list_qu = qu.THREADS_LIST
         self.list_key = 'threads'
+        self.history_key = 'threadId'
 
     def get_list(self, nextPage):
         """
@@ -60,11 +78,46 @@ class ThreadExtractor(Extractor):
 
         """
         self.wait_for_request(qu.THREADS_LIST)
-        t = self.service.users().threads()
-        l = t.list(userId = 'me', labelIds = ['SENT'], pageToken = nextPage).execute()
+        l = self.execute_request(self.get_list_request(nextPage), qu.THREADS_LIST)
         self.update_attributes(qu.THREADS_LIST)
         return l
 
+    def get_list_request(self, nextPage):
+        """
+        Obtains the Gmail API request which gets a page of the list of sent
+        threads.
+
+        Parameters
+        ----------
+        nextPage : str
+            Page token to retrieve a specific page of results in the list.
+
+        Returns
+        -------
+        HttpRequest which gets the page of the list.
+
+        """
+        t = self.service.users().threads()
+        return t.list(userId = 'me', labelIds = ['SENT'], pageToken = nextPage,
+                      fields = cfe.THREAD_LIST_FIELDS)
+
+    def get_request(self, resId):
+        """
+        Obtains the Gmail API request which gets the threads resource.
+
+        Parameters
+        ----------
+        resId : str
+            Thread resource's identifier that we want to retrieve.
+
+        Returns
+        -------
+        HttpRequest which gets the Gmail API users.threads resource.
+
+        """
+        return self.service.users().threads().get(id = resId, userId = 'me',
+                                                  fields = cfe.THREAD_FIELDS)
+
     def get_resource(self, resId):
         """
         Obtains the Gmail API threads resource.
@@ -80,7 +133,7 @@ class ThreadExtractor(Extractor):
 
         """
         self.wait_for_request(qu.THREADS_GET)
-        t = self.service.users().threads().get(id = resId, userId = 'me').execute()
+        t = self.execute_request(self.get_request(resId), qu.THREADS_GET)
         self.update_attributes(qu.THREADS_GET)
         return t
 
@@ -114,20 +167,17 @@ class ThreadExtractor(Extractor):
     
             plain_text = self.data_extractor.get_plain_text()
             if plain_text is not None:
-                msg.bodyBase64Plain = base64.urlsafe_b64encode(
-                    plain_text.encode()).decode()
+                msg.bodyPlain = plain_text
                 msg.plainEncoding = self.data_extractor.get_plain_encod()
                 msg.charLength = len(plain_text)
     
             html_text = self.data_extractor.get_html_text()
             if html_text is not None:
-                msg.bodyBase64Html = base64.urlsafe_b64encode(
-                    html_text.encode()).decode()
-                if (plain_text is None):
-                    p_text = self.html_converter.handle(html_text)
-                    msg.bodyBase64Plain = base64.urlsafe_b64encode(
-                        p_text.encode()).decode()
-                    msg.charLength = len(p_text)
+                msg.bodyHtml = html_text
+                if plain_text is None:
+                    # Its plain text, and so its length, is obtained when it
+                    # is preprocessed
+                    msg.charLength = None
             l_msgs.append(msg)
             depth += 1
         return l_msgs
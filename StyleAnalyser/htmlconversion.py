@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  1 09:14:37 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from html2text import HTML2Text
+
+# Converter of the html bodies without plain text ('html2text' or 'lxml',
+# which is faster but needs the lxml package)
+HTML_CONVERTER = 'html2text'
+# Number of converted bodies which are kept in memory
+HTML_CACHE_SIZE = 4096
+
+# Elements of the html bodies which are not text
+LXML_DROPPED_TAGS = ['head', 'script', 'style', 'title']
+# Elements of the html bodies which are separated by line breaks
+LXML_BLOCK_TAGS = ['p', 'div', 'blockquote', 'pre', 'ul', 'ol', 'li', 'dl',
+                   'dt', 'dd', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+                   'section', 'article', 'header', 'footer', 'address',
+                   'table', 'tr']
+
+class Html2TextConverter:
+    """
+    Converts html bodies to plain text with html2text, ignoring the emphasis,
+    the links, the images and the tables.
+
+    """
+    def convert(self, html):
+        """
+        Converts the given html body to plain text.
+
+        Parameters
+        ----------
+        html : str
+            Html body of a message.
+
+        Returns
+        -------
+        str: body as plain text.
+
+        """
+        # HTML2Text keeps the state of the parsing, so it is not shared by
+        # the threads which convert bodies
+        converter = HTML2Text()
+        converter.ignore_emphasis = True
+        converter.ignore_links = True
+        converter.ignore_images = True
+        converter.ignore_tables = True
+        return converter.handle(html)
+
+class LxmlConverter:
+    """
+    Converts html bodies to plain text with the html parser of lxml. The
+    elements which are not text (LXML_DROPPED_TAGS) are removed and the block
+    elements (LXML_BLOCK_TAGS) are separated by blank lines.
+
+    """
+    def __init__(self):
+        """
+        Class constructor.
+
+        Raises
+        ------
+        ImportError
+            If lxml is not installed.
+
+        Returns
+        -------
+        Constructed LxmlConverter class.
+
+        """
+        import lxml.html
+        self.__parser = lxml.html
+
+    def convert(self, html):
+        """
+        Converts the given html body to plain text.
+
+        Parameters
+        ----------
+        html : str
+            Html body of a message.
+
+        Returns
+        -------
+        str: body as plain text.
+
+        """
+        if not(html.strip()):
+            return ''
+        doc = self.__parser.document_fromstring(html)
+        for el in list(doc.iter(*LXML_DROPPED_TAGS)):
+            el.drop_tree()
+        for el in doc.iter('br'):
+            el.tail = '\n' + (el.tail or '')
+        for el in doc.iter(*LXML_BLOCK_TAGS):
+            el.text = '\n\n' + (el.text or '')
+            el.tail = '\n\n' + (el.tail or '')
+
+        lines = [' '.join(line.split()) for line in doc.text_content().split('\n')]
+        return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip('\n') + '\n'
+
+# Available converters
+CONVERTERS = {'html2text' : Html2TextConverter, 'lxml' : LxmlConverter}
+
+_converter = None
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def set_converter(converter):
+    """
+    Changes the converter of the html bodies. The cached conversions are
+    removed.
+
+    Parameters
+    ----------
+    converter : str or object
+        Name of a converter of CONVERTERS or object with a convert(html)
+        method.
+
+    Returns
+    -------
+    None.
+
+    """
+    global _converter
+    if isinstance(converter, str):
+        converter = CONVERTERS[converter]()
+    with _cache_lock:
+        _converter = converter
+        _cache.clear()
+
+def get_converter():
+    """
+    Obtains the converter of the html bodies (HTML_CONVERTER if it has not
+    been changed).
+
+    Returns
+    -------
+    Converter of the html bodies.
+
+    """
+    if _converter is None:
+        set_converter(HTML_CONVERTER)
+    return _converter
+
+def html_to_text(html):
+    """
+    Converts the given html body to plain text. The conversions are memoised
+    by the hash of the body, so repeated bodies (templates, automatic replies,
+    ...) are only converted once.
+
+    Parameters
+    ----------
+    html : str
+        Html body of a message.
+
+    Returns
+    -------
+    str: body as plain text.
+
+    """
+    converter = get_converter()
+    key = hashlib.sha1(html.encode('utf-8', 'surrogatepass')).digest()
+    with _cache_lock:
+        text = _cache.get(key)
+        if text is not None:
+            _cache.move_to_end(key)
+            return text
+
+    text = converter.convert(html)
+    with _cache_lock:
+        if converter is _converter:
+            _cache[key] = text
+            if len(_cache) > HTML_CACHE_SIZE:
+                _cache.popitem(last = False)
+    return text
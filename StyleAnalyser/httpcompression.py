@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jul  6 09:36:12 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import gzip
+import io
+
+# Minimum size (bytes) of the bodies which are compressed
+GZIP_MIN_SIZE = 1024
+# Compression level of the bodies (1 is the fastest and 9 the smallest)
+GZIP_LEVEL = 6
+
+def compress_body(data):
+    """
+    Compresses the given body if it is big enough.
+
+    Parameters
+    ----------
+    data : bytes
+        Body of a request or a response.
+
+    Returns
+    -------
+    data : bytes
+        Body which is going to be sent.
+    compressed : bool
+        Whether it has been compressed.
+
+    """
+    if len(data) < GZIP_MIN_SIZE:
+        return data, False
+    return gzip.compress(data, GZIP_LEVEL), True
+
+class GunzipRequests:
+    """
+    WSGI middleware which decompresses the bodies of the requests sent with
+    'Content-Encoding: gzip', so the Flask application reads them as usual.
+
+    Attributes
+    ----------
+    __app: WSGI application
+        Application which receives the decompressed requests.
+
+    """
+    def __init__(self, app):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        app : WSGI application
+            Application which receives the decompressed requests.
+
+        Returns
+        -------
+        Constructed GunzipRequests class.
+
+        """
+        self.__app = app
+
+    def __call__(self, environ, start_response):
+        if environ.get('HTTP_CONTENT_ENCODING', '').lower() == 'gzip':
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = gzip.decompress(environ['wsgi.input'].read(length))
+            environ['wsgi.input'] = io.BytesIO(body)
+            environ['CONTENT_LENGTH'] = str(len(body))
+            del environ['HTTP_CONTENT_ENCODING']
+        return self.__app(environ, start_response)
+
+def init_compression(app):
+    """
+    Makes the given Flask application accept gzip compressed requests and
+    compress its responses when the client accepts it.
+
+    Parameters
+    ----------
+    app : Flask
+        Application of a stage service.
+
+    Returns
+    -------
+    None.
+
+    """
+    from flask import request
+
+    def compress_response(response):
+        if ('gzip' in request.headers.get('Accept-Encoding', '') and
+            not(response.direct_passthrough) and
+            not('Content-Encoding' in response.headers)):
+            data, compressed = compress_body(response.get_data())
+            if compressed:
+                response.set_data(data)
+                response.headers['Content-Encoding'] = 'gzip'
+                response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    app.wsgi_app = GunzipRequests(app.wsgi_app)
+    app.after_request(compress_response)
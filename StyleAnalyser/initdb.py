@@ -7,14 +7,22 @@ Created on Wed Apr 22 17:50:25 2020
 
 import mongoengine
 
-def init_db():
+# Database of the analysis
+DB_NAME = 'analysis'
+
+def init_db(name = DB_NAME):
     """
     Inits the connection with the MongoDB.
 
+    Parameters
+    ----------
+    name : str, optional
+        Name of the database. The default is DB_NAME.
+
     Returns
     -------
     None.
 
     """
-    mongoengine.register_connection(alias='core', name='analysis')
-    mongoengine.connect('analysis', alias='default')
\ No newline at end of file
+    mongoengine.register_connection(alias='core', name=name)
+    mongoengine.connect(name, alias='default')
\ No newline at end of file
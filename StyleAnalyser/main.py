@@ -7,12 +7,19 @@ Created on Tue Nov 12 14:32:54 2019
 
 from __future__ import print_function
 from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from httplib2 import Http
 import config
 import auth
 from analyser import Analyser
 from analyser import yes_no_question
 import os
 import sys
+from getpass import getpass
+from initdb import init_db
+from extraction.checkpoint import ExtractionCheckpoint
+from pipelinelog import init_logging
+import confanalyser as cfa
 
 def main():
     """
@@ -25,26 +32,50 @@ def main():
     """
     if not(os.getcwd() in sys.path):
         sys.path.append(os.getcwd())
+    init_logging('analyser')
     
-    #Creation of a Gmail resource
-    service = build('gmail', 'v1',
-                    credentials = auth.get_credentials(config.SCOPES, config.CREDS))
     anls = None
     nextPageToken = None
     
     usu = input('Introduce the user name: ')
     
-    if (yes_no_question('Were there a previous execution with the same credentials?')):
-        q = int(input('Introduce the remaining quota units: '))
-        if (yes_no_question('Was it with the same user?')):
-            ext = yes_no_question('Was the previously executed by extracting messages?')
-            nextPageToken = input('Introduce NextPageToken: ')
-            num_res = int(input('How many Gmail resources were extracted? '))
-            anls = Analyser(service, usu, q, ext, num_res)
-        else:
-            anls = Analyser(service, usu, q)
+    if (yes_no_question('Are the messages in a mailbox export (mbox or Maildir)?')):
+        path = input('Introduce the path of the mbox file or Maildir directory: ')
+        anls = Analyser(None, usu, mailbox = path)
+    elif (yes_no_question('Are the messages extracted through IMAP?')):
+        address = input('Introduce the email address: ')
+        password = getpass('Introduce the password (app password in Gmail): ')
+        anls = Analyser(None, usu, imap = (address, password))
     else:
-        anls = Analyser(service, usu)
+        #Creation of a Gmail resource
+        creds = auth.get_credentials(config.SCOPES, config.CREDS)
+        service = build('gmail', 'v1', credentials = creds)
+        # Each fetch worker needs its own http object
+        http_factory = lambda: AuthorizedHttp(creds, http = Http())
+        async_factory = None
+        if cfa.ASYNC_EXTRACTION:
+            from extraction.asyncgmail import AsyncGmailClient
+            async_factory = lambda: AsyncGmailClient(creds)
+        
+        init_db()
+        if ExtractionCheckpoint.objects(user_name = usu, finished = False).first():
+            print('The previous extraction will be resumed from its checkpoint.\n')
+            anls = Analyser(service, usu, http_factory = http_factory,
+                            async_factory = async_factory)
+        elif (yes_no_question('Were there a previous execution with the same credentials?')):
+            q = int(input('Introduce the remaining quota units: '))
+            if (yes_no_question('Was it with the same user?')):
+                ext = yes_no_question('Was the previously executed by extracting messages?')
+                nextPageToken = input('Introduce NextPageToken: ')
+                num_res = int(input('How many Gmail resources were extracted? '))
+                anls = Analyser(service, usu, q, ext, num_res, http_factory,
+                                async_factory = async_factory)
+            else:
+                anls = Analyser(service, usu, q, http_factory = http_factory,
+                                async_factory = async_factory)
+        else:
+            anls = Analyser(service, usu, http_factory = http_factory,
+                            async_factory = async_factory)
         
     if (yes_no_question('Has the user an email signature?')):
         print('Introduce the signature and finish it with the word "STOP".\n')
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jun 17 13:02:37 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import argparse
+import base64
+from pymongo import UpdateOne
+from initdb import init_db
+from bodystorage import compress_body, decompress_body
+from extraction.extractedmessage import ExtractedMessage
+from preprocess.preprocessedmessage import PreprocessedMessage
+from typocorrection.correctedmessage import CorrectedMessage
+
+# Number of documents updated in each bulk write
+MIGRATION_BATCH = 500
+
+def convert_body(doc, kind, to_compressed):
+    """
+    Obtains the update which changes the storage format of a body of the
+    given document.
+
+    Parameters
+    ----------
+    doc : dict
+        Raw document of the collection.
+    kind : str
+        Kind of the body ('Plain' or 'Html').
+    to_compressed : bool
+        Whether the body is stored compressed or as a Base64 encoded string.
+
+    Returns
+    -------
+    set_fields : dict
+        Fields which have to be set.
+    unset_fields : dict
+        Fields which have to be removed.
+
+    """
+    b64_field = 'bodyBase64' + kind
+    zip_field = 'bodyCompressed' + kind
+    if to_compressed and doc.get(b64_field) is not None:
+        text = base64.urlsafe_b64decode(doc[b64_field].encode()).decode()
+        return {zip_field : compress_body(text)}, {b64_field : ''}
+    if not(to_compressed) and doc.get(zip_field) is not None:
+        text = decompress_body(doc[zip_field])
+        return ({b64_field : base64.urlsafe_b64encode(text.encode()).decode()},
+                {zip_field : ''})
+    return {}, {}
+
+def migrate_collection(document, to_compressed):
+    """
+    Changes the storage format of the bodies of every message of the
+    collection of the given document.
+
+    Parameters
+    ----------
+    document : class
+        Document class of the collection (it must have CompressedBody fields).
+    to_compressed : bool
+        Whether the bodies are stored compressed or as Base64 encoded strings.
+
+    Returns
+    -------
+    int: number of migrated messages.
+
+    """
+    coll = document._get_collection()
+    prefix = 'bodyBase64' if to_compressed else 'bodyCompressed'
+    query = {'$or' : [{prefix + 'Plain' : {'$ne' : None}},
+                      {prefix + 'Html' : {'$ne' : None}}]}
+    migrated = 0
+    updates = []
+    for doc in coll.find(query):
+        set_fields = {}
+        unset_fields = {}
+        for kind in ['Plain', 'Html']:
+            s, u = convert_body(doc, kind, to_compressed)
+            set_fields.update(s)
+            unset_fields.update(u)
+        updates.append(UpdateOne({'_id' : doc['_id']},
+                                 {'$set' : set_fields, '$unset' : unset_fields}))
+        if len(updates) == MIGRATION_BATCH:
+            coll.bulk_write(updates, ordered = False)
+            migrated += len(updates)
+            updates = []
+    if updates:
+        coll.bulk_write(updates, ordered = False)
+        migrated += len(updates)
+    return migrated
+
+def main():
+    """
+    Changes the storage format of the bodies of the extracted, preprocessed
+    and corrected messages.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description = 'Changes the storage format'
+                                     + ' of the bodies of the messages.')
+    parser.add_argument('--base64', action = 'store_true',
+                        help = 'store them as Base64 encoded strings instead'
+                        + ' of compressing them')
+    args = parser.parse_args()
+
+    init_db()
+    for document in [ExtractedMessage, PreprocessedMessage, CorrectedMessage]:
+        migrated = migrate_collection(document, not(args.base64))
+        print(f'{migrated} messages of {document.__name__} migrated.')
+
+if __name__ == '__main__':
+    main()
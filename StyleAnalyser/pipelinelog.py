@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Jun 22 10:08:44 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+from time import perf_counter
+
+# Directory where the log file of each run is created
+LOG_DIR = 'logs'
+# Minimum level of the logged records
+LOG_LEVEL = logging.INFO
+# Number of records buffered before writing them in the log file (records of
+# level ERROR or higher are written immediately)
+LOG_BUFFER_RECORDS = 200
+# Maximum seconds that a record stays in the buffer
+LOG_FLUSH_INTERVAL = 5
+# Name of the parent logger of the whole pipeline
+ROOT_LOGGER = 'styleanalyser'
+# Upper bounds (seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Attributes of every LogRecord (the rest are the structured fields)
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+RECORD_ATTRIBUTES |= {'message', 'asctime'}
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the log records as json objects (one per line) with the time, the
+    level, the stage (last component of the logger name), the event and the
+    structured fields given with the extra parameter (msg_id, duration,
+    quota, ...).
+
+    """
+    def format(self, record):
+        """
+        Formats the given record.
+
+        Parameters
+        ----------
+        record : LogRecord
+            Record which is going to be formatted.
+
+        Returns
+        -------
+        str: record in json format.
+
+        """
+        entry = {'time' : record.created,
+                 'level' : record.levelname,
+                 'stage' : record.name.rpartition('.')[2],
+                 'event' : record.getMessage()}
+        for key, value in vars(record).items():
+            if not(key in RECORD_ATTRIBUTES):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default = str, ensure_ascii = False)
+
+class BufferedHandler(MemoryHandler):
+    """
+    MemoryHandler which also writes the buffered records periodically, so they
+    reach the log file even if no more records arrive.
+
+    Attributes
+    ----------
+    interval: float
+        Seconds between two periodic writes of the buffer.
+    __stopped: threading.Event
+        Event which stops the periodic writes when the handler is closed.
+    __timer: threading.Thread
+        Thread which writes the buffer periodically.
+
+    """
+    def __init__(self, capacity, flushLevel, target,
+                 interval = LOG_FLUSH_INTERVAL):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        capacity : int
+            Number of records buffered before writing them.
+        flushLevel : int
+            Level of the records which are written immediately.
+        target : Handler
+            Handler which writes the records.
+        interval : float, optional
+            Seconds between two periodic writes of the buffer. The default is
+            LOG_FLUSH_INTERVAL.
+
+        Returns
+        -------
+        Constructed BufferedHandler class.
+
+        """
+        super().__init__(capacity, flushLevel, target)
+        self.interval = interval
+        self.__stopped = threading.Event()
+        self.__timer = threading.Thread(target = self.__flush_periodically,
+                                        daemon = True)
+        self.__timer.start()
+
+    def __flush_periodically(self):
+        """
+        Writes the buffered records every interval seconds until the handler
+        is closed.
+
+        Returns
+        -------
+        None.
+
+        """
+        while not(self.__stopped.wait(self.interval)):
+            self.flush()
+
+    def close(self):
+        """
+        Stops the periodic writes, writes the buffered records and closes the
+        handler.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.__stopped.set()
+        self.__timer.join()
+        super().close()
+
+def get_logger(stage):
+    """
+    Obtains the logger of the given stage of the pipeline.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage (extraction, analyser, preprocessor, ...).
+
+    Returns
+    -------
+    Logger of the stage.
+
+    """
+    return logging.getLogger(f'{ROOT_LOGGER}.{stage}')
+
+def init_logging(run_name, log_dir = LOG_DIR):
+    """
+    Starts the logging of the current run (process). The records are put in a
+    queue by the threads of the pipeline and a background thread writes them
+    in buffered batches in the log file of the run, which is opened once.
+
+    Parameters
+    ----------
+    run_name : str
+        Name of the run, used as prefix of the log file.
+    log_dir : str, optional
+        Directory where the log file is created. The default is LOG_DIR.
+
+    Returns
+    -------
+    str: path of the log file of the run.
+
+    """
+    global _listener
+    if _listener is not None:
+        return _listener.path
+
+    os.makedirs(log_dir, exist_ok = True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(log_dir, f'{run_name}-{stamp}-{os.getpid()}.jsonl')
+
+    file_handler = logging.FileHandler(path, encoding = 'utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    buffered = BufferedHandler(LOG_BUFFER_RECORDS, logging.ERROR, file_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(QueueHandler(log_queue))
+    root.propagate = False
+
+    _listener = QueueListener(log_queue, buffered)
+    _listener.path = path
+    _listener.handlers_to_close = [buffered, file_handler]
+    _listener.start()
+    atexit.register(stop_logging)
+    return path
+
+def stop_logging():
+    """
+    Writes the pending records and closes the log file of the run.
+
+    Returns
+    -------
+    None.
+
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers_to_close:
+        handler.close()
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    root.propagate = True
+    _listener = None
+
+@contextmanager
+def timed(logger, event, **fields):
+    """
+    Logs the given event with its duration (seconds) when the block ends.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger of the stage.
+    event : str
+        Name of the event.
+    **fields : dict
+        Structured fields of the record. The block can add more fields to the
+        yielded dictionary.
+
+    Yields
+    ------
+    dict: structured fields of the record.
+
+    """
+    start = perf_counter()
+    try:
+        yield fields
+    finally:
+        fields['duration'] = perf_counter() - start
+        logger.info(event, extra = fields)
+
+class LatencyHistogram:
+    """
+    Histogram of the latencies of an operation. It can be updated by several
+    threads.
+
+    Attributes
+    ----------
+    count: int
+        Number of observed latencies.
+    total: float
+        Sum of the observed latencies (seconds).
+    max: float
+        Maximum observed latency (seconds).
+    __buckets: tuple
+        Upper bounds of the buckets (seconds).
+    __counts: list
+        Number of latencies of each bucket (the last one has the latencies
+        greater than every bound).
+    __lock: threading.Lock
+        Lock of the counters.
+
+    """
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        buckets : tuple, optional
+            Upper bounds of the buckets (seconds), in ascending order. The
+            default is LATENCY_BUCKETS.
+
+        Returns
+        -------
+        Constructed LatencyHistogram class.
+
+        """
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.__buckets = buckets
+        self.__counts = [0] * (len(buckets) + 1)
+        self.__lock = threading.Lock()
+
+    def observe(self, seconds):
+        """
+        Adds a latency to the histogram.
+
+        Parameters
+        ----------
+        seconds : float
+            Latency.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.__lock:
+            self.__counts[bisect_left(self.__buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Obtains an upper bound of the given quantile of the latencies (the
+        bound of the bucket where it is).
+
+        Parameters
+        ----------
+        q : float
+            Quantile (between 0 and 1).
+
+        Returns
+        -------
+        float: upper bound in seconds (the maximum latency if it is greater
+        than every bound). It is None if there are no latencies.
+
+        """
+        with self.__lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            acc = 0
+            for bound, n in zip(self.__buckets, self.__counts):
+                acc += n
+                if acc >= rank:
+                    return min(bound, self.max)
+            return self.max
+
+    def to_dict(self):
+        """
+        Obtains the summary of the histogram as structured fields of a log
+        record.
+
+        Returns
+        -------
+        dict: number, mean, maximum and quantiles (50, 95 and 99) of the
+        latencies and the number of latencies of each bucket ('le_<bound>').
+
+        """
+        summary = {'count' : self.count,
+                   'mean' : self.total / self.count if self.count else None,
+                   'max' : self.max,
+                   'p50' : self.quantile(0.5),
+                   'p95' : self.quantile(0.95),
+                   'p99' : self.quantile(0.99)}
+        with self.__lock:
+            for bound, n in zip(self.__buckets, self.__counts):
+                summary[f'le_{bound}'] = n
+            summary['le_inf'] = self.__counts[-1]
+        return summary
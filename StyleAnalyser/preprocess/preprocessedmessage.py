@@ -6,8 +6,9 @@ Created on Mon Mar  9 17:45:20 2020
 """
 
 import mongoengine as db
+from bodystorage import CompressedBody
 
-class PreprocessedMessage(db.Document):
+class PreprocessedMessage(CompressedBody, db.Document):
     """
     Class which manage the MongoDB table about the preprocessed messages.
     
@@ -37,8 +38,15 @@ class PreprocessedMessage(db.Document):
         Message's subject.
     bodyBase64Plain: db.StringField
         Message's body as a Base64 encoded plain text.
+    bodyCompressedPlain: db.BinaryField
+        Message's body as a zlib compressed plain text.
+    bodyHash: db.StringField
+        Hash of the message's body in the body store (if it is stored there
+        instead of in the message).
     bodyBase64Html: db.StringField
         Message's body as a Base64 encoded html text.
+    bodyCompressedHtml: db.BinaryField
+        Message's body as a zlib compressed html text.
     plainEncoding: db.StringField
         Original message's encoding.
     charLength: db.IntField
@@ -54,8 +62,11 @@ class PreprocessedMessage(db.Document):
     depth = db.IntField(required = True)
     date = db.LongField(required = True)
     subject = db.StringField()
-    bodyBase64Plain = db.StringField(required = True)
+    bodyBase64Plain = db.StringField()
     bodyBase64Html = db.StringField()
+    bodyCompressedPlain = db.BinaryField()
+    bodyHash = db.StringField()
+    bodyCompressedHtml = db.BinaryField()
     plainEncoding = db.StringField()
     charLength = db.IntField()
     
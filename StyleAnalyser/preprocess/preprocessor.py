@@ -12,6 +12,14 @@ from re import search
 from re import finditer
 import preprocess.confprep as cf
 from preprocess.preprocessedmessage import PreprocessedMessage
+from extraction.extractedmessage import ExtractedMessage
+from softbreaks import remove_soft_breaks
+from htmlconversion import html_to_text
+from bodystore import get_body_hash, get_result, save_result, load_body, set_body
+from stagebatch import run_batch
+
+# Name of the stage in the body store
+STAGE = 'preprocessor'
 
 class Preprocessor:
     """
@@ -366,44 +374,6 @@ class Preprocessor:
             
         return cleaned_text.replace('  ', ' ').replace('\n\n', '\n').strip()
         
-    def __clean_decoded_text(self, text):
-        """
-        Removes soft break lines of the message body.
-
-        Parameters
-        ----------
-        text: str
-            Message body
-
-        Returns
-        -------
-        str: Message body without soft break lines.
-        
-        """
-        new_text = ""
-        i = 0
-        n = len(text)
-        while i < n:
-            if (text[i] == '\r' and (i + 1 < n) and text[i + 1] == '\n'):
-                i += 2
-                if (i < n and text[i].isalpha() and new_text[-1].isalpha()):
-                    new_text += ' '
-                while((i + 1 < n) and text[i] == '\r' and text[i + 1] == '\n'):
-                    new_text += text[i + 1]
-                    i += 2
-            elif (text[i] == '\n'):
-                i += 1
-                if (i < n and text[i].isalpha() and new_text[-1].isalpha()):
-                    new_text += ' '
-                while((i < n) and text[i] == '\n'):
-                    new_text += text[i]
-                    i += 1
-            else:
-                new_text += text[i]
-                i += 1
-    
-        return new_text
-    
     def __remove_signature(self, text, sign):
         """
         Removes the signature from the text of the email.
@@ -490,16 +460,16 @@ class Preprocessor:
                     prep_msg['bodyPlain'], raw_msg.pop('bodyHtml'))
             elif ('plainEncoding' in raw_msg and 
                   raw_msg['plainEncoding'] == 'quoted-printable'):
-                prep_msg['bodyPlain'] = self.__clean_decoded_text(
-                    prep_msg['bodyPlain'])
+                prep_msg['bodyPlain'] = remove_soft_breaks(
+                    prep_msg['bodyPlain'], decoded = True)
                     
         elif 'bodyHtml' in raw_msg:
             prep_msg['bodyPlain'] = self.__remove_soft_breaks(
                 raw_msg['bodyPlain'], raw_msg.pop('bodyHtml'))
         elif ('plainEncoding' in raw_msg and 
               raw_msg['plainEncoding'] == 'quoted-printable'):
-            prep_msg['bodyPlain'] = self.__clean_decoded_text(
-                raw_msg['bodyPlain'])
+            prep_msg['bodyPlain'] = remove_soft_breaks(
+                raw_msg['bodyPlain'], decoded = True)
         else:
             prep_msg['bodyPlain'] = raw_msg['bodyPlain']
             
@@ -531,8 +501,6 @@ class Preprocessor:
             prep['subject'] = raw['subject']
         if ('plainEncoding' in raw and raw['plainEncoding'] is not None):
             prep['plainEncoding'] = raw['plainEncoding']
-        if ('bodyBase64Html' in raw):
-            prep['bodyBase64Html'] = raw['bodyBase64Html']
             
     def __save_prep_msg(self, prep):
         """
@@ -554,8 +522,6 @@ class Preprocessor:
                 'subject' : string,          # Optional
                 'bodyPlain' : string,
                 'bodyHtml': string,          # Optional
-                'bodyBase64Plain' : string,
-                'bodyBase64Html' : string,   # Optional
                 'plainEncoding' : string,    # Optional
                 'charLength' : int
             }
@@ -581,12 +547,12 @@ class Preprocessor:
             msg.subject = prep['subject']
             
         msg.depth = prep['depth']
-        msg.bodyBase64Plain = prep['bodyBase64Plain']
+        set_body(msg, prep['bodyPlain'])
         
         if 'plainEncoding' in prep:
             msg.plainEncoding = prep['plainEncoding']
-        if 'bodyBase64Html' in prep:
-            msg.bodyBase64Html = prep['bodyBase64Html']
+        if 'bodyHtml' in prep:
+            msg.bodyHtml = prep['bodyHtml']
 
         msg.charLength = prep['charLength']
         msg.save()
@@ -639,8 +605,10 @@ class Preprocessor:
                 'depth' : int,               # How many messages precede it
                 'date' : long,               # Epoch ms
                 'subject' : string,          # Optional
-                'bodyBase64Plain' : string,  # Optional
-                'bodyBase64Html' : string,   # Optional
+                'bodyPlain' : string,        # Optional
+                'bodyHtml' : string,         # Optional
+                'bodyBase64Plain' : string,  # Optional (if not bodyPlain)
+                'bodyBase64Html' : string,   # Optional (if not bodyHtml)
                 'plainEncoding' : string,    # Optional
                 'charLength' : int           # Optional
             }
@@ -653,29 +621,78 @@ class Preprocessor:
             Message identifier.
         
         """
-        if ('bodyBase64Plain' in raw_msg and 
+        if (('bodyPlain' in raw_msg or 'bodyBase64Plain' in raw_msg or
+             'bodyHtml' in raw_msg or 'bodyBase64Html' in raw_msg) and 
             not(PreprocessedMessage.objects(msg_id = raw_msg['id']).first())):
             prep_msg = {}
-            raw_msg['bodyPlain'] = base64.urlsafe_b64decode(
-                raw_msg['bodyBase64Plain'].encode()).decode()
-            
-            if 'bodyBase64Html' in raw_msg:
+            if not('bodyHtml' in raw_msg) and 'bodyBase64Html' in raw_msg:
                 raw_msg['bodyHtml'] = base64.urlsafe_b64decode(
                     raw_msg['bodyBase64Html'].encode()).decode()
+            html = raw_msg.get('bodyHtml')
             
-            raw_msg['bodyPlain'] = self.__remove_pasted_images(raw_msg['bodyPlain'])
-            self.__extract_body_msg(prep_msg, raw_msg)
+            if 'bodyBase64Plain' in raw_msg and not('bodyPlain' in raw_msg):
+                raw_msg['bodyPlain'] = base64.urlsafe_b64decode(
+                    raw_msg['bodyBase64Plain'].encode()).decode()
             
-            if sign is not None:
-                prep_msg['bodyPlain'] = self.__remove_signature(
-                    prep_msg['bodyPlain'], sign)
+            # The preprocessing of a body only depends on these data
+            key = get_body_hash(raw_msg.get('bodyPlain', ''), html,
+                                raw_msg['depth'] > 0,
+                                raw_msg.get('plainEncoding'), sign)
+            converted = not('bodyPlain' in raw_msg)
+            cached = get_result(STAGE, key)
+            if cached is not None:
+                prep_msg['bodyPlain'] = load_body(cached['bodyHash'])
+                raw_msg['charLength'] = cached.get('charLength',
+                                                   raw_msg.get('charLength'))
+            computed = prep_msg.get('bodyPlain') is None
+            if computed:
+                if converted:
+                    # Messages with only html body are converted when they
+                    # are preprocessed
+                    raw_msg['bodyPlain'] = html_to_text(html)
+                    raw_msg['charLength'] = len(raw_msg['bodyPlain'])
+                raw_msg['bodyPlain'] = self.__remove_pasted_images(raw_msg['bodyPlain'])
+                self.__extract_body_msg(prep_msg, raw_msg)
+                
+                if sign is not None:
+                    prep_msg['bodyPlain'] = self.__remove_signature(
+                        prep_msg['bodyPlain'], sign)
             
-            prep_msg['bodyBase64Plain'] = base64.urlsafe_b64encode(
-                prep_msg['bodyPlain'].encode()).decode()
+            if html is not None:
+                prep_msg['bodyHtml'] = html
             
             self.__copy_metadata(prep_msg, raw_msg)
             prep_msg['charLength'] = len(prep_msg['bodyPlain'])
             
             self.__save_prep_msg(prep_msg)
+            if converted:
+                # The length of the extracted message is known now
+                ExtractedMessage.objects(msg_id = raw_msg['id']).update_one(
+                    set__charLength = raw_msg.get('charLength'))
+            if computed:
+                result = {'bodyHash' : get_body_hash(prep_msg['bodyPlain'])}
+                if converted:
+                    result['charLength'] = raw_msg['charLength']
+                save_result(STAGE, key, result)
             
-            return prep_msg['id']
\ No newline at end of file
+            return prep_msg['id']
+        
+    def preprocess_messages(self, raw_msgs, sign = None):
+        """
+        Preprocesses the given extracted messages (see preprocess_message).
+        
+        Parameters
+        ----------
+        raw_msgs: list
+            Extracted messages which are going to be preprocessed.
+        sign: str (optional)
+            Sign of the person who writes the emails.
+            
+        Returns
+        -------
+        list: result of each message (see stagebatch.run_batch), whose result
+        is {'id' : identifier of the preprocessed message}.
+        
+        """
+        return run_batch(STAGE, lambda m: {'id' : self.preprocess_message(m, sign)},
+                         raw_msgs)
\ No newline at end of file
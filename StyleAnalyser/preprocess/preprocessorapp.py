@@ -13,10 +13,15 @@ if not(os.getcwd() in sys.path):
 from flask import Flask, jsonify, request
 from preprocess.preprocessor import Preprocessor
 from initdb import init_db
+from pipelinelog import get_logger, init_logging, timed
+from stagebatch import to_stage_message
+from httpcompression import init_compression
 
 os.chdir(initial_dir)
 
 app = Flask(__name__)
+init_compression(app)
+log = get_logger('preprocessor')
 preprocessor = Preprocessor()
 
 @app.route('/preprocessor', methods=['POST'])
@@ -35,9 +40,28 @@ def preprocess_message():
     msg['id'] = msg['_id']
     del msg['_id']
     
-    return jsonify({'id' : 
-                    preprocessor.preprocess_message(msg, request.json['sign'])})
+    with timed(log, 'preprocess', msg_id = msg['id']):
+        prep_id = preprocessor.preprocess_message(msg, request.json['sign'])
+    return jsonify({'id' : prep_id})
+
+@app.route('/preprocessor/batch', methods=['POST'])
+def preprocess_messages():
+    """
+    Preprocess the list of extracted messages given by the post method.
+
+    Returns
+    -------
+    json: Dictionary in json format which has the result of each message in
+    'results' (see stagebatch.run_batch).
+
+    """
+    msgs = [to_stage_message(m) for m in request.json['messages']]
+    
+    with timed(log, 'preprocess batch', size = len(msgs)):
+        results = preprocessor.preprocess_messages(msgs, request.json['sign'])
+    return jsonify({'results' : results})
 
 if __name__ == '__main__':
     init_db()
+    init_logging('preprocessor')
     app.run(debug=True)
\ No newline at end of file
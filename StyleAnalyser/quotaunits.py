@@ -14,6 +14,8 @@ MSG_GET = 5
 MSG_LIST = 5
 THREADS_GET = 10
 THREADS_LIST = 10
+GET_PROFILE = 1
+HISTORY_LIST = 2
 
 #Minimum quota units needed to continue messages extraction
 MIN_QUNITS_MSG = 5
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jun 19 09:37:52 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import re
+
+# Runs of line breaks of the html bodies (only CRLF line breaks are soft ones)
+HTML_BREAKS = re.compile(r'(?:\r\n)+')
+# Runs of line breaks of the decoded bodies (CRLF or LF line breaks)
+DECODED_BREAKS = re.compile(r'(?:\r\n)+|\n+')
+
+def iter_soft_break_pieces(text, decoded = False):
+    """
+    Obtains in a single pass the pieces of the given text without its soft
+    break lines. In each run of n line breaks, the first one is a soft break
+    and it is removed, so the run is replaced by n - 1 line breaks. If it is
+    a decoded text, a run of a single break between two letters is replaced
+    by a space and the remaining line breaks are LF.
+
+    Parameters
+    ----------
+    text : str
+        Message body.
+    decoded : bool, optional
+        Whether it is a decoded body (otherwise it is an html body). The
+        default is False.
+
+    Yields
+    ------
+    str: next piece of the text without soft break lines.
+
+    """
+    pattern = DECODED_BREAKS if decoded else HTML_BREAKS
+    n = len(text)
+    last = 0
+    # Whether the last character given is a letter
+    prev_alpha = False
+    for m in pattern.finditer(text):
+        start, end = m.span()
+        if start > last:
+            yield text[last:start]
+            prev_alpha = text[start - 1].isalpha()
+
+        run = m.group()
+        if not(decoded):
+            yield run[2:]
+        elif run[0] == '\r' and len(run) > 2:
+            yield '\n' * (len(run) // 2 - 1)
+            prev_alpha = False
+        elif run[0] == '\n' and len(run) > 1:
+            yield run[1:]
+            prev_alpha = False
+        elif prev_alpha and end < n and text[end].isalpha():
+            yield ' '
+            prev_alpha = False
+        last = end
+
+    if last < n:
+        yield text[last:]
+
+def remove_soft_breaks(text, decoded = False):
+    """
+    Removes soft break lines of the message body in linear time.
+
+    Parameters
+    ----------
+    text : str
+        Message body.
+    decoded : bool, optional
+        Whether it is a decoded body (otherwise it is an html body). The
+        default is False.
+
+    Returns
+    -------
+    str: Message body without soft break lines.
+
+    """
+    return ''.join(iter_soft_break_pieces(text, decoded))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Jul  5 10:18:36 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from itertools import islice
+from pipelinelog import get_logger
+
+log = get_logger('analyser')
+
+# Status of the stage calls which have finished successfully
+STATUS_OK = 200
+# Status of the stage calls which have raised an exception
+STATUS_ERROR = 500
+
+def to_stage_message(msg):
+    """
+    Obtains the given message in the format of the stages (whose identifier
+    is 'id' instead of '_id'). The given message is not modified.
+
+    Parameters
+    ----------
+    msg : dict
+        Message.
+
+    Returns
+    -------
+    dict: message for the stages.
+
+    """
+    if msg.get('_id') is not None:
+        msg = dict(msg)
+        msg['id'] = msg.pop('_id')
+    return msg
+
+def run_batch(stage, func, msgs, *args):
+    """
+    Processes each one of the given messages with the given function. An
+    exception only makes its message fail.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    func : function
+        Function which processes a message.
+    msgs : list
+        Messages in the format of the stages.
+    *args : tuple
+        Rest of the arguments of the function.
+
+    Returns
+    -------
+    list: result of each message, in the same order. It has the following
+    structure:
+        {
+            'status' : int,         # STATUS_OK or STATUS_ERROR
+            'result' : object,      # If the status is STATUS_OK
+            'error' : str           # If the status is STATUS_ERROR
+        }
+
+    """
+    results = []
+    for msg in msgs:
+        try:
+            results.append({'status' : STATUS_OK, 'result' : func(msg, *args)})
+        except Exception as e:
+            log.exception(f'{stage} failed', extra = {'msg_id' : msg.get('id')})
+            results.append({'status' : STATUS_ERROR, 'error' : repr(e)})
+    return results
+
+def pipe_bodies(stage, nlp, msgs, needs_doc):
+    """
+    Processes together with the spaCy's model the bodies of the given messages
+    which need it. A message whose check fails is left out (it will fail in
+    run_batch), and if the model fails no document is given, so each message
+    is processed by itself. Hence a failure never makes the whole batch fail.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    nlp : spaCy model
+        spaCy's trained model of the stage.
+    msgs : list
+        Messages in the format of the stages.
+    needs_doc : function
+        Function which checks whether the body of a message has to be
+        analysed.
+
+    Returns
+    -------
+    dict: spaCy's document of each body.
+
+    """
+    bodies = []
+    for msg in msgs:
+        try:
+            body = msg.get('bodyPlain')
+            if isinstance(body, str) and body and needs_doc(msg):
+                bodies.append(body)
+        except Exception:
+            log.exception(f'{stage} check failed', extra = {'msg_id' : msg.get('id')})
+    bodies = list(dict.fromkeys(bodies))
+    try:
+        return dict(zip(bodies, nlp.pipe(bodies)))
+    except Exception:
+        log.exception(f'{stage} pipe failed', extra = {'bodies' : len(bodies)})
+        return {}
+
+def chunked(iterable, size):
+    """
+    Splits the given iterable in lists of the given size (the last one may
+    be smaller).
+
+    Parameters
+    ----------
+    iterable : iterable
+        Items which are going to be split.
+    size : int
+        Maximum number of items of each list.
+
+    Yields
+    ------
+    list: next items.
+
+    """
+    it = iter(iterable)
+    chunk = list(islice(it, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, size))
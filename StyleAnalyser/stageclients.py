@@ -0,0 +1,595 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Jul  3 09:52:30 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import json
+import threading
+from time import perf_counter
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+import confanalyser as cfa
+from pipelinelog import get_logger, LatencyHistogram
+from httpcompression import compress_body
+from stagebatch import STATUS_OK, STATUS_ERROR, to_stage_message
+
+log = get_logger('analyser')
+
+def get_batch_results(results):
+    """
+    Obtains the status and the result of each message of a batch call.
+
+    Parameters
+    ----------
+    results : list
+        Results of the batch (see stagebatch.run_batch).
+
+    Returns
+    -------
+    list: tuples (status, result), where the result is None if the status is
+    not STATUS_OK.
+
+    """
+    return [(res['status'], res.get('result')) for res in results]
+
+class HttpStages:
+    """
+    Client of the stages of the analysis (preprocessor, typographic corrector
+    and style meter) which runs each one as a service (see their Flask
+    applications), so they can be distributed. The connections to each
+    service are kept alive and the big bodies are compressed.
+
+    Attributes
+    ----------
+    __sessions: dict
+        HTTP session of each service (by its host and port).
+    __latencies: dict
+        Latency histogram of each endpoint (by its URL).
+    __lock: threading.Lock
+        Lock of the sessions and the histograms.
+
+    """
+    def __init__(self):
+        """
+        Class constructor.
+
+        Returns
+        -------
+        Constructed HttpStages class.
+
+        """
+        self.__sessions = {}
+        self.__latencies = {}
+        self.__lock = threading.Lock()
+
+    def __get_session(self, url):
+        """
+        Obtains the session of the service of the given URL, whose pool keeps
+        up to cfa.HTTP_POOL_SIZE connections alive.
+
+        Parameters
+        ----------
+        url : str
+            URL of an endpoint of the service.
+
+        Returns
+        -------
+        requests.Session.
+
+        """
+        service = urlsplit(url).netloc
+        with self.__lock:
+            session = self.__sessions.get(service)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections = 1,
+                                      pool_maxsize = cfa.HTTP_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.__sessions[service] = session
+            return session
+
+    def __observe(self, url, seconds):
+        """
+        Adds the latency of a request to the histogram of its endpoint.
+
+        Parameters
+        ----------
+        url : str
+            URL of the endpoint.
+        seconds : float
+            Latency.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.__lock:
+            hist = self.__latencies.setdefault(url, LatencyHistogram())
+        hist.observe(seconds)
+
+    def __send(self, url, body):
+        """
+        Sends the given body to a stage through the session of its service.
+
+        Parameters
+        ----------
+        url : str
+            URL of the stage.
+        body : dict
+            Body of the request (in json).
+
+        Returns
+        -------
+        requests.Response: response of the stage. It is None if the request
+        has failed or timed out.
+
+        """
+        data = json.dumps(body).encode()
+        headers = {'Content-Type' : 'application/json'}
+        if cfa.HTTP_GZIP:
+            data, compressed = compress_body(data)
+            if compressed:
+                headers['Content-Encoding'] = 'gzip'
+        
+        start = perf_counter()
+        try:
+            # The response is decompressed by requests if it is compressed
+            response = self.__get_session(url).post(
+                url, data = data, headers = headers,
+                timeout = (cfa.HTTP_CONNECT_TIMEOUT, cfa.HTTP_READ_TIMEOUT))
+        except requests.RequestException:
+            log.exception('stage request failed', extra = {'url' : url})
+            return None
+        finally:
+            self.__observe(url, perf_counter() - start)
+        return response
+
+    def __post(self, url, body):
+        """
+        Sends the given body to a stage.
+
+        Parameters
+        ----------
+        url : str
+            URL of the stage.
+        body : dict
+            Body of the request (in json).
+
+        Returns
+        -------
+        status : int
+            HTTP status of the response (STATUS_ERROR if the request has
+            failed or timed out).
+        result : dict
+            Response of the stage (None if the status is not STATUS_OK).
+
+        """
+        response = self.__send(url, body)
+        if response is None:
+            return STATUS_ERROR, None
+        if response.status_code != STATUS_OK:
+            return response.status_code, None
+        return response.status_code, response.json()
+
+    def preprocess(self, msg, sign):
+        """
+        Preprocesses the given extracted message.
+
+        Parameters
+        ----------
+        msg : dict
+            Extracted message (see ExtractedMessage.to_message).
+        sign : str
+            Signature of the user in his emails.
+
+        Returns
+        -------
+        status : int
+            Status of the call.
+        result : dict
+            {'id' : identifier of the preprocessed message}
+
+        """
+        return self.__post(cfa.URL_PREP, {'message' : msg, 'sign' : sign})
+
+    def __post_batch(self, url, msgs, **fields):
+        """
+        Sends the given messages to the batch endpoint of a stage.
+
+        Parameters
+        ----------
+        url : str
+            URL of the batch endpoint.
+        msgs : list
+            Messages.
+        **fields : dict
+            Rest of the fields of the body.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message. If the request fails,
+        every message has its status.
+
+        """
+        fields['messages'] = msgs
+        status, result = self.__post(url, fields)
+        if status != STATUS_OK:
+            return [(status, None)] * len(msgs)
+        return get_batch_results(result['results'])
+
+    def preprocess_batch(self, msgs, sign):
+        """
+        Preprocesses the given extracted messages in a single call.
+
+        Parameters
+        ----------
+        msgs : list
+            Extracted messages.
+        sign : str
+            Signature of the user in his emails.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message (see preprocess).
+
+        """
+        return self.__post_batch(cfa.URL_PREP_BATCH, msgs, sign = sign)
+
+    def correct(self, msg, index):
+        """
+        Corrects the typographic errors of the given message from the given
+        token.
+
+        Parameters
+        ----------
+        msg : dict
+            Preprocessed message.
+        index : int
+            Position of the token from which the message is corrected.
+
+        Returns
+        -------
+        status : int
+            Status of the call.
+        result : dict
+            Result of TypoCorrector.correct_msg.
+
+        """
+        return self.__post(cfa.URL_TYPO_CORRECT, {'message' : msg, 'index' : index})
+
+    def correct_batch(self, msgs):
+        """
+        Corrects the typographic errors of the given messages from their first
+        token in a single call.
+
+        Parameters
+        ----------
+        msgs : list
+            Preprocessed messages.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message (see correct).
+
+        """
+        return self.__post_batch(cfa.URL_TYPO_BATCH, msgs)
+
+    def save_oov(self, ling_feat):
+        """
+        Saves the linguistic features of a token out of vocabulary.
+
+        Parameters
+        ----------
+        ling_feat : dict
+            Linguistic features of the token.
+
+        Returns
+        -------
+        int: status of the call.
+
+        """
+        response = self.__send(cfa.URL_TYPO_SAVE, ling_feat)
+        return STATUS_ERROR if response is None else response.status_code
+
+    def measure(self, msg):
+        """
+        Measures the writing style of the given corrected message.
+
+        Parameters
+        ----------
+        msg : dict
+            Corrected message.
+
+        Returns
+        -------
+        status : int
+            Status of the call.
+        result : dict
+            {'id' : identifier of the measured message}
+
+        """
+        return self.__post(cfa.URL_MET, {'message' : msg})
+
+    def measure_batch(self, msgs):
+        """
+        Measures the writing style of the given corrected messages in a single
+        call.
+
+        Parameters
+        ----------
+        msgs : list
+            Corrected messages.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message (see measure).
+
+        """
+        return self.__post_batch(cfa.URL_MET_BATCH, msgs)
+
+    def close(self):
+        """
+        Logs the latency histogram of each endpoint and closes the connections
+        to the services.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.__lock:
+            for url, hist in self.__latencies.items():
+                log.info('http latency', extra = dict(hist.to_dict(), url = url))
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions = {}
+            self.__latencies = {}
+
+class LocalStages:
+    """
+    Client of the stages of the analysis which runs them in the analyser
+    process, sharing its spaCy model, so the messages are neither serialized
+    nor sent through sockets. It gives the same results as HttpStages.
+
+    Attributes
+    ----------
+    __preprocessor: Preprocessor
+        Preprocessor of the extracted messages.
+    __typocorrector: TypoCorrector
+        Corrector of the typographic errors of the preprocessed messages.
+    __stylemeter: StyleMeter
+        Style meter of the corrected messages.
+
+    """
+    def __init__(self, nlp = None):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        nlp : spaCy model, optional
+            spaCy's trained model of the typographic corrector and the style
+            meter. The default is None (cfa.NLP).
+
+        Returns
+        -------
+        Constructed LocalStages class.
+
+        """
+        from preprocess.preprocessor import Preprocessor
+        from typocorrection.typocorrector import TypoCorrector
+        from stylemeasuring.stylemeter import StyleMeter
+        if nlp is None:
+            nlp = cfa.NLP
+        self.__preprocessor = Preprocessor()
+        self.__typocorrector = TypoCorrector(nlp)
+        self.__stylemeter = StyleMeter(nlp)
+
+    def __call(self, stage, func, msg, *args):
+        """
+        Calls the given stage with the message in the format of the stage
+        services (whose identifier is 'id' instead of '_id').
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage.
+        func : function
+            Method of the stage.
+        msg : dict
+            Message.
+        *args : tuple
+            Rest of the arguments of the method.
+
+        Returns
+        -------
+        status : int
+            STATUS_OK or STATUS_ERROR (if the stage has raised an exception).
+        result : object
+            Value returned by the stage (None if it has failed).
+
+        """
+        # The message of the caller is not modified (as in HttpStages)
+        msg = to_stage_message(msg)
+        try:
+            return STATUS_OK, func(msg, *args)
+        except Exception:
+            log.exception(f'{stage} failed', extra = {'msg_id' : msg.get('id')})
+            return STATUS_ERROR, None
+
+    def preprocess(self, msg, sign):
+        """
+        Preprocesses the given extracted message (see HttpStages.preprocess).
+
+        Parameters
+        ----------
+        msg : dict
+            Extracted message (see ExtractedMessage.to_message).
+        sign : str
+            Signature of the user in his emails.
+
+        Returns
+        -------
+        status : int
+            STATUS_OK or STATUS_ERROR.
+        result : dict
+            {'id' : identifier of the preprocessed message}
+
+        """
+        status, prep_id = self.__call('preprocess', self.__preprocessor
+                                      .preprocess_message, msg, sign)
+        return status, {'id' : prep_id}
+
+    def preprocess_batch(self, msgs, sign):
+        """
+        Preprocesses the given extracted messages (see
+        HttpStages.preprocess_batch).
+
+        Parameters
+        ----------
+        msgs : list
+            Extracted messages.
+        sign : str
+            Signature of the user in his emails.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message (see preprocess).
+
+        """
+        return get_batch_results(self.__preprocessor.preprocess_messages(
+            [to_stage_message(m) for m in msgs], sign))
+
+    def correct(self, msg, index):
+        """
+        Corrects the typographic errors of the given message from the given
+        token (see HttpStages.correct).
+
+        Parameters
+        ----------
+        msg : dict
+            Preprocessed message.
+        index : int
+            Position of the token from which the message is corrected.
+
+        Returns
+        -------
+        status : int
+            STATUS_OK or STATUS_ERROR.
+        result : dict
+            Result of TypoCorrector.correct_msg (None if it has failed).
+
+        """
+        return self.__call('typo-correction', self.__typocorrector.correct_msg,
+                           msg, index)
+
+    def correct_batch(self, msgs):
+        """
+        Corrects the typographic errors of the given messages from their first
+        token (see HttpStages.correct_batch).
+
+        Parameters
+        ----------
+        msgs : list
+            Preprocessed messages.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message (see correct).
+
+        """
+        return get_batch_results(self.__typocorrector.correct_msgs(
+            [to_stage_message(m) for m in msgs]))
+
+    def save_oov(self, ling_feat):
+        """
+        Saves the linguistic features of a token out of vocabulary (see
+        HttpStages.save_oov).
+
+        Parameters
+        ----------
+        ling_feat : dict
+            Linguistic features of the token.
+
+        Returns
+        -------
+        int: STATUS_OK or STATUS_ERROR.
+
+        """
+        try:
+            self.__typocorrector.save_oov(ling_feat)
+        except Exception:
+            log.exception('save-oov failed', extra = {'text' : ling_feat.get('text')})
+            return STATUS_ERROR
+        return STATUS_OK
+
+    def measure(self, msg):
+        """
+        Measures the writing style of the given corrected message (see
+        HttpStages.measure).
+
+        Parameters
+        ----------
+        msg : dict
+            Corrected message.
+
+        Returns
+        -------
+        status : int
+            STATUS_OK or STATUS_ERROR.
+        result : dict
+            {'id' : identifier of the measured message}
+
+        """
+        status, met_id = self.__call('style measuring', self.__stylemeter
+                                     .measure_style, msg)
+        return status, {'id' : met_id}
+
+    def measure_batch(self, msgs):
+        """
+        Measures the writing style of the given corrected messages (see
+        HttpStages.measure_batch).
+
+        Parameters
+        ----------
+        msgs : list
+            Corrected messages.
+
+        Returns
+        -------
+        list: tuples (status, result) of each message (see measure).
+
+        """
+        return get_batch_results(self.__stylemeter.measure_styles(
+            [to_stage_message(m) for m in msgs]))
+
+    def close(self):
+        """
+        Releases the resources of the client (see HttpStages.close). The
+        stages run in this process, so there is nothing to release.
+
+        Returns
+        -------
+        None.
+
+        """
+        pass
+
+def get_stages():
+    """
+    Obtains the client of the stages of the analysis configured in
+    cfa.IN_PROCESS_STAGES.
+
+    Returns
+    -------
+    LocalStages or HttpStages.
+
+    """
+    if cfa.IN_PROCESS_STAGES:
+        return LocalStages()
+    return HttpStages()
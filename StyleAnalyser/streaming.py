@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Jul  4 11:07:45 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import queue
+import threading
+from time import perf_counter
+from pipelinelog import get_logger
+
+log = get_logger('analyser')
+
+# Item which tells a worker of a stage that there are no more items
+STOP = object()
+
+class StageWorkers:
+    """
+    Stage of a streaming pipeline. Its items are put in a bounded queue, so
+    the previous stage waits when this one falls behind, and they are
+    processed by a number of worker threads. The value returned for each item
+    (unless it is None) is put in the queue of the next stage. If the stage
+    has a batch size, each worker takes the items which are waiting (up to
+    that size) and processes them together.
+
+    Attributes
+    ----------
+    name: str
+        Name of the stage (used for the log records).
+    processed: int
+        Number of items processed.
+    failed: int
+        Number of items whose processing has raised an exception.
+    busy: float
+        Seconds that the workers have spent processing items.
+    __func: function
+        Function which processes an item.
+    __next: StageWorkers or queue.Queue
+        Next stage (None if it is the last one).
+    __batch_size: int
+        Maximum number of items processed together (None if they are
+        processed one by one).
+    __queue: queue.Queue
+        Pending items.
+    __threads: list
+        Worker threads.
+    __lock: threading.Lock
+        Lock of the counters.
+
+    """
+    def __init__(self, name, func, num_workers, maxsize, next_stage = None,
+                 batch_size = None):
+        """
+        Class constructor.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        func : function
+            Function which processes an item. It returns the item of the next
+            stage or None.
+        num_workers : int
+            Number of worker threads.
+        maxsize : int
+            Maximum number of pending items.
+        next_stage : StageWorkers or queue.Queue, optional
+            Next stage. The default is None.
+        batch_size : int, optional
+            Maximum number of items processed together. If it is not None,
+            the function receives a list of items and returns the list of the
+            items of the next stage. The default is None.
+
+        Returns
+        -------
+        Constructed StageWorkers class.
+
+        """
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.__func = func
+        self.__next = next_stage
+        self.__batch_size = batch_size
+        self.__queue = queue.Queue(maxsize)
+        self.__threads = [threading.Thread(target = self.__work, daemon = True,
+                                           name = f'{name}-{i}')
+                          for i in range(max(1, num_workers))]
+        self.__lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads.
+
+        Returns
+        -------
+        None.
+
+        """
+        for t in self.__threads:
+            t.start()
+
+    def put(self, item):
+        """
+        Adds an item to the stage, waiting while its queue is full.
+
+        Parameters
+        ----------
+        item : object
+            Item which is going to be processed.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.__queue.put(item)
+
+    def __work(self):
+        """
+        Processes the items of the queue until STOP is received.
+
+        Returns
+        -------
+        None.
+
+        """
+        stop = False
+        while not(stop):
+            item = self.__queue.get()
+            if item is STOP:
+                return
+            items = [item]
+            while (self.__batch_size is not None and
+                   len(items) < self.__batch_size and not(stop)):
+                try:
+                    item = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                stop = item is STOP
+                if not(stop):
+                    items.append(item)
+            
+            start = perf_counter()
+            results = []
+            try:
+                if self.__batch_size is None:
+                    results = [self.__func(item)]
+                else:
+                    results = self.__func(items)
+                failed = 0
+            except Exception:
+                log.exception(f'{self.name} failed')
+                failed = len(items)
+            with self.__lock:
+                self.processed += len(items)
+                self.failed += failed
+                self.busy += perf_counter() - start
+            if self.__next is not None:
+                for result in results:
+                    if result is not None:
+                        self.__next.put(result)
+
+    def close(self):
+        """
+        Waits until every item of the stage has been processed and stops its
+        workers.
+
+        Returns
+        -------
+        None.
+
+        """
+        for _ in self.__threads:
+            self.__queue.put(STOP)
+        for t in self.__threads:
+            t.join()
+        log.info('stage finished', extra = {'stage_name' : self.name,
+                                            'processed' : self.processed,
+                                            'failed' : self.failed,
+                                            'busy' : self.busy,
+                                            'workers' : len(self.__threads)})
@@ -10,6 +10,11 @@ import stylemeasuring.confstyle as cfs
 import math
 import base64
 from stylemeasuring.metrics import Metrics
+from bodystore import get_body_hash, get_result, has_result, save_result
+from stagebatch import pipe_bodies, run_batch
+
+# Name of the stage in the body store
+STAGE = 'stylemeter'
 
 class StyleMeter:
     """
@@ -41,7 +46,7 @@ class StyleMeter:
         """
         self.__nlp = nlp
         
-    def __get_structured_text(self, msg):
+    def __get_structured_text(self, msg, doc = None):
         """
         Adds to the msg dictionary a key 'doc', whose value will correspond with
         the spaCy's Doc of the body of the message, and a key 'sentences', whose
@@ -57,19 +62,22 @@ class StyleMeter:
         ----------
         msg : dict
             Dictionary of the corrected message.
+        doc : spacy.Doc, optional
+            spaCy's Doc of the body if it has already been obtained. The
+            default is None.
             
         Returns
         -------
         None.
         
         """
-        msg['doc'] = self.__nlp(msg['bodyPlain'])
+        msg['doc'] = self.__nlp(msg['bodyPlain']) if doc is None else doc
         sentences = [s.text for s in msg['doc'].sents]
         msg['sentences'] = []
 
-        for s in sentences:
+        for s_doc in self.__nlp.pipe(sentences):
             msg['sentences'].append({})
-            msg['sentences'][-1]['doc'] = self.__nlp(s)
+            msg['sentences'][-1]['doc'] = s_doc
             msg['sentences'][-1]['words'] = [t for t in 
                                                 msg['sentences'][-1]['doc']]
         
@@ -474,7 +482,6 @@ class StyleMeter:
                 'date' : long,               # Epoch ms
                 'subject' : string,          # Optional
                 'bodyPlain' : string,
-                'bodyBase64Plain' : string,
                 'plainEncoding' : string,    # Optional
                 'charLength' : int,
                 'doc' : spaCy's Doc,
@@ -518,7 +525,7 @@ class StyleMeter:
         if 'subject' in cor_msg:
             metrics['subject'] = cor_msg['subject']
     
-    def measure_style(self, cor_msg):
+    def measure_style(self, cor_msg, doc = None):
         """
         Measures the writting style of the given message.
 
@@ -537,7 +544,8 @@ class StyleMeter:
                 'depth' : int,               # How many messages precede it
                 'date' : long,               # Epoch ms
                 'subject' : string,          # Optional
-                'bodyBase64Plain' : string,
+                'bodyPlain' : string,        # Optional
+                'bodyBase64Plain' : string,  # Optional (if not bodyPlain)
                 'plainEncoding' : string,    # Optional
                 'charLength' : int,
                 'corrections' : [
@@ -557,6 +565,10 @@ class StyleMeter:
                 ]
             }
 
+        doc : spacy.Doc, optional
+            spaCy's Doc of the body if it has already been obtained. The
+            default is None.
+
         Returns
         -------
         str :
@@ -568,12 +580,45 @@ class StyleMeter:
             if not('bodyPlain' in cor_msg):
                 cor_msg['bodyPlain'] = base64.urlsafe_b64decode(
                             cor_msg['bodyBase64Plain'].encode()).decode()
-            self.__get_structured_text(cor_msg)
-            doc = cor_msg.pop('doc')
-            self.__calculate_metrics(metrics, cor_msg, doc)
+            # The metrics of a body only depend on its corrections
+            key = get_body_hash(cor_msg['bodyPlain'], cor_msg['corrections'],
+                                cor_msg['charLength'])
+            cached = get_result(STAGE, key)
+            if cached is not None:
+                metrics.update(cached)
+            else:
+                self.__get_structured_text(cor_msg, doc)
+                doc = cor_msg.pop('doc')
+                self.__calculate_metrics(metrics, cor_msg, doc)
+                save_result(STAGE, key, metrics)
             self.__copy_metadata(metrics, cor_msg)
             met = Metrics(**metrics)
             met.save()
             
             return metrics['id']
-                
\ No newline at end of file
+                
+    
+    def measure_styles(self, cor_msgs):
+        """
+        Measures the writting style of the given messages (see measure_style).
+        The bodies which have to be analysed are processed together by the
+        spaCy's model.
+
+        Parameters
+        ----------
+        cor_msgs : list
+            Corrected messages.
+
+        Returns
+        -------
+        list: result of each message (see stagebatch.run_batch), whose result
+        is {'id' : identifier of the measured message}.
+
+        """
+        docs = pipe_bodies(STAGE, self.__nlp, cor_msgs, lambda m: (
+            not(Metrics.objects(msg_id = m.get('id')).first()) and
+            not(has_result(STAGE, get_body_hash(m['bodyPlain'],
+                                                m.get('corrections'),
+                                                m.get('charLength'))))))
+        return run_batch(STAGE, lambda m: {'id' : self.measure_style(
+            m, docs.get(m.get('bodyPlain')))}, cor_msgs)
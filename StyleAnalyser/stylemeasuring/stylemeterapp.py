@@ -14,11 +14,16 @@ if not(os.getcwd() in sys.path):
 from flask import Flask, request, jsonify
 from stylemeasuring.stylemeter import StyleMeter
 from initdb import init_db
+from pipelinelog import get_logger, init_logging, timed
+from stagebatch import to_stage_message
+from httpcompression import init_compression
 from confanalyser import NLP
 
 os.chdir(initial_dir)
 
 app = Flask(__name__)
+init_compression(app)
+log = get_logger('stylemeter')
 stylemeter = StyleMeter(NLP)
 
 @app.route('/stylemeter', methods=['POST'])
@@ -36,8 +41,28 @@ def measure_style():
     msg['id'] = msg['_id']
     del msg['_id']
     
-    return jsonify({'id' : stylemeter.measure_style(msg)})
+    with timed(log, 'style measuring', msg_id = msg['id']):
+        met_id = stylemeter.measure_style(msg)
+    return jsonify({'id' : met_id})
+
+@app.route('/stylemeter/batch', methods=['POST'])
+def measure_styles():
+    """
+    Measures the writting style of the given list of messages.
+
+    Returns
+    -------
+    json: Dictionary in json format which has the result of each message in
+    'results' (see stagebatch.run_batch).
+
+    """
+    msgs = [to_stage_message(m) for m in request.json['messages']]
+    
+    with timed(log, 'style measuring batch', size = len(msgs)):
+        results = stylemeter.measure_styles(msgs)
+    return jsonify({'results' : results})
 
 if __name__ == '__main__':
     init_db()
+    init_logging('stylemeter')
     app.run(debug=True, port = 6000)
\ No newline at end of file
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul  7 10:02:18 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import base64
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if not(path in sys.path):
+        sys.path.append(path)
+
+mongomock = pytest.importorskip('mongomock')
+import mongoengine as db
+
+@pytest.fixture
+def database():
+    """
+    Connects the documents to an in-memory MongoDB.
+
+    Yields
+    ------
+    None.
+
+    """
+    db.disconnect_all()
+    for alias in ('core', 'default'):
+        db.connect('analysis', alias = alias,
+                   mongo_client_class = mongomock.MongoClient)
+    yield
+    db.disconnect_all()
+
+def make_message(msg_id, thread_id = None, labels = ('SENT',)):
+    """
+    Builds a Gmail API users.messages resource with a plain text body.
+
+    Parameters
+    ----------
+    msg_id : str
+        Identifier of the message.
+    thread_id : str, optional
+        Identifier of its thread. The default is None (the message starts it).
+    labels : tuple, optional
+        Labels of the message. The default is ('SENT',).
+
+    Returns
+    -------
+    dict: users.messages resource.
+
+    """
+    body = base64.urlsafe_b64encode(f'Body of {msg_id}'.encode()).decode()
+    return {'id' : msg_id, 'threadId' : thread_id or msg_id,
+            'labelIds' : list(labels), 'internalDate' : '1593500000000',
+            'payload' : {'mimeType' : 'text/plain',
+                         'headers' : [{'name' : 'From', 'value' : 'me@x.com'},
+                                      {'name' : 'To', 'value' : 'you@x.com'},
+                                      {'name' : 'Subject', 'value' : msg_id}],
+                         'body' : {'data' : body}}}
+
+def make_archive(messages, page_size = 100, history_id = '1'):
+    """
+    Builds the archive of a ReplayService (see benchmarks/gmailreplay.py)
+    whose mailbox has the given sent messages.
+
+    Parameters
+    ----------
+    messages : list
+        users.messages resources.
+    page_size : int, optional
+        Number of resources of each list page. The default is 100.
+    history_id : str, optional
+        Current history identifier of the mailbox. The default is '1'.
+
+    Returns
+    -------
+    dict: archive.
+
+    """
+    threads = {}
+    for m in messages:
+        threads.setdefault(m['threadId'], []).append(m)
+    archive = {'labels.get' : {'SENT' : {'messagesTotal' : len(messages),
+                                         'threadsTotal' : len(threads)}},
+               'getProfile' : {'' : {'historyId' : history_id}},
+               'messages.get' : {m['id'] : m for m in messages},
+               'threads.get' : {t : {'id' : t, 'messages' : msgs}
+                                for t, msgs in threads.items()},
+               'history.list' : {}}
+    for coll, items in (('messages', [{'id' : m['id'], 'threadId' : m['threadId']}
+                                      for m in messages]),
+                        ('threads', [{'id' : t} for t in threads])):
+        pages = archive.setdefault(f'{coll}.list', {})
+        for i in range(0, max(len(items), 1), page_size):
+            page = {coll : items[i:i + page_size]}
+            if i + page_size < len(items):
+                page['nextPageToken'] = str(i + page_size)
+            pages[str(i) if i else ''] = page
+    return archive
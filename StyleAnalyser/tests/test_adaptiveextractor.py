@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 09:12:40 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import quotaunits as qu
+from conftest import make_message, make_archive
+from gmailreplay import ReplayService
+from extraction.adaptiveextractor import AdaptiveExtractor
+from extraction.extractedmessage import ExtractedMessage
+from extraction.quotausage import QuotaUsage
+
+def make_threads(nthreads, length):
+    return [make_message(f't{t}m{i}', thread_id = f't{t}m0')
+            for t in range(nthreads) for i in range(length)]
+
+def extract(archive, nmsg):
+    service = ReplayService(archive)
+    ext = AdaptiveExtractor(service, 'me', qu.QUOTA_UNITS_PER_DAY)
+    # The quota units consumed by previous extractions of the day are kept
+    usage = QuotaUsage.objects(user_name = 'me').first()
+    before = qu.QUOTA_UNITS_PER_DAY if usage is None else usage.get_remaining_quota()
+    ext.extract_sent_msg(nmsg)
+    spent = before - ext.quota - qu.GET_PROFILE - qu.MSG_LIST
+    return service, spent
+
+def test_long_threads_are_requested_as_threads(database):
+    msgs = make_threads(4, 3)
+    service, spent = extract(make_archive(msgs), len(msgs))
+    
+    assert set(ExtractedMessage.objects().scalar('msg_id')) == {m['id'] for m in msgs}
+    assert service.calls.get('threads.get') == 4
+    assert service.calls.get('messages.get') is None
+    # A thread costs less than its three messages
+    assert spent == 4 * qu.THREADS_GET < len(msgs) * qu.MSG_GET
+
+def test_single_messages_are_requested_as_messages(database):
+    msgs = make_threads(4, 1)
+    service, spent = extract(make_archive(msgs), len(msgs))
+    
+    assert service.calls.get('messages.get') == 4
+    assert service.calls.get('threads.get') is None
+    assert spent == 4 * qu.MSG_GET
+
+def test_stored_messages_reduce_the_quota_spent(database):
+    msgs = make_threads(4, 3)
+    archive = make_archive(msgs)
+    # Two messages of each thread were extracted before
+    old = [m for m in msgs if not(m['id'].endswith('m2'))]
+    extract(make_archive(old), len(old))
+    service, spent = extract(archive, len(msgs) - len(old))
+    
+    assert ExtractedMessage.objects().count() == len(msgs)
+    assert service.calls.get('messages.get') == 4
+    assert service.calls.get('threads.get') is None
+    assert spent == 4 * qu.MSG_GET
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul  7 11:48:20 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import asyncio
+import json
+import threading
+import pytest
+
+pytest.importorskip('aiohttp')
+import quotaunits as qu
+import extraction.extractor as extractor
+from extraction.asyncgmail import AsyncGmailClient
+from extraction.messageextractor import MessageExtractor
+from extraction.retrypolicy import is_retryable
+
+class FakeRequest:
+    def __init__(self, uri):
+        self.method = 'GET'
+        self.uri = uri
+        self.headers = {}
+        self.body = None
+
+class CountingClient(AsyncGmailClient):
+    def __init__(self, creds):
+        super().__init__(creds)
+        self.executions = 0
+
+    async def execute(self, req):
+        self.executions += 1
+        return await super().execute(req)
+
+class FakeCreds:
+    def __init__(self, valid = True):
+        self.valid = valid
+        self.token = 'token'
+        self.refresh_threads = []
+
+    def refresh(self, request):
+        self.refresh_threads.append(threading.get_ident())
+        self.valid = True
+
+async def serve(drops, client_test):
+    """
+    Starts a local server which closes the first drops connections without
+    answering (as a dropped connection) and answers the rest with a message.
+    Then it runs the given test with its url. aiohttp may send a request again
+    by itself when its connection is dropped, so each failed execution can
+    drop several connections.
+
+    """
+    requests = []
+    async def answer(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        requests.append(1)
+        if len(requests) > drops:
+            body = json.dumps({'id' : 'm1'}).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                         + b'Connection: close\r\n'
+                         + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+        writer.close()
+        
+    server = await asyncio.start_server(answer, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with server:
+            return await client_test(f'http://127.0.0.1:{port}/m1'), len(requests)
+    finally:
+        server.close()
+
+def test_dropped_connections_are_retryable():
+    async def client_test(url):
+        async with AsyncGmailClient(FakeCreds()) as client:
+            with pytest.raises(ConnectionError) as error:
+                await client.execute(FakeRequest(url))
+            return error.value
+    
+    error, nrequests = asyncio.run(serve(100, client_test))
+    assert is_retryable(error)
+    assert nrequests >= 1
+
+def test_extractor_retries_dropped_connections(database, monkeypatch):
+    monkeypatch.setattr(extractor, 'get_backoff_delay', lambda attempt, e = None: 0)
+    ext = MessageExtractor(None, 'me', qu.QUOTA_UNITS_PER_DAY)
+    creds = FakeCreds(valid = False)
+    
+    client = CountingClient(creds)
+    
+    async def client_test(url):
+        async with client:
+            return await ext.execute_request_async(client, FakeRequest(url),
+                                                   qu.MSG_GET)
+    
+    res, nrequests = asyncio.run(serve(4, client_test))
+    assert res == {'id' : 'm1'}
+    assert nrequests == 5
+    assert client.executions > 1
+    # The token is refreshed out of the event loop
+    assert len(creds.refresh_threads) == 1
+    assert creds.refresh_threads[0] != threading.get_ident()
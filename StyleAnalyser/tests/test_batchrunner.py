@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 15:12:44 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import json
+import mailbox
+from email.message import EmailMessage
+import mongoengine as db
+import mongomock
+import pytest
+
+# The analyser needs the language models and the runner the OAuth flow
+pytest.importorskip('spacy')
+pytest.importorskip('google_auth_oauthlib')
+import analyser
+import batchrunner
+import initdb
+
+@pytest.fixture
+def server(monkeypatch):
+    """
+    Makes every account connect to its database of the same in-memory MongoDB
+    server, as the processes of the pool connect to the same server.
+
+    Yields
+    ------
+    mongomock.MongoClient: client of the server.
+
+    """
+    store = mongomock.store.ServerStore()
+    def init_db(name = initdb.DB_NAME):
+        db.disconnect_all()
+        for alias in ('core', 'default'):
+            db.connect(name, alias = alias, mongo_client_class = mongomock.MongoClient,
+                       _store = store)
+    monkeypatch.setattr(initdb, 'init_db', init_db)
+    monkeypatch.setattr(analyser, 'init_db', init_db)
+    monkeypatch.setattr(batchrunner, 'init_logging', lambda run_name: None)
+    yield mongomock.MongoClient(_store = store)
+    db.disconnect_all()
+
+def write_mbox(path, user, nmsg):
+    box = mailbox.mbox(path)
+    for i in range(nmsg):
+        msg = EmailMessage()
+        msg['From'] = user
+        msg['To'] = 'you@x.com'
+        msg['Subject'] = f'Mensaje {i}'
+        msg['Message-ID'] = f'<{i}.{user}>'
+        msg['Date'] = 'Mon, 29 Jun 2020 10:00:00 +0200'
+        msg.set_content(f'Hola, este es el mensaje {i}.')
+        box.add(msg)
+    box.close()
+
+def write_manifest(tmp_path, accounts):
+    path = tmp_path / 'accounts.json'
+    path.write_text(json.dumps(accounts))
+    return str(path)
+
+def test_each_account_is_extracted_in_its_own_database(server, tmp_path):
+    manifest = []
+    for user, nmsg in (('ana@x.com', 2), ('luis@x.com', 3)):
+        path = str(tmp_path / f'{user}.mbox')
+        write_mbox(path, user, nmsg)
+        manifest.append({'user' : user, 'mailbox' : path})
+    accounts = batchrunner.load_manifest(write_manifest(tmp_path, manifest))
+
+    results = [batchrunner.extract_account(acc) for acc in accounts]
+
+    assert [r['error'] for r in results] == [None, None]
+    assert [r['extracted'] for r in results] == [2, 3]
+    for acc in accounts:
+        assert acc['database'] == batchrunner.get_account_db(acc['user'])
+        senders = server[acc['database']]['extractedmessage'].distinct('sender')
+        assert senders == [acc['user']]
+
+def test_accounts_cannot_share_a_database(tmp_path):
+    path = write_manifest(tmp_path, [{'user' : 'ana@x.com', 'database' : 'shared'},
+                                     {'user' : 'luis@x.com', 'database' : 'shared'}])
+
+    with pytest.raises(ValueError):
+        batchrunner.load_manifest(path)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 10:03:27 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import pytest
+import htmlconversion
+from bodystore import StoredBody
+from extraction.extractedmessage import ExtractedMessage
+from preprocess.preprocessedmessage import PreprocessedMessage
+from preprocess.preprocessor import Preprocessor
+from stagebatch import to_stage_message
+
+HTML = '<html><body><p>Hola,</p><p>nos vemos el lunes.</p></body></html>'
+
+class CountingConverter:
+    def __init__(self):
+        self.calls = 0
+
+    def convert(self, html):
+        self.calls += 1
+        return 'Hola,\n\nnos vemos el lunes.\n'
+
+@pytest.fixture
+def converter():
+    conv = CountingConverter()
+    htmlconversion.set_converter(conv)
+    yield conv
+    htmlconversion.set_converter(htmlconversion.HTML_CONVERTER)
+
+def save_html_message(msg_id):
+    msg = ExtractedMessage(msg_id = msg_id, threadId = msg_id, sender = 'me@x.com',
+                           to = ['you@x.com'], depth = 0, date = 1593500000000)
+    msg.bodyHtml = HTML
+    msg.save()
+    return msg
+
+def test_to_message_does_not_convert_html(database, converter):
+    msg = save_html_message('m1').to_message()
+    
+    assert converter.calls == 0
+    assert msg['bodyHtml'] == HTML
+    assert not('bodyPlain' in msg)
+    assert msg.get('charLength') is None
+
+def test_preprocessor_converts_html_and_sets_the_length(database, converter):
+    prep = Preprocessor()
+    for msg_id in ('m1', 'm2'):
+        prep.preprocess_message(to_stage_message(save_html_message(msg_id)
+                                                 .to_message()))
+    
+    # The second body is the same, so its result is reused
+    assert converter.calls == 1
+    text = CountingConverter().convert(HTML)
+    assert [ext.charLength for ext in ExtractedMessage.objects()] == [len(text)] * 2
+
+def test_identical_bodies_are_preprocessed_once(database, monkeypatch):
+    calls = []
+    extract = Preprocessor._Preprocessor__extract_body_msg
+    def counting_extract(self, prep_msg, raw_msg):
+        calls.append(raw_msg['id'])
+        return extract(self, prep_msg, raw_msg)
+    monkeypatch.setattr(Preprocessor, '_Preprocessor__extract_body_msg',
+                        counting_extract)
+    
+    prep = Preprocessor()
+    for msg_id in ('m1', 'm2'):
+        msg = ExtractedMessage(msg_id = msg_id, threadId = msg_id,
+                               sender = 'me@x.com', to = ['you@x.com'],
+                               depth = 0, date = 1593500000000)
+        msg.bodyPlain = 'Hola,\n\nnos vemos el lunes.\n'
+        msg.save()
+        prep.preprocess_message(to_stage_message(msg.to_message()))
+    
+    assert calls == ['m1']
+    bodies = {m.msg_id : m.bodyHash for m in PreprocessedMessage.objects()}
+    assert set(bodies) == {'m1', 'm2'} and bodies['m1'] == bodies['m2']
+    assert StoredBody.objects().count() == 1
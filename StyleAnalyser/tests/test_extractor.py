@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul  7 10:24:51 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import threading
+from datetime import datetime
+from datetime import timedelta
+import pytest
+import quotaunits as qu
+from conftest import make_message, make_archive
+from gmailreplay import ReplayService, ReplayAsyncClient
+from extraction.messageextractor import MessageExtractor
+from extraction.threadextractor import ThreadExtractor
+from extraction.adaptiveextractor import AdaptiveExtractor
+from extraction.checkpoint import ExtractionCheckpoint
+from extraction.quotausage import QuotaUsage
+from extraction.extractedmessage import ExtractedMessage
+from extraction.syncstate import SyncState
+
+def stored_ids():
+    return set(ExtractedMessage.objects().scalar('msg_id'))
+
+def test_batch_extraction_groups_requests(database):
+    msgs = [make_message(f'm{i:03}') for i in range(30)]
+    service = ReplayService(make_archive(msgs, page_size = 10))
+    ext = MessageExtractor(service, 'me', qu.QUOTA_UNITS_PER_DAY, batch = True)
+    ext.extract_sent_msg(len(msgs))
+    
+    assert stored_ids() == {m['id'] for m in msgs}
+    assert [len(b) for b in service.batches] == [10, 10, 10]
+    assert service.calls['messages.get'] == len(msgs)
+
+def test_batch_extraction_skips_deleted_messages(database):
+    msgs = [make_message(f'm{i:03}') for i in range(10)]
+    archive = make_archive(msgs)
+    # Deleted between the list request and the get request
+    del archive['messages.get']['m004']
+    service = ReplayService(archive)
+    ext = MessageExtractor(service, 'me', qu.QUOTA_UNITS_PER_DAY, batch = True)
+    ext.extract_sent_msg(len(msgs))
+    
+    assert stored_ids() == {m['id'] for m in msgs} - {'m004'}
+    assert len(service.batches) == 1
+
+def test_concurrent_extraction_sends_batches(database):
+    msgs = [make_message(f'm{i:03}') for i in range(30)]
+    service = ReplayService(make_archive(msgs, page_size = 10))
+    ext = MessageExtractor(service, 'me', qu.QUOTA_UNITS_PER_DAY, batch = True,
+                           num_workers = 4, http_factory = object)
+    ext.extract_sent_msg(len(msgs))
+    
+    assert stored_ids() == {m['id'] for m in msgs}
+    assert sorted(len(b) for b in service.batches) == [10, 10, 10]
+    assert service.calls['messages.get'] == len(msgs)
+
+def test_incremental_extraction_fetches_replies_of_stored_threads(database):
+    first = make_message('m1')
+    archive = make_archive([first])
+    ThreadExtractor(ReplayService(archive), 'me',
+                    qu.QUOTA_UNITS_PER_DAY).extract_sent_msg(1)
+    assert SyncState.objects(user_name = 'me').first().historyId == '1'
+    
+    # The user replies to the thread which was already extracted
+    reply = make_message('m2', thread_id = 'm1')
+    archive['threads.get']['m1']['messages'].append(reply)
+    archive['history.list']['1:'] = {
+        'history' : [{'id' : '2', 'messagesAdded' : [
+            {'message' : {'id' : 'm2', 'threadId' : 'm1',
+                          'labelIds' : ['SENT']}}]}],
+        'historyId' : '3'}
+    service = ReplayService(archive)
+    ThreadExtractor(service, 'me', qu.QUOTA_UNITS_PER_DAY).extract_new_msg()
+    
+    assert service.calls['threads.get'] == 1
+    assert stored_ids() == {'m1', 'm2'}
+    assert ExtractedMessage.objects().count() == 2
+    assert SyncState.objects(user_name = 'me').first().historyId == '3'
+
+def test_partial_extraction_does_not_synchronize(database):
+    msgs = [make_message(f'm{i:03}') for i in range(30)]
+    archive = make_archive(msgs, page_size = 10)
+    MessageExtractor(ReplayService(archive), 'me',
+                     qu.QUOTA_UNITS_PER_DAY).extract_sent_msg(10)
+    
+    state = SyncState.objects(user_name = 'me').first()
+    assert len(stored_ids()) == 10
+    assert state.historyId is None and state.pendingHistoryId == '1'
+    
+    MessageExtractor(ReplayService(archive), 'me',
+                     qu.QUOTA_UNITS_PER_DAY).extract_sent_msg(20)
+    
+    state = SyncState.objects(user_name = 'me').first()
+    assert stored_ids() == {m['id'] for m in msgs}
+    assert state.historyId == '1' and state.pendingHistoryId is None
+
+def make_threads(nthreads, length):
+    return [make_message(f't{t}m{i}', thread_id = f't{t}m0')
+            for t in range(nthreads) for i in range(length)]
+
+@pytest.mark.parametrize('mode', [{}, {'batch' : True},
+                                  {'batch' : True, 'num_workers' : 2,
+                                   'http_factory' : object}])
+def test_extraction_resumes_a_page_stopped_by_the_quota(database, mode):
+    msgs = make_threads(6, 2)
+    archive = make_archive(msgs, page_size = 6)
+    # Profile, list page and two threads, so 7 units are left for the third
+    quota = qu.GET_PROFILE + qu.MSG_LIST + 2 * qu.THREADS_GET + 7
+    AdaptiveExtractor(ReplayService(archive), 'me', quota,
+                      **mode).extract_sent_msg(len(msgs))
+    
+    cp = ExtractionCheckpoint.objects(user_name = 'me').first()
+    assert len(stored_ids()) == 4
+    assert not(cp.finished) and cp.pageToken is None
+    assert set(cp.doneIds) == stored_ids()
+    
+    # It is resumed the next day, when the quota units are available again
+    QuotaUsage.objects(user_name = 'me').update_one(
+        set__dayStart = datetime.utcnow() - timedelta(days = 1))
+    AdaptiveExtractor(ReplayService(archive), 'me', qu.QUOTA_UNITS_PER_DAY,
+                      **mode).extract_sent_msg(len(msgs) - 4, cp.pageToken)
+    
+    assert stored_ids() == {m['id'] for m in msgs}
+    assert ExtractionCheckpoint.objects(user_name = 'me').first().finished
+
+def test_async_extraction_skips_deleted_messages(database):
+    msgs = [make_message(f'm{i:03}') for i in range(10)]
+    archive = make_archive(msgs, page_size = 5)
+    del archive['messages.get']['m004']
+    service = ReplayService(archive)
+    ext = MessageExtractor(service, 'me', qu.QUOTA_UNITS_PER_DAY,
+                           async_factory = lambda: ReplayAsyncClient(service))
+    # The pending identifiers are obtained out of the event loop
+    planners = []
+    get_pending_ids = ext._Extractor__get_pending_ids
+    def recording(*args):
+        planners.append(threading.get_ident())
+        return get_pending_ids(*args)
+    ext._Extractor__get_pending_ids = recording
+    ext.extract_sent_msg(len(msgs))
+    
+    assert stored_ids() == {m['id'] for m in msgs} - {'m004'}
+    assert len(planners) == 2 and not(threading.get_ident() in planners)
+    assert ExtractionCheckpoint.objects(user_name = 'me').first().finished
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 12:41:05 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import pytest
+from googleapiclient.errors import HttpError
+import quotaunits as qu
+from conftest import make_message, make_archive
+from gmailreplay import ReplayService, record_archive, load_archive
+from extraction.retrypolicy import get_error_reasons, is_retryable
+
+RECORDED = ('labels.get', 'getProfile', 'messages.list', 'messages.get',
+            'threads.list', 'threads.get')
+
+@pytest.fixture
+def archive():
+    msgs = [make_message(f'm{i:02}', thread_id = f't{i // 2:02}')
+            for i in range(7)]
+    return make_archive(msgs, page_size = 3)
+
+def test_recorded_archive_replays_the_same_responses(archive, tmp_path):
+    path = str(tmp_path / 'archive.json.gz')
+    recorded = record_archive(ReplayService(archive), path)
+
+    assert load_archive(path) == recorded
+    for method in RECORDED:
+        assert recorded[method] == archive[method]
+
+    replay = ReplayService(path).users()
+    assert replay.labels().get(id = 'SENT').execute() == archive['labels.get']['SENT']
+    assert replay.getProfile().execute() == archive['getProfile']['']
+    for coll in ('messages', 'threads'):
+        resource = getattr(replay, coll)()
+        pages = [resource.list(labelIds = ['SENT']).execute()]
+        while 'nextPageToken' in pages[-1]:
+            pages.append(resource.list(labelIds = ['SENT'],
+                                       pageToken = pages[-1]['nextPageToken']).execute())
+        for res in (r for page in pages for r in page[coll]):
+            assert resource.get(id = res['id']).execute() == archive[f'{coll}.get'][res['id']]
+        assert pages == list(archive[f'{coll}.list'].values())
+
+def test_partial_recording_agrees_with_the_label_totals(archive, tmp_path):
+    recorded = record_archive(ReplayService(archive),
+                              str(tmp_path / 'archive.json.gz'), max_res = 4)
+
+    assert len(recorded['messages.get']) == 4
+    assert recorded['labels.get']['SENT']['messagesTotal'] == 4
+    assert recorded['labels.get']['SENT']['threadsTotal'] == len(recorded['threads.get'])
+
+def test_random_quota_errors_are_rate_limit_errors(archive):
+    service = ReplayService(archive, error_rate = 1.0)
+
+    with pytest.raises(HttpError) as e:
+        service.users().messages().get(id = 'm00').execute()
+    assert e.value.resp.status == 429
+    assert is_retryable(e.value)
+    assert service.errors == 1
+
+def test_quota_per_second_errors_are_user_rate_limit_errors(archive):
+    service = ReplayService(archive, quota_per_sec = 2 * qu.MSG_GET)
+    messages = service.users().messages()
+    messages.get(id = 'm00').execute()
+    messages.get(id = 'm01').execute()
+
+    with pytest.raises(HttpError) as e:
+        messages.get(id = 'm02').execute()
+    assert e.value.resp.status == 403
+    assert get_error_reasons(e.value) == {'userRateLimitExceeded'}
+    assert is_retryable(e.value)
+
+def test_batch_reports_errors_of_each_request(archive):
+    service = ReplayService(archive)
+    responses = {}
+    def callback(request_id, response, exception):
+        responses[request_id] = exception or response
+
+    batch = service.new_batch_http_request(callback = callback)
+    for msg_id in ('m00', 'deleted'):
+        batch.add(service.users().messages().get(id = msg_id), request_id = msg_id)
+    batch.execute()
+
+    assert responses['m00'] == archive['messages.get']['m00']
+    assert responses['deleted'].resp.status == 404
+    assert service.batches == [['m00', 'deleted']]
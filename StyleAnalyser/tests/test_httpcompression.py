@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 16:31:27 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import gzip
+import io
+import json
+from httpcompression import GZIP_MIN_SIZE, GunzipRequests, compress_body
+
+def test_only_big_bodies_are_compressed():
+    small = b'x' * (GZIP_MIN_SIZE - 1)
+    big = json.dumps({'bodyPlain' : 'Hola. ' * GZIP_MIN_SIZE}).encode()
+    
+    assert compress_body(small) == (small, False)
+    data, compressed = compress_body(big)
+    assert compressed and len(data) < len(big)
+    assert gzip.decompress(data) == big
+
+def call(app, body, headers):
+    environ = {'wsgi.input' : io.BytesIO(body),
+               'CONTENT_LENGTH' : str(len(body))}
+    environ.update(headers)
+    return app(environ, lambda status, headers: None)
+
+def test_compressed_requests_are_decompressed():
+    received = []
+    def app(environ, start_response):
+        length = int(environ['CONTENT_LENGTH'])
+        received.append((environ['wsgi.input'].read(length),
+                         environ.get('HTTP_CONTENT_ENCODING')))
+        return [b'']
+    body = json.dumps({'bodyPlain' : 'Hola. ' * GZIP_MIN_SIZE}).encode()
+    
+    call(GunzipRequests(app), gzip.compress(body), {'HTTP_CONTENT_ENCODING' : 'gzip'})
+    call(GunzipRequests(app), body, {})
+    
+    assert received == [(body, None), (body, None)]
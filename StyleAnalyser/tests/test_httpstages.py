@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 16:52:10 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import gzip
+import json
+import logging
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+# The configuration of the analyser loads the spaCy model
+pytest.importorskip('spacy')
+import confanalyser as cfa
+from httpcompression import compress_body
+from stageclients import HttpStages
+from stagebatch import STATUS_OK, STATUS_ERROR
+
+class StageHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of a stage service which records the connection and the encoding
+    of each request. The batch responses are compressed if the client
+    accepts it.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            data = gzip.decompress(data)
+        body = json.loads(data)
+        self.server.requests.append({'port' : self.client_address[1],
+                                     'encoding' : encoding, 'body' : body})
+
+        if self.path.endswith('/batch'):
+            response = {'results' : [{'status' : STATUS_OK,
+                                      'result' : {'id' : m['_id']}}
+                                     for m in body['messages']]}
+        else:
+            response = {'id' : body['message']['_id']}
+        data = json.dumps(response).encode()
+        compressed = False
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data, compressed = compress_body(data)
+        self.send_response(STATUS_OK)
+        self.send_header('Content-Type', 'application/json')
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def service(monkeypatch):
+    """
+    Serves the stand-in of the preprocessor service in a background thread.
+
+    Yields
+    ------
+    ThreadingHTTPServer: server, whose url attribute is the URL of the
+    preprocessor and whose requests attribute has the received requests.
+
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StageHandler)
+    server.requests = []
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_port}/preprocessor'
+    monkeypatch.setattr(cfa, 'URL_PREP', server.url)
+    monkeypatch.setattr(cfa, 'URL_PREP_BATCH', server.url + '/batch')
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def message(msg_id, size = 10):
+    return {'_id' : msg_id, 'threadId' : msg_id, 'depth' : 0,
+            'bodyPlain' : 'Hola. ' * size}
+
+def test_connections_to_a_service_are_reused(service):
+    stages = HttpStages()
+    results = [stages.preprocess(message(f'm{i}'), None) for i in range(5)]
+    stages.close()
+
+    assert results == [(STATUS_OK, {'id' : f'm{i}'}) for i in range(5)]
+    assert len({r['port'] for r in service.requests}) == 1
+
+def test_big_bodies_are_compressed(service, monkeypatch):
+    stages = HttpStages()
+    small = message('small')
+    big = message('big', size = 1000)
+    stages.preprocess(small, None)
+    stages.preprocess(big, None)
+    batch = [message(f'm{i}', size = 1000) for i in range(50)]
+    results = stages.preprocess_batch(batch, None)
+    monkeypatch.setattr(cfa, 'HTTP_GZIP', False)
+    stages.preprocess(big, None)
+    stages.close()
+
+    assert [r['encoding'] for r in service.requests] == [None, 'gzip', 'gzip', None]
+    assert service.requests[1]['body']['message'] == big
+    # The compressed response of the batch is decompressed by the client
+    assert results == [(STATUS_OK, {'id' : f'm{i}'}) for i in range(50)]
+
+def test_latencies_are_logged_by_endpoint(service, monkeypatch, caplog):
+    stages = HttpStages()
+    for i in range(3):
+        stages.preprocess(message(f'm{i}'), None)
+    stages.preprocess_batch([message('m3')], None)
+    # The latency of the failed requests is also observed
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        closed_url = f'http://127.0.0.1:{sock.getsockname()[1]}/preprocessor'
+    monkeypatch.setattr(cfa, 'URL_PREP', closed_url)
+    assert stages.preprocess(message('m4'), None) == (STATUS_ERROR, None)
+    with caplog.at_level(logging.INFO):
+        stages.close()
+
+    counts = {r.url : r.count for r in caplog.records
+              if r.getMessage() == 'http latency'}
+    assert counts == {service.url : 3, service.url + '/batch' : 1,
+                      closed_url : 1}
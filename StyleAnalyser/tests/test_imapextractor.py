@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 11:20:54 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import pytest
+from imapserver import ImapStandIn
+import extraction.confextraction as cfe
+from extraction.imapextractor import ImapExtractor
+from extraction.extractedmessage import ExtractedMessage
+from extraction.syncstate import SyncState
+
+def make_raw(i):
+    return (f'From: me@x.com\r\nTo: you@x.com\r\nSubject: Message {i}\r\n'
+            f'Date: Tue, 30 Jun 2020 10:{i:02}:00 +0200\r\n'
+            f'Message-ID: <m{i}@x.com>\r\n'
+            f'Content-Type: text/plain; charset=utf-8\r\n\r\n'
+            f'Body of message {i}\r\n').encode()
+
+@pytest.fixture
+def server(monkeypatch):
+    # The latency covers the delay of the small commands by TCP (Nagle)
+    monkeypatch.setattr(cfe, 'IMAP_FETCH_BATCH', 4)
+    monkeypatch.setattr(cfe, 'IMAP_PIPELINE_DEPTH', 3)
+    srv = ImapStandIn([make_raw(i) for i in range(10)], latency = 0.1)
+    srv.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+def make_extractor(server):
+    return ImapExtractor('me', 'me@x.com', 'secret', host = '127.0.0.1',
+                         port = server.port, use_ssl = False,
+                         folder = server.folder)
+
+def test_uid_ranges_are_fetched_in_pipelined_batches(database, server):
+    make_extractor(server).extract_sent_msg()
+    
+    fetches = server.get_commands('UID FETCH')
+    assert [f['args'].split(' ')[0] for f in fetches] == ['1:4', '5:8', '9:10']
+    assert all('BODY.PEEK[]' in f['args'] for f in fetches)
+    # The commands of a window are sent before reading their responses
+    assert [f['pipelined'] for f in fetches] == [True, True, False]
+    assert ExtractedMessage.objects().count() == 10
+    assert SyncState.objects(user_name = 'me').first().uidNext == 11
+
+def test_new_messages_are_fetched_from_uid_next(database, server):
+    make_extractor(server).extract_sent_msg()
+    server.messages += [make_raw(i) for i in range(10, 13)]
+    server.msgids += [10**15 + i for i in range(10, 13)]
+    server.thrids += [10**15 + i for i in range(10, 13)]
+    del server.commands[:]
+    
+    assert make_extractor(server).extract_new_msg() is not None
+    
+    assert [f['args'].split(' ')[0] for f in
+            server.get_commands('UID FETCH')] == ['11:13']
+    assert ExtractedMessage.objects().count() == 13
+    assert SyncState.objects(user_name = 'me').first().uidNext == 14
+
+def test_uid_validity_change_needs_a_full_extraction(database, server):
+    make_extractor(server).extract_sent_msg()
+    server.uid_validity += 1
+    del server.commands[:]
+    
+    # The saved UIDs are not valid anymore
+    assert make_extractor(server).extract_new_msg() is None
+    assert server.get_commands('UID FETCH') == []
+    
+    make_extractor(server).extract_sent_msg()
+    state = SyncState.objects(user_name = 'me').first()
+    assert state.uidValidity == server.uid_validity and state.uidNext == 11
+    assert ExtractedMessage.objects().count() == 10
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 14:20:16 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from bson import BSON
+from extraction.extractedmessage import ExtractedMessage
+from extraction.messagewriter import MessageWriter
+
+def new_message(msg_id):
+    msg = ExtractedMessage(msg_id = msg_id, threadId = msg_id, sender = 'me@x.com',
+                           to = ['you@x.com'], depth = 0, date = 1593500000000)
+    msg.bodyPlain = 'Hola'
+    return msg
+
+class Listener:
+    def __init__(self):
+        self.flushes = []
+
+    def __call__(self, msgs):
+        self.flushes.append([m.msg_id for m in msgs])
+
+def test_writer_flushes_when_the_buffer_is_full(database):
+    listener = Listener()
+    writer = MessageWriter('me', listener, max_docs = 3)
+    for i in range(7):
+        writer.add(new_message(f'm{i}'), i)
+    
+    assert listener.flushes == [['m0', 'm1', 'm2'], ['m3', 'm4', 'm5']]
+    assert len(writer) == 1 and ExtractedMessage.objects().count() == 6
+    
+    assert [m.msg_id for m in writer.flush()] == ['m6']
+    assert len(writer) == 0 and ExtractedMessage.objects().count() == 7
+    assert writer.flush() == []
+    assert len(listener.flushes) == 3
+
+def test_writer_flushes_when_the_buffer_is_too_big(database):
+    size = len(BSON.encode(new_message('m0').to_mongo()))
+    listener = Listener()
+    writer = MessageWriter('me', listener, max_bytes = 2 * size)
+    for i in range(5):
+        writer.add(new_message(f'm{i}'), i)
+    
+    assert listener.flushes == [['m0', 'm1'], ['m2', 'm3']]
+    assert len(writer) == 1
+
+def test_writer_only_discards_the_failed_documents(database):
+    new_message('m1').save()
+    listener = Listener()
+    writer = MessageWriter('me', listener)
+    for i in range(3):
+        writer.add(new_message(f'm{i}'), i)
+    
+    # m1 was already stored, the rest of the unordered insertion goes on
+    assert [m.msg_id for m in writer.flush()] == ['m0', 'm2']
+    assert listener.flushes == [['m0', 'm2']]
+    assert ExtractedMessage.objects().count() == 3
+
+def test_writer_skips_invalid_messages(database):
+    writer = MessageWriter('me')
+    invalid = new_message('m0')
+    invalid.sender = None
+    writer.add(invalid, 0)
+    writer.add(new_message('m1'), 1)
+    
+    assert len(writer) == 1
+    assert [m.msg_id for m in writer.flush()] == ['m1']
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 14:47:29 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import base64
+import mongomock
+import pytest
+import migratebodies
+from migratebodies import migrate_collection
+from extraction.extractedmessage import ExtractedMessage
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+def insert_base64_messages(n):
+    ExtractedMessage._get_collection().insert_many([
+        {'_id' : f'm{i}', 'threadId' : f'm{i}', 'sender' : 'me@x.com',
+         'depth' : 0, 'date' : 1593500000000,
+         'bodyBase64Plain' : encode(f'Hola {i}, ¿qué tal?'),
+         'bodyBase64Html' : encode(f'<p>Hola {i}, ¿qué tal?</p>')}
+        for i in range(n)])
+
+@pytest.fixture
+def bulk_writes(monkeypatch):
+    """
+    Records the size of each bulk write. The updates are applied one by one
+    because mongomock does not accept the UpdateOne of recent pymongo versions.
+
+    Yields
+    ------
+    list: number of updates of each bulk write.
+
+    """
+    sizes = []
+    def bulk_write(coll, requests, ordered = True, **kwargs):
+        sizes.append(len(requests))
+        for req in requests:
+            coll.update_one(req._filter, req._doc)
+    monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', bulk_write)
+    yield sizes
+
+def test_bodies_are_compressed_and_decompressed_back(database, bulk_writes,
+                                                     monkeypatch):
+    monkeypatch.setattr(migratebodies, 'MIGRATION_BATCH', 2)
+    insert_base64_messages(5)
+    coll = ExtractedMessage._get_collection()
+    
+    assert migrate_collection(ExtractedMessage, True) == 5
+    assert bulk_writes == [2, 2, 1]
+    for doc in coll.find():
+        assert set(doc) >= {'bodyCompressedPlain', 'bodyCompressedHtml'}
+        assert not('bodyBase64Plain' in doc or 'bodyBase64Html' in doc)
+    for msg in ExtractedMessage.objects():
+        i = msg.msg_id[1:]
+        assert msg.bodyPlain == f'Hola {i}, ¿qué tal?'
+        assert msg.bodyHtml == f'<p>Hola {i}, ¿qué tal?</p>'
+    # Messages already migrated are not migrated again
+    assert migrate_collection(ExtractedMessage, True) == 0
+    assert bulk_writes == [2, 2, 1]
+    
+    assert migrate_collection(ExtractedMessage, False) == 5
+    doc = coll.find_one({'_id' : 'm3'})
+    assert doc['bodyBase64Plain'] == encode('Hola 3, ¿qué tal?')
+    assert not('bodyCompressedPlain' in doc or 'bodyCompressedHtml' in doc)
+
+def test_messages_without_body_are_not_migrated(database, bulk_writes):
+    ExtractedMessage._get_collection().insert_one(
+        {'_id' : 'm0', 'threadId' : 'm0', 'sender' : 'me@x.com', 'depth' : 0,
+         'date' : 1593500000000})
+    
+    assert migrate_collection(ExtractedMessage, True) == 0
+    assert bulk_writes == []
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul  7 11:05:37 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import logging
+import time
+from pipelinelog import BufferedHandler
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def make_record(msg):
+    return logging.LogRecord('styleanalyser.test', logging.INFO, __file__, 0,
+                             msg, (), None)
+
+def test_buffered_records_are_written_without_new_records():
+    target = RecordingHandler()
+    handler = BufferedHandler(100, logging.ERROR, target, interval = 0.05)
+    try:
+        handler.handle(make_record('first'))
+        assert target.records == []
+        
+        deadline = time.monotonic() + 2
+        while not(target.records) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [r.getMessage() for r in target.records] == ['first']
+    finally:
+        handler.close()
+
+def test_close_writes_the_buffer():
+    target = RecordingHandler()
+    handler = BufferedHandler(100, logging.ERROR, target, interval = 60)
+    handler.handle(make_record('last'))
+    handler.close()
+    
+    assert [r.getMessage() for r in target.records] == ['last']
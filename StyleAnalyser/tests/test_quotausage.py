@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 13:58:37 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from datetime import datetime
+from datetime import timedelta
+from time import sleep
+import quotaunits as qu
+from conftest import make_message, make_archive
+from gmailreplay import ReplayService
+from extraction.messageextractor import MessageExtractor
+from extraction.quotascheduler import QuotaScheduler, SECONDS_PER_DAY
+from extraction.quotausage import QuotaUsage
+
+def extract(msgs):
+    ext = MessageExtractor(ReplayService(make_archive(msgs)), 'me',
+                           qu.QUOTA_UNITS_PER_DAY)
+    return ext.extract_sent_msg(len(msgs))
+
+def test_restarted_extraction_keeps_the_daily_consumption(database):
+    msgs = [make_message(f'm{i}') for i in range(3)]
+    remaining = extract(msgs)
+    consumed = qu.QUOTA_UNITS_PER_DAY - remaining
+    assert QuotaUsage.objects(user_name = 'me').first().consumed == consumed
+
+    # A new execution (with a new scheduler) continues the same quota day
+    again = extract(msgs + [make_message('m3')])
+    assert again < remaining
+    assert (QuotaUsage.objects(user_name = 'me').first().consumed == 
+            qu.QUOTA_UNITS_PER_DAY - again)
+
+def test_usage_of_a_finished_day_is_ignored(database):
+    QuotaUsage(user_name = 'me', consumed = qu.QUOTA_UNITS_PER_DAY,
+               dayStart = datetime.utcnow() - timedelta(days = 1, hours = 1)).save()
+
+    remaining = extract([make_message('m0')])
+    assert remaining > qu.QUOTA_UNITS_PER_DAY - qu.QUOTA_UNITS_PER_SECOND
+    assert QuotaUsage.objects(user_name = 'me').first().get_remaining_quota() == remaining
+
+def test_restored_day_is_refilled_when_it_finishes():
+    scheduler = QuotaScheduler()
+    day_start = datetime.utcnow() - timedelta(seconds = SECONDS_PER_DAY - 0.2)
+    scheduler.restore_day_usage(day_start, 1000)
+    assert scheduler.get_remaining() == qu.QUOTA_UNITS_PER_DAY - 1000
+    saved_start, consumed = scheduler.get_day_usage()
+    assert consumed == 1000
+    assert abs((saved_start - day_start).total_seconds()) < 0.1
+
+    sleep(0.3)
+    assert scheduler.get_remaining() == qu.QUOTA_UNITS_PER_DAY
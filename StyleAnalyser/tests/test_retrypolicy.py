@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 12:03:16 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import json
+import socket
+import ssl
+import http.client
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+import quotaunits as qu
+import extraction.confextraction as cfe
+import extraction.extractor as extractor
+from extraction.retrypolicy import is_retryable
+from extraction.messageextractor import MessageExtractor
+from gmailreplay import ReplayService
+
+def http_error(status, reason = None):
+    content = {'error' : {'code' : status, 'errors' : []}}
+    if reason is not None:
+        content['error']['errors'].append({'reason' : reason})
+    return HttpError(httplib2.Response({'status' : status}),
+                     json.dumps(content).encode('utf-8'))
+
+class FlakyRequest:
+    """
+    Request which fails with the given errors before returning its response.
+    """
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.executions = 0
+
+    def execute(self, http = None):
+        self.executions += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'id' : 'm1'}
+
+@pytest.mark.parametrize('error', [
+    http_error(429), http_error(503),
+    http_error(403, 'userRateLimitExceeded'),
+    ConnectionResetError(), TimeoutError(), socket.timeout(),
+    ssl.SSLError(), httplib2.ServerNotFoundError('oauth2.googleapis.com'),
+    http.client.RemoteDisconnected(), http.client.IncompleteRead(b'')])
+def test_transient_errors_are_retried(error):
+    assert is_retryable(error)
+
+@pytest.mark.parametrize('error', [
+    http_error(400), http_error(404), http_error(403, 'forbidden'),
+    ssl.SSLCertVerificationError(), ValueError()])
+def test_permanent_errors_are_not_retried(error):
+    assert not(is_retryable(error))
+
+@pytest.fixture
+def ext(monkeypatch):
+    monkeypatch.setattr(extractor, 'get_backoff_delay', lambda attempt, e: 0)
+    return MessageExtractor(ReplayService({}), 'me', qu.QUOTA_UNITS_PER_DAY)
+
+def test_request_is_retried_until_it_succeeds(ext):
+    req = FlakyRequest([http.client.RemoteDisconnected(), http_error(503)])
+    initial = ext.quota
+
+    assert ext.execute_request(req, qu.MSG_GET) == {'id' : 'm1'}
+    assert req.executions == 3
+    # Each retry consumes the quota units of the request again
+    assert initial - ext.quota == 2 * qu.MSG_GET
+
+def test_permanent_error_is_not_retried(ext):
+    req = FlakyRequest([http_error(400)])
+
+    with pytest.raises(HttpError):
+        ext.execute_request(req, qu.MSG_GET)
+    assert req.executions == 1
+
+def test_request_fails_after_the_last_retry(ext):
+    req = FlakyRequest([socket.timeout()] * (cfe.MAX_RETRIES + 1))
+
+    with pytest.raises(socket.timeout):
+        ext.execute_request(req, qu.MSG_GET)
+    assert req.executions == cfe.MAX_RETRIES + 1
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 13:15:42 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import json
+import pytest
+from benchsoftbreaks import CORPUS
+from softbreaks import remove_soft_breaks
+
+with open(CORPUS, encoding = 'utf-8') as f:
+    CASES = json.load(f)
+
+@pytest.mark.parametrize('case', CASES)
+def test_html_body_matches_the_corpus(case):
+    assert remove_soft_breaks(case['text']) == case['html']
+
+@pytest.mark.parametrize('case', [c for c in CASES if 'decoded' in c])
+def test_decoded_body_matches_the_corpus(case):
+    assert remove_soft_breaks(case['text'], decoded = True) == case['decoded']
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Jul  7 12:31:09 2020
+
+@author: Carlos Moreno Morera
+"""
+
+from stagebatch import STATUS_ERROR, STATUS_OK, pipe_bodies, run_batch
+
+class FakeNlp:
+    def __init__(self, fail = False):
+        self.fail = fail
+        self.piped = []
+
+    def pipe(self, bodies):
+        for body in bodies:
+            if self.fail:
+                raise RuntimeError('model failure')
+            self.piped.append(body)
+            yield body.upper()
+
+def needs_doc(msg):
+    return not(msg['corrections'])
+
+def test_malformed_messages_only_fail_themselves():
+    msgs = [{'id' : 'm1', 'bodyPlain' : 'hi', 'corrections' : []},
+            {'id' : 'm2', 'bodyPlain' : 'bye'},
+            {'id' : 'm3', 'bodyPlain' : 'hi', 'corrections' : []}]
+    nlp = FakeNlp()
+    docs = pipe_bodies('test', nlp, msgs, needs_doc)
+    
+    assert nlp.piped == ['hi']
+    assert docs == {'hi' : 'HI'}
+    
+    results = run_batch('test', lambda m: (needs_doc(m), docs[m['bodyPlain']]),
+                        msgs)
+    assert [r['status'] for r in results] == [STATUS_OK, STATUS_ERROR, STATUS_OK]
+
+def test_model_failure_gives_no_documents():
+    msgs = [{'id' : 'm1', 'bodyPlain' : 'hi', 'corrections' : []}]
+    
+    assert pipe_bodies('test', FakeNlp(fail = True), msgs, needs_doc) == {}
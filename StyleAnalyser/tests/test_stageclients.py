@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 15:46:03 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import threading
+import pytest
+
+# The stages need the spaCy model and their services Flask
+pytest.importorskip('spacy')
+pytest.importorskip('flask')
+from werkzeug.serving import make_server
+import confanalyser as cfa
+from bodystore import StageResult
+from extraction.extractedmessage import ExtractedMessage
+from preprocess.preprocessedmessage import PreprocessedMessage
+from stageclients import LocalStages, HttpStages
+from stagebatch import STATUS_OK, STATUS_ERROR
+
+SIGN = 'Carlos'
+BODIES = ['Hola,\n\nnos vemos el lunes a las diez.\n\nCarlos\n',
+          'Te adjunto el informe.\r\nUn saludo,\r\nCarlos\r\n\r\n' +
+          'El lun., 29 jun. 2020 a las 10:00, Ana escribió:\r\n> ¿Me lo mandas?\r\n']
+
+@pytest.fixture
+def prep_service(database, monkeypatch):
+    """
+    Serves the preprocessor application in a background thread and makes
+    HttpStages send its requests to it.
+
+    Yields
+    ------
+    None.
+
+    """
+    from preprocess.preprocessorapp import app
+    server = make_server('127.0.0.1', 0, app, threaded = True)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}/preprocessor'
+    monkeypatch.setattr(cfa, 'URL_PREP', url)
+    monkeypatch.setattr(cfa, 'URL_PREP_BATCH', url + '/batch')
+    yield
+    server.shutdown()
+    thread.join()
+
+def extracted_messages():
+    msgs = []
+    for i, body in enumerate(BODIES):
+        msg = ExtractedMessage(msg_id = f'm{i}', threadId = f'm{i}',
+                               sender = 'me@x.com', to = ['you@x.com'],
+                               depth = i, date = 1593500000000)
+        msg.bodyPlain = body
+        msg.save()
+        msgs.append(msg.to_message())
+    # Without depth the preprocessing fails
+    broken = dict(msgs[0], _id = 'broken')
+    del broken['depth']
+    return msgs + [broken]
+
+def forget_preprocessing():
+    PreprocessedMessage.objects().delete()
+    StageResult.objects().delete()
+
+def preprocess_with(stages, msgs):
+    forget_preprocessing()
+    single = [stages.preprocess(m, SIGN) for m in msgs[:-1]]
+    single_bodies = {m.msg_id : m.bodyPlain for m in PreprocessedMessage.objects()}
+    forget_preprocessing()
+    batch = stages.preprocess_batch(msgs, SIGN)
+    batch_bodies = {m.msg_id : m.bodyPlain for m in PreprocessedMessage.objects()}
+    stages.close()
+    return single, single_bodies, batch, batch_bodies
+
+def test_local_and_http_stages_give_the_same_results(prep_service):
+    msgs = extracted_messages()
+
+    local = preprocess_with(LocalStages(), msgs)
+    http = preprocess_with(HttpStages(), msgs)
+
+    assert local == http
+    single, single_bodies, batch, batch_bodies = local
+    assert single == [(STATUS_OK, {'id' : 'm0'}), (STATUS_OK, {'id' : 'm1'})]
+    assert batch == single + [(STATUS_ERROR, None)]
+    assert single_bodies == batch_bodies and set(batch_bodies) == {'m0', 'm1'}
+    # The caller's messages are not modified by either client
+    assert [m['_id'] for m in msgs] == ['m0', 'm1', 'broken']
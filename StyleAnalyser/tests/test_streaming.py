@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Jul  8 16:08:51 2020
+
+@author: Carlos Moreno Morera
+"""
+
+import queue
+import threading
+from streaming import StageWorkers
+
+def drain(q):
+    items = []
+    while not(q.empty()):
+        items.append(q.get_nowait())
+    return items
+
+def test_items_flow_through_the_stages():
+    output = queue.Queue()
+    square = StageWorkers('square', lambda x: x * x, 2, 4, output)
+    # Odd numbers are filtered out by returning None
+    even = StageWorkers('even', lambda x: x if x % 2 == 0 else None, 3, 4, square)
+    square.start()
+    even.start()
+    for i in range(20):
+        even.put(i)
+    even.close()
+    square.close()
+    
+    assert sorted(drain(output)) == [i * i for i in range(0, 20, 2)]
+    assert (even.processed, square.processed) == (20, 10)
+    assert even.failed == square.failed == 0
+
+def test_producer_waits_while_the_queue_is_full():
+    release = threading.Event()
+    stage = StageWorkers('blocked', lambda x: release.wait(), 1, 2)
+    stage.start()
+    put = []
+    def produce():
+        for i in range(10):
+            stage.put(i)
+            put.append(i)
+    producer = threading.Thread(target = produce, daemon = True)
+    producer.start()
+    producer.join(0.3)
+    
+    # One item is being processed and two are waiting in the queue
+    assert producer.is_alive() and len(put) == 3
+    release.set()
+    producer.join()
+    stage.close()
+    assert stage.processed == 10
+
+def test_waiting_items_are_processed_in_batches():
+    batches = []
+    output = queue.Queue()
+    stage = StageWorkers('batch', lambda items: batches.append(items) or items,
+                         1, 10, output, batch_size = 3)
+    for i in range(7):
+        stage.put(i)
+    stage.start()
+    stage.close()
+    
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert drain(output) == list(range(7))
+
+def test_failed_items_do_not_stop_the_stage():
+    def invert(x):
+        return 1 / x
+    output = queue.Queue()
+    stage = StageWorkers('invert', invert, 2, 4, output)
+    stage.start()
+    for x in (1, 0, 2, 0, 4):
+        stage.put(x)
+    stage.close()
+    
+    assert sorted(drain(output)) == [0.25, 0.5, 1.0]
+    assert (stage.processed, stage.failed) == (5, 2)
@@ -6,8 +6,9 @@ Created on Mon Mar  9 19:03:23 2020
 """
 
 import mongoengine as db
+from bodystorage import CompressedBody
 
-class CorrectedMessage(db.Document):
+class CorrectedMessage(CompressedBody, db.Document):
     """
     Class which manage the MongoDB table about the corrected messages.
     
@@ -37,6 +38,11 @@ class CorrectedMessage(db.Document):
         Message's subject.
     bodyBase64Plain: db.StringField
         Message's body as a Base64 encoded plain text.
+    bodyCompressedPlain: db.BinaryField
+        Message's body as a zlib compressed plain text.
+    bodyHash: db.StringField
+        Hash of the message's body in the body store (if it is stored there
+        instead of in the message).
     plainEncoding: db.StringField
         Original message's encoding.
     charLength: db.IntField
@@ -56,6 +62,8 @@ class CorrectedMessage(db.Document):
     date = db.LongField(required = True)
     subject = db.StringField()
     bodyBase64Plain = db.StringField()
+    bodyCompressedPlain = db.BinaryField()
+    bodyHash = db.StringField()
     plainEncoding = db.StringField()
     charLength = db.IntField()
     corrections = db.ListField()
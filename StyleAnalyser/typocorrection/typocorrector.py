@@ -7,11 +7,16 @@ Created on Fri Dec 20 22:09:13 2019
 
 from __future__ import print_function
 import base64
-from correction import Correction
-from correctedmessage import CorrectedMessage
-from typocode import TypoCode
+from typocorrection.correction import Correction
+from typocorrection.correctedmessage import CorrectedMessage
+from typocorrection.typocode import TypoCode
+from bodystore import get_body_hash, get_result, has_result, save_result, set_body
+from stagebatch import pipe_bodies, run_batch
 import json
 
+# Name of the stage in the body store
+STAGE = 'typocorrector'
+
 class TypoCorrector:
     """
     TypoCorrector class performs the task of correcting the typographic errors
@@ -77,8 +82,8 @@ class TypoCorrector:
                     'depth' : int,               # How many messages precede it
                     'date' : long,               # Epoch ms
                     'subject' : string,          # Optional
-                    'bodyBase64Plain' : string,
-                    'bodyBase64Html' : string,   # Optional
+                    'bodyPlain' : string,        # Optional
+                    'bodyBase64Plain' : string,  # Optional (if not bodyPlain)
                     'plainEncoding' : string,    # Optional
                     'charLength' : int
                 }
@@ -124,7 +129,6 @@ class TypoCorrector:
                 'date' : long,               # Epoch ms
                 'subject' : string,          # Optional
                 'bodyPlain' : string,
-                'bodyBase64Plain' : string,
                 'plainEncoding' : string,    # Optional
                 'charLength' : int
                 'doc' : spaCy's Doc
@@ -166,7 +170,7 @@ class TypoCorrector:
             msg.subject = typo['subject']
             
         msg.depth = typo['depth']
-        msg.bodyBase64Plain = typo['bodyBase64Plain']
+        set_body(msg, typo['bodyPlain'])
         
         if 'plainEncoding' in typo:
             msg.plainEncoding = typo['plainEncoding']
@@ -178,7 +182,7 @@ class TypoCorrector:
         msg.charLength = typo['charLength']
         msg.save()
         
-    def correct_msg(self, prep_msg, i):
+    def correct_msg(self, prep_msg, i, doc = None):
         """
         Obtains the preprocessed message and corrects all the typographic errors
         on it. Besides this method saves the preprocessed messages before the 
@@ -198,14 +202,17 @@ class TypoCorrector:
                 'depth' : int,               # How many messages precede it
                 'date' : long,               # Epoch ms
                 'subject' : string,          # Optional
-                'bodyBase64Plain' : string,
-                'bodyBase64Html' : string,   # Optional
+                'bodyPlain' : string,        # Optional
+                'bodyBase64Plain' : string,  # Optional (if not bodyPlain)
                 'plainEncoding' : string,    # Optional
                 'charLength' : int
             }
         i: int
             It indicates the position of the word from which the typographic 
             correction should be made.
+        doc: spacy.Doc, optional
+            spaCy's Doc of the body if it has already been obtained. The
+            default is None.
             
         Returns
         -------
@@ -226,7 +233,6 @@ class TypoCorrector:
                     'date' : long,               # Epoch ms
                     'subject' : string,          # Optional
                     'bodyPlain' : string,
-                    'bodyBase64Plain' : string,
                     'plainEncoding' : string,    # Optional
                     'charLength' : int,
                     'corrections' : [
@@ -257,10 +263,27 @@ class TypoCorrector:
             not(CorrectedMessage.objects(msg_id = prep_msg['id']).first())):
             prep_msg['bodyPlain'] = base64.urlsafe_b64decode(
                         prep_msg['bodyBase64Plain'].encode()).decode()
+        # Only the corrections which do not need the user are reused (the
+        # ones of a whole body without previous corrections)
+        key = None
+        cached = None
+        if i == 0 and not(prep_msg.get('corrections')):
+            key = get_body_hash(prep_msg['bodyPlain'])
+            cached = get_result(STAGE, key)
+            
+        if (len(prep_msg['bodyPlain']) > 0) and cached is not None:
+            msg_typo['bodyPlain'] = prep_msg['bodyPlain']
+            msg_typo['corrections'] = cached['corrections']
+            self.__copy_data(prep_msg, msg_typo)
+            msg_typo['charLength'] = len(msg_typo['bodyPlain'])
+            self.__save_cor_msg(msg_typo)
+            response = TypoCode.successful
+            i = cached['index']
         # If the body is not an empty string
-        if (len(prep_msg['bodyPlain']) > 0):
+        elif (len(prep_msg['bodyPlain']) > 0):
             msg_typo['bodyPlain'] = prep_msg['bodyPlain']
-            msg_typo['doc'] = self.__nlp(msg_typo['bodyPlain'])
+            msg_typo['doc'] = (self.__nlp(msg_typo['bodyPlain']) if doc is None
+                               else doc)
             if 'corrections' in prep_msg:
                 msg_typo['corrections'] = prep_msg['corrections']
             else:
@@ -285,12 +308,13 @@ class TypoCorrector:
             self.__copy_data(prep_msg, msg_typo)
             
             msg_typo['charLength'] = len(msg_typo['bodyPlain'])
-            msg_typo['bodyBase64Plain'] = base64.urlsafe_b64encode(
-                msg_typo['bodyPlain'].encode()).decode()
             
             if no_errors:
                 self.__save_cor_msg(msg_typo)
                 response = TypoCode.successful
+                if key is not None:
+                    save_result(STAGE, key, {'corrections' : msg_typo['corrections'],
+                                             'index' : i})
             else:
                 response = TypoCode.typoFound
                 word = msg_typo['doc'][i].text
@@ -301,6 +325,29 @@ class TypoCorrector:
         return {'typoCode' : response.name, 'index' : i, 'typoError': word, 
                 'token_idx' : tok_idx, 'message' : msg_typo}
     
+    def correct_msgs(self, prep_msgs):
+        """
+        Corrects the given preprocessed messages from their first token (see
+        correct_msg). The bodies which have to be analysed are processed
+        together by the spaCy's model.
+
+        Parameters
+        ----------
+        prep_msgs : list
+            Preprocessed messages.
+
+        Returns
+        -------
+        list: result of each message (see stagebatch.run_batch), whose result
+        is the one of correct_msg.
+
+        """
+        docs = pipe_bodies(STAGE, self.__nlp, prep_msgs, lambda m: (
+            not(m.get('corrections')) and
+            not(has_result(STAGE, get_body_hash(m['bodyPlain'])))))
+        return run_batch(STAGE, lambda m: self.correct_msg(
+            m, 0, docs.get(m.get('bodyPlain'))), prep_msgs)
+    
     def save_oov(self, cor):
         """
         Saves the given token in the mongoDB.
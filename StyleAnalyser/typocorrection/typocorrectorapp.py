@@ -14,11 +14,16 @@ if not(os.getcwd() in sys.path):
 from flask import Flask, jsonify, request
 from typocorrection.typocorrector import TypoCorrector
 from initdb import init_db
+from pipelinelog import get_logger, init_logging, timed
+from stagebatch import to_stage_message
+from httpcompression import init_compression
 from confanalyser import NLP
 
 os.chdir(initial_dir)
 
 app = Flask(__name__)
+init_compression(app)
+log = get_logger('typocorrector')
 typocorrector = TypoCorrector(NLP)
 
 @app.route('/typocorrector/correct', methods=['POST'])
@@ -39,7 +44,29 @@ def correct_message():
         msg['id'] = msg['_id']
         del msg['_id']
         
-    return jsonify(typocorrector.correct_msg(msg, request.json['index']))
+    with timed(log, 'typo-correction', msg_id = msg.get('id'),
+               index = request.json['index']) as fields:
+        result = typocorrector.correct_msg(msg, request.json['index'])
+        fields['typoCode'] = result['typoCode']
+    return jsonify(result)
+
+@app.route('/typocorrector/batch', methods=['POST'])
+def correct_messages():
+    """
+    Checks the typographic errors of the list of preprocessed messages given
+    by the post method (from their first token).
+
+    Returns
+    -------
+    json: Dictionary in json format which has the result of each message in
+    'results' (see stagebatch.run_batch).
+
+    """
+    msgs = [to_stage_message(m) for m in request.json['messages']]
+    
+    with timed(log, 'typo-correction batch', size = len(msgs)):
+        results = typocorrector.correct_msgs(msgs)
+    return jsonify({'results' : results})
 
 @app.route('/typocorrector/saveoov', methods=['POST'])
 def save_oov():
@@ -57,4 +84,5 @@ def save_oov():
 
 if __name__ == '__main__':
     init_db()
+    init_logging('typocorrector')
     app.run(debug=True, port = 4000)
\ No newline at end of file